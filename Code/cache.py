@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import hashlib
+import importlib.util
+import pandas as pd
+
+from collections import deque
+
+# parquet engine, looked up without importing it
+HAS_PARQUET = importlib.util.find_spec( 'pyarrow' ) is not None
+
+
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+# most recent reads kept for cache_report
+MAX_TIMINGS = 10000
+
+READERS = {
+    'excel': pd.read_excel,
+    'csv'  : pd.read_csv,
+}
+
+# one record per cached_read call made in this process and, through map_files, its process pool
+# workers, see cache_report(). Only the last MAX_TIMINGS are kept, so long sessions do not grow it
+_timings = deque( maxlen = MAX_TIMINGS )
+
+
+def file_hash( path, blocksize = 1 << 20 ):
+
+    'SHA-1 of the contents of a file, read in blocks of 1 MB'
+
+    h = hashlib.sha1()
+    with open( path, 'rb' ) as f:
+        for block in iter( lambda: f.read( blocksize ), b'' ):
+            h.update( block )
+
+    return h.hexdigest()
+
+def _source_id( path, reader, kwargs ):
+
+    'Identifier of a source file read with a given reader and reader arguments'
+
+    spec = json.dumps( [ os.path.abspath( path ), reader, kwargs ], sort_keys = True, default = str )
+
+    return hashlib.sha1( spec.encode() ).hexdigest()
+
+def _load_json( path ):
+
+    try:
+        with open( path ) as f:
+            return json.load( f )
+    except ( OSError, ValueError ):
+        return None
+
+def _dump_json( obj, path ):
+
+    'Write json atomically so concurrent workers never see a partial file'
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open( tmp, 'w' ) as f:
+        json.dump( obj, f )
+    os.replace( tmp, path )
+
+def _remove( *paths ):
+
+    for path in paths:
+        try:
+            os.remove( path )
+        except OSError:
+            pass
+
+def _write_snapshot( df, base ):
+
+    '''
+    Write a dataframe snapshot next to base. Parquet is used when it round-trips
+    the frame with identical dtypes; sheets with mixed-type columns (common in the
+    raw Excel files) fall back to pickle.
+
+    Returns
+    --------
+
+      Path of the snapshot written.
+    '''
+
+    if HAS_PARQUET:
+        path = f'{base}.parquet'
+        try:
+            df.to_parquet( path )
+            back = pd.read_parquet( path )
+            if list( back.columns ) == list( df.columns ) and back.dtypes.equals( df.dtypes ):
+                return path
+        except ( ValueError, TypeError, NotImplementedError ):
+            pass
+        _remove( path )
+
+    path = f'{base}.pkl'
+    df.to_pickle( path )
+
+    return path
+
+def _read_snapshot( path ):
+
+    if path.endswith( '.parquet' ):
+        return pd.read_parquet( path )
+
+    return pd.read_pickle( path )
+
+def evict( cache_dir, max_bytes = MAX_CACHE_BYTES ):
+
+    '''
+    Delete least recently used snapshots until the cache holds at most max_bytes.
+
+    Parameters
+    ---------
+
+      cache_dir
+        Cache directory
+
+      max_bytes
+        Size cap of the snapshots in bytes
+
+    Returns
+    --------
+
+      Number of snapshots removed.
+    '''
+
+    entries = []
+    for name in os.listdir( cache_dir ):
+        if not name.startswith( 'src-' ):
+            continue
+        meta = _load_json( os.path.join( cache_dir, name ) )
+        if meta is None or not os.path.exists( meta['snapshot'] ):
+            continue
+        entries.append( ( os.path.getmtime( meta['snapshot'] ), meta['bytes'], name, meta['snapshot'] ) )
+
+    total   = sum( e[1] for e in entries )
+    removed = 0
+    for _, nbytes, name, snapshot in sorted( entries ):
+        if total <= max_bytes:
+            break
+        _remove( snapshot, os.path.join( cache_dir, name ) )
+        total   -= nbytes
+        removed += 1
+
+    return removed
+
+def cached_read( path, reader = 'excel', cache_dir = None, max_bytes = MAX_CACHE_BYTES, **kwargs ):
+
+    '''
+    Read an Excel/CSV file through a content-addressed columnar cache.
+    The snapshot key is built from path, size, mtime and the SHA-1 of the file
+    contents. The content hash is only recomputed when size or mtime change,
+    so a warm read costs one stat and one snapshot load.
+
+    Parameters
+    ---------
+
+      path
+        Source file
+
+      reader
+        'excel' (pd.read_excel) or 'csv' (pd.read_csv)
+
+      cache_dir
+        Directory with the snapshots. None reads the source file directly.
+
+      max_bytes
+        Size cap of the cache directory, least recently used snapshots are evicted
+
+      kwargs
+        Passed to the reader and part of the cache key
+
+    Returns
+    --------
+
+      Dataframe as returned by the reader.
+    '''
+
+    read  = READERS[reader]
+    start = time.perf_counter()
+
+    if cache_dir is None:
+        df = read( path, **kwargs )
+        _timings.append( { 'path': path, 'hit': False, 'seconds': time.perf_counter() - start,
+                           'parse_seconds': None } )
+        return df
+
+    os.makedirs( cache_dir, exist_ok = True )
+
+    st       = os.stat( path )
+    src_id   = _source_id( path, reader, kwargs )
+    src_meta = os.path.join( cache_dir, f'src-{src_id}.json' )
+    meta     = _load_json( src_meta )
+
+    if meta is not None and meta['size'] == st.st_size and meta['mtime_ns'] == st.st_mtime_ns \
+       and os.path.exists( meta['snapshot'] ):
+        try:
+            df = _read_snapshot( meta['snapshot'] )
+        except Exception:
+            df = None
+        if df is not None:
+            os.utime( meta['snapshot'] )
+            _timings.append( { 'path': path, 'hit': True, 'seconds': time.perf_counter() - start,
+                               'parse_seconds': meta['parse_seconds'] } )
+            return df
+
+    sha1 = file_hash( path )
+    key  = hashlib.sha1( f'{src_id}|{st.st_size}|{st.st_mtime_ns}|{sha1}'.encode() ).hexdigest()
+
+    parse_start = time.perf_counter()
+    df          = read( path, **kwargs )
+    parse_time  = time.perf_counter() - parse_start
+
+    # the source changed: drop the stale snapshot before writing the new one
+    if meta is not None and meta['key'] != key:
+        _remove( meta['snapshot'] )
+
+    snapshot = _write_snapshot( df, os.path.join( cache_dir, key ) )
+    _dump_json( { 'path'         : os.path.abspath( path ),
+                  'size'         : st.st_size,
+                  'mtime_ns'     : st.st_mtime_ns,
+                  'sha1'         : sha1,
+                  'key'          : key,
+                  'snapshot'     : snapshot,
+                  'bytes'        : os.path.getsize( snapshot ),
+                  'parse_seconds': parse_time }, src_meta )
+
+    evict( cache_dir, max_bytes )
+
+    _timings.append( { 'path': path, 'hit': False, 'seconds': time.perf_counter() - start,
+                       'parse_seconds': parse_time } )
+
+    return df
+
+def cached_read_excel( path, cache_dir = None, **kwargs ):
+
+    'pd.read_excel through the snapshot cache'
+
+    return cached_read( path, 'excel', cache_dir, **kwargs )
+
+def cached_read_csv( path, cache_dir = None, **kwargs ):
+
+    'pd.read_csv through the snapshot cache'
+
+    return cached_read( path, 'csv', cache_dir, **kwargs )
+
+def cache_report( reset = False ):
+
+    '''
+    Cold and warm read timings of the last MAX_TIMINGS files read in this process,
+    including those read by the process pool workers of map_files.
+
+    Parameters
+    ---------
+
+      reset
+        Clear the recorded timings after building the report
+
+    Returns
+    --------
+
+      Table with one row per read: path, hit (True = served from the cache),
+      seconds (wall time of the read) and parse_seconds (cold parse time of
+      the source, stored with the snapshot) and speedup (parse_seconds/seconds).
+    '''
+
+    df = pd.DataFrame( list( _timings ), columns = [ 'path', 'hit', 'seconds', 'parse_seconds' ] )
+    df['speedup'] = df['parse_seconds'] / df['seconds']
+
+    if reset:
+        _timings.clear()
+
+    return df
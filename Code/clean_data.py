@@ -1,19 +1,11 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 
-import seaborn as sns
-import scipy.stats as stats
-import datetime
+from .instrument import instrumented, log
 
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.preprocessing import StandardScaler
-from scipy.stats import pearsonr
 
-
-def clean_data(df,crit_data,crit_label,crit_name, crit_number,date_name, index_qc):
+@instrumented
+def clean_data(df,crit_data,crit_label,crit_name, crit_number,date_name, index_qc, headless = False, return_diagnostics = False):
     
     'input is the merged data tables for either rainfall / discharge. output is qcd dataframe based on climate criterias used for plotting'
     '''
@@ -42,72 +34,101 @@ def clean_data(df,crit_data,crit_label,crit_name, crit_number,date_name, index_q
         
       index_qc
         Index of interest data
+        
+      headless
+        Do not print the selected stations or plot the trend and residual
+        
+      return_diagnostics
+        Also return the diagnostics dictionary (see clean_diagnostics)
     
     Returns
     --------
       
       Detrended data based on criterias
+      Diagnostics, if return_diagnostics
     
     '''
     
-    temp_df = df
-
-    #display( temp_df )
     df_select  = crit_data[(crit_data[crit_name] == crit_number) ]
-    #print(df_select)
     df_name    = list(df_select[crit_label])
-    print(df_name)
-    print()
-    print(f'n={len(df_name)}')
+    if not headless:
+        log( f'{df_name}\n\nn={len(df_name)}', stations = df_name, n = len(df_name) )
     
     # Mean of the data that meet criteria
-    df_mean         = pd.DataFrame( temp_df[df_name].mean(axis=1) )
-    df_mean.columns = ['data_mean']
-    df_mean['date'] = temp_df[date_name]
-    df_mean = df_mean.dropna().reset_index( drop=True )
+    data_mean = df[df_name].mean(axis=1).to_numpy( dtype = float )[:, None]
+    data_mean[pd.isna( df[date_name] ).to_numpy()] = np.nan
+    
+    _check_positive( data_mean, df[date_name], [ crit_number ], crit_name )
+    
+    steps       = detrend_deseason( data_mean )
+    diagnostics = clean_diagnostics( steps, 0, df[date_name], df_name )
+    
+    if not headless:
+        from .plot_data import trend_plot, residual_plot
+        trend_plot( diagnostics )
+        residual_plot( diagnostics )
+    
+    df_final = _merge_index( _steps_frame( steps, 0, df[date_name] ), index_qc )
     
-    # log scale of mean values
-    df_mean['data_log']    = pd.DataFrame( (np.log10(df_mean['data_mean'])) )
+    if return_diagnostics:
+        return df_final, diagnostics
     
-    # scale data 
-    scaler = StandardScaler()
-    df_mean['data_scaled']      = scaler.fit_transform( df_mean['data_log'].values.reshape(-1,1) )
+    return df_final
 
+def _check_positive( means, dates, groups, crit_name ):
     
-    # detrend mean values  using fit and substract 
-    X = [i for i in range( 0, len(df_mean['data_log']) ) ]
-    X = np.reshape( X, (len(X), 1) )
-    y = df_mean['data_scaled'].values
-    pf = PolynomialFeatures(degree=3)
-    Xp = pf.fit_transform(X)
+    '''
+    Raise if a group mean is zero or negative: it has no log, and the cleaning would 
+    silently turn the whole group to NaN (StandardScaler raised on it).
+    '''
+    
+    bad = ~np.isnan( means ) & ( means <= 0 )
+    if bad.any():
+        dates  = pd.Series( dates ).to_numpy()
+        detail = [ f'{crit_name} {g}: {int( bad[:, j].sum() )} months, first {pd.Timestamp( dates[bad[:, j].argmax()] ).date()}'
+                   for j, g in enumerate( groups ) if bad[:, j].any() ]
+        raise ValueError( f'Group means of zero or less have no log: {"; ".join( detail )}. '
+                          'Set those values to NaN in the input.' )
+
+def clean_diagnostics( steps, g, dates, stations ):
     
-    model = LinearRegression()
-    model.fit(X, y)
+    '''
+    Diagnostics of the cleaning of group g, as data.
+    
+    Returns
+    --------
+      
+      Dictionary with stations (selected station names), n (number of stations), date, 
+      data_scaled, trend (polynomial trend) and residual (data_scaled - trend) over the 
+      rows kept by the dropna of the group mean
+    '''
     
-    md2 = LinearRegression()
-    md2.fit(Xp, y)
+    valid = steps['valid'][:, g]
     
-    trend = model.predict(X)
-    trendp = md2.predict(Xp)
+    return { 'stations'   : list( stations ),
+             'n'          : len( stations ),
+             'date'       : dates.to_numpy()[valid],
+             'data_scaled': steps['data_scaled'][valid, g],
+             'trend'      : steps['trend'][valid, g],
+             'residual'   : steps['data_detrend_P'][valid, g] }
+
+def _steps_frame( steps, g, dates ):
     
-    plt.plot(y)
-    plt.plot(trendp)
-    plt.ylabel('Scaled Data')
-    plt.title('Polynomial Trend')
-    plt.show()
+    'Table of the cleaning steps of group g, rows kept by the dropna of the group mean'
     
-    df_mean['data_detrend_P'] = [y[i] - trendp[i] for i in range(0, len(df_mean['data_log']) )]
+    valid = steps['valid'][:, g]
     
-    plt.plot(df_mean['data_detrend_P'])
-    plt.ylabel('Scaled Data')
-    plt.title('Residual:Trend substracted from data')
-    plt.show()
+    df_mean = pd.DataFrame( {'data_mean': steps['data_mean'][valid, g]} )
+    df_mean['date'] = dates.to_numpy()[valid]
+    for col in ['data_log','data_scaled','data_detrend_P','data_deseason','data_deseason12']:
+        df_mean[col] = steps[col][valid, g]
+        
+    return df_mean
+
+def _merge_index( df_mean, index_qc ):
     
-    # REMOVE SEASONALITY 
-    df_mean['data_deseason'] = df_mean['data_detrend_P'].rolling(window=6, center=True).mean()[3:-3]
-    df_mean['data_deseason12'] = df_mean['data_detrend_P'].rolling(window=12, center=True).mean()[6:-6]
+    'Merge the cleaned data with the index (ENSO 3.4 rel) data and add the month column'
     
-    # merge with ENSO 3.4arel index 
     df_final = df_mean.merge(index_qc, how = 'outer', on = 'date', validate = '1:1' )
     df_final = df_final.sort_values( 'date' ).reset_index(drop=True)
     df_final = df_final.dropna().reset_index(drop=True)
@@ -115,4 +136,226 @@ def clean_data(df,crit_data,crit_label,crit_name, crit_number,date_name, index_q
     
     #df_final.to_csv(f'../discharge/Data/Images/Nov18/{crit_name}_{crit_number}_{crit_label}', encoding='utf-8', index=False)
     
-    return df_final
\ No newline at end of file
+    return df_final
+
+def _compact( values, valid ):
+    
+    '''
+    Move the valid rows of every column to the top, keeping their order.
+    
+    Returns
+    --------
+      
+      Compacted values (NaN below the valid rows), the row order used and the number of valid rows per column
+    '''
+    
+    order = np.argsort( ~valid, axis = 0, kind = 'stable' )
+    
+    return np.take_along_axis( np.where( valid, values, np.nan ), order, axis = 0 ), order, valid.sum( axis = 0 )
+
+def _rolling_mean( compact, n, window ):
+    
+    '''
+    Centred rolling mean along the rows of compacted columns, with the ends cut as in
+    Series.rolling(window, center=True).mean()[window//2:-(window//2)]
+    '''
+    
+    half  = window // 2
+    rows  = np.arange( compact.shape[0] )[:, None]
+    csum  = np.vstack( [ np.zeros( ( 1, compact.shape[1] ) ), np.cumsum( np.nan_to_num( compact ), axis = 0 ) ] )
+    
+    lower = np.clip( rows - half, 0, compact.shape[0] )
+    upper = np.clip( rows - half + window, 0, compact.shape[0] )
+    mean  = ( np.take_along_axis( csum, np.broadcast_to( upper, compact.shape ), axis = 0 ) - 
+              np.take_along_axis( csum, np.broadcast_to( lower, compact.shape ), axis = 0 ) ) / window
+    
+    keep  = ( rows >= half ) & ( rows <= n - 1 - half ) & ( rows - half + window <= n )
+    
+    return np.where( keep, mean, np.nan )
+
+@instrumented
+def detrend_deseason( data_mean, degree = 3, windows = ( 6, 12 ) ):
+    
+    '''
+    Log, scale, polynomial detrend and rolling-mean deseason every column of a 
+    dates-by-series matrix at once. Each column is cleaned as clean_data does for one
+    criteria group: rows with a missing mean are dropped, the fit uses the positions of
+    the remaining rows and the rolling means run over the remaining rows.
+    
+    Parameters
+    ---------
+      
+      data_mean
+        Array (dates x series) of monthly means, NaN where missing
+        
+      degree
+        Degree of the polynomial trend
+        
+      windows
+        Rolling mean windows, stored as data_deseason (first) and data_deseason12 (second)
+    
+    Returns
+    --------
+      
+      Dictionary of arrays (dates x series): valid, data_mean, data_log, data_scaled, trend, 
+      data_detrend_P, data_deseason, data_deseason12. Rows that are not valid are NaN.
+    '''
+    
+    data_mean = np.asarray( data_mean, dtype = float )
+    valid     = ~np.isnan( data_mean )
+    n         = valid.sum( axis = 0 )
+    
+    with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+        
+        # log scale of mean values
+        data_log = np.where( valid, np.log10( np.where( valid, data_mean, 1 ) ), np.nan )
+        
+        # scale data (as sklearn StandardScaler)
+        mu    = np.nanmean( data_log, axis = 0 )
+        sigma = np.nanstd( data_log, axis = 0 )
+        sigma[~( sigma > 0 )] = 1
+        data_scaled = ( data_log - mu ) / sigma
+        
+        # detrend using a least squares polynomial over the positions of the valid rows. 
+        # Positions are mapped onto [-1, 1] and fitted in the Legendre basis, which spans 
+        # the same polynomials as 1, x, x^2, x^3 but keeps the normal equations well conditioned
+        pos = np.cumsum( valid, axis = 0 ) - 1
+        x   = 2 * pos / np.maximum( n - 1, 1 ) - 1
+        V   = np.polynomial.legendre.legvander( x, degree ) * valid[..., None]
+        y0  = np.where( valid, data_scaled, 0 )
+        
+        A     = np.einsum( 'tgi,tgj->gij', V, V )
+        b     = np.einsum( 'tgi,tg->gi', V, y0 )
+        coef  = np.einsum( 'gij,gj->gi', np.linalg.pinv( A ), b )
+        trend = np.where( valid, np.einsum( 'tgi,gi->tg', V, coef ), np.nan )
+        
+        data_detrend = data_scaled - trend
+        
+        # remove seasonality with centred rolling means over the valid rows
+        compact, order, n = _compact( data_detrend, valid )
+        rows  = np.arange( len( data_mean ) )[:, None]
+        steps = {}
+        for name, window in zip( ['data_deseason', 'data_deseason12'], windows ):
+            rolled = _rolling_mean( compact, n, window )
+            out    = np.full( data_mean.shape, np.nan )
+            np.put_along_axis( out, order, np.where( rows < n, rolled, np.nan ), axis = 0 )
+            steps[name] = out
+    
+    steps.update( { 'valid'         : valid,
+                    'data_mean'     : np.where( valid, data_mean, np.nan ),
+                    'data_log'      : data_log,
+                    'data_scaled'   : data_scaled,
+                    'trend'         : trend,
+                    'data_detrend_P': data_detrend } )
+    
+    return steps
+
+@instrumented
+def group_means( df, crit_data, crit_label, crit_name, crit_numbers = None ):
+    
+    '''
+    Mean of the stations in every criteria group, for all groups at once.
+    
+    Parameters
+    ---------
+      
+      df
+        Merged dataset as monthly means
+      
+      crit_data
+        File with Climate Types 
+    
+      crit_label
+        River = River Discharge; Rainfall = Station Name
+        
+      crit_name
+        Climate Type or CPE
+        
+      crit_numbers
+        Categories of Climate type or CPE. None uses every category in crit_data, sorted.
+    
+    Returns
+    --------
+      
+      Array (dates x groups) of group means
+      List of the group categories
+      List with the station names of every group
+    '''
+    
+    if crit_numbers is None:
+        crit_numbers = sorted( crit_data[crit_name].dropna().unique() )
+    crit_numbers = list( crit_numbers )
+    
+    names   = [ list( crit_data.loc[crit_data[crit_name] == c, crit_label] ) for c in crit_numbers ]
+    columns = list( dict.fromkeys( n for group in names for n in group ) )
+    
+    # stations x groups membership counts (a station listed twice counts twice, as in df[names].mean)
+    member  = np.zeros( ( len( columns ), len( crit_numbers ) ) )
+    col_pos = { c: i for i, c in enumerate( columns ) }
+    for g, group in enumerate( names ):
+        np.add.at( member[:, g], [ col_pos[n] for n in group ], 1 )
+    
+    values  = df[columns].to_numpy( dtype = float )
+    present = ~np.isnan( values )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        means = ( np.where( present, values, 0 ) @ member ) / ( present @ member )
+    
+    return means, crit_numbers, names
+
+@instrumented
+def clean_data_groups( df, crit_data, crit_label, crit_name, date_name, index_qc, crit_numbers = None, 
+                       return_diagnostics = False ):
+    
+    '''
+    clean_data for every criteria group in one call. The group means, scaling, 
+    polynomial detrending and deseasoning are computed for all groups together
+    (see detrend_deseason), nothing is printed or plotted.
+    
+    Parameters
+    ---------
+      
+      df
+        Merged dataset as monthly means
+      
+      crit_data
+        File with Climate Types 
+    
+      crit_label
+        River = River Discharge; Rainfall = Station Name
+        
+      crit_name
+        Climate Type or CPE
+        
+      date_name
+        Column Name of date
+        
+      index_qc
+        Index of interest data
+        
+      crit_numbers
+        Categories of Climate type or CPE. None uses every category in crit_data.
+        
+      return_diagnostics
+        Also return the diagnostics of every category (see clean_diagnostics)
+    
+    Returns
+    --------
+      
+      Dictionary of detrended data by criteria category, each as returned by clean_data
+      Dictionary of diagnostics by criteria category, if return_diagnostics
+    '''
+    
+    means, crit_numbers, names = group_means( df, crit_data, crit_label, crit_name, crit_numbers )
+    means[pd.isna( df[date_name] ).to_numpy()] = np.nan
+    _check_positive( means, df[date_name], crit_numbers, crit_name )
+    
+    steps = detrend_deseason( means )
+    
+    cleaned = { c: _merge_index( _steps_frame( steps, g, df[date_name] ), index_qc ) 
+                for g, c in enumerate( crit_numbers ) }
+    
+    if return_diagnostics:
+        return cleaned, { c: clean_diagnostics( steps, g, df[date_name], names[g] ) 
+                          for g, c in enumerate( crit_numbers ) }
+    
+    return cleaned
@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import inspect
+import argparse
+import traceback
+
+from .instrument import configure, add_hook, jsonl_sink, log
+
+
+# exit codes for schedulers
+EXIT_OK       = 0
+EXIT_FAILED   = 1    # a stage or an export raised
+EXIT_CONFIG   = 2    # bad command line or config file
+EXIT_STALE    = 3    # status: some stages would be recomputed
+EXIT_INTERRUPT= 130
+
+# config keys of the run itself; every other key is an enso_stages argument
+RUN_KEYS = { 'store_dir', 'targets', 'force', 'folders', 'outputs', 'output_store', 'hist_daily',
+             'verbose', 'trace_memory', 'events' }
+
+# exportable stage outputs and their date columns
+OUTPUT_DATES = { 'rain': 'Date', 'discharge': 'Year' }
+
+# cleaned criteria groups of every exportable output, written next to its csv as
+# <output>_clean.csv (the CLEAN_COLUMN step, one column per group)
+OUTPUT_CLEAN = { 'rain': 'clean_rain', 'discharge': 'clean_dis' }
+CLEAN_COLUMN = 'data_deseason12'
+
+
+class ConfigError( Exception ):
+
+    'Invalid config file or command line'
+
+
+def read_config( filename ):
+
+    '''
+    Read a run config: JSON, or YAML (.yaml / .yml) when PyYAML is installed.
+
+    Example (JSON):
+
+      {
+        "files_folder"     : "Data/Files",
+        "modern_folder"    : "Modern/",
+        "hess_folder"      : "HESS/",
+        "historical_folder": "Historical/",
+        "hist_rename"      : {"iloilo": "mod_hist_iloilo"},
+        "hess_drop_list"   : ["historical_Maragayap", "hess_maragayap"],
+        "cache_dir"        : "Data/Cache",
+        "n_jobs"           : 4,
+        "folders"          : ["Data/Files", "Data/Figures"],
+        "outputs"          : {"rain": "Data/Files/output_rainfall.csv", "discharge": "Data/Files/output_discharge.csv"},
+        "output_store"     : true,
+        "hist_daily"       : {"filename": "Data/Requests/hist_daily.xlsx", "mode": "columnar"},
+        "events"           : "Data/Pipeline/events.jsonl"
+      }
+
+    Parameters
+    ---------
+
+      filename
+        Config file
+
+    Returns
+    --------
+
+      Dictionary of settings
+    '''
+
+    if not os.path.isfile( filename ):
+        raise ConfigError( f'Config file not found: {filename}' )
+
+    with open( filename ) as f:
+        text = f.read()
+
+    if filename.lower().endswith( ( '.yaml', '.yml' ) ):
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError( f'{filename}: reading YAML configs needs PyYAML, or use a JSON config' )
+        try:
+            config = yaml.safe_load( text ) or {}
+        except yaml.YAMLError as e:
+            raise ConfigError( f'{filename}: {e}' )
+    else:
+        try:
+            config = json.loads( text )
+        except ValueError as e:
+            raise ConfigError( f'{filename}: {e}' )
+
+    if not isinstance( config, dict ):
+        raise ConfigError( f'{filename}: the config must be a mapping of settings' )
+
+    return config
+
+def split_config( config ):
+
+    '''
+    Split a config into enso_stages arguments and run settings, rejecting unknown keys.
+
+    Returns
+    --------
+
+      Dictionary of enso_stages keyword arguments, dictionary of run settings
+    '''
+
+    from .pipeline import enso_stages
+
+    stage_keys = set( inspect.signature( enso_stages ).parameters )
+    unknown    = sorted( k for k in config if k not in stage_keys | RUN_KEYS )
+    if unknown:
+        raise ConfigError( f'Unknown config keys: {unknown}' )
+
+    return { k: v for k, v in config.items() if k in stage_keys }, { k: v for k, v in config.items() if k in RUN_KEYS }
+
+def export_outputs( stage_outputs, settings ):
+
+    '''
+    Write the run's exports: output csvs (and output stores) of the merged tables and
+    of their cleaned criteria groups (<output>_clean.csv), and the daily historical
+    discharge.
+
+    Returns
+    --------
+
+      List of files written
+    '''
+
+    from .enso         import clean_to_wide
+    from .output_store import write_output_store
+    from .prepare_data import dump_inst_hist_dis
+
+    written = []
+
+    for what, filename in ( settings.get( 'outputs' ) or {} ).items():
+        os.makedirs( os.path.dirname( filename ) or '.', exist_ok = True )
+        base    = os.path.splitext( filename )[0]
+        tables  = [ ( filename, stage_outputs[what], OUTPUT_DATES[what] ),
+                    ( f'{base}_clean.csv', clean_to_wide( stage_outputs[OUTPUT_CLEAN[what]], CLEAN_COLUMN ), 'date' ) ]
+        for name, df, date_name in tables:
+            df.to_csv( name, encoding = 'utf-8', index = False )
+            written.append( name )
+            if settings.get( 'output_store' ):
+                folder = os.path.splitext( name )[0]
+                write_output_store( df, folder, date_name )
+                written.append( folder )
+
+    if settings.get( 'hist_daily' ):
+        written += dump_inst_hist_dis( stage_outputs['hist_dis_dict'], **settings['hist_daily'] )
+
+    return written
+
+def _targets( settings ):
+
+    'Stages the run needs: the requested targets, the clean stages and the inputs of the exports'
+
+    outputs = settings.get( 'outputs' ) or {}
+    unknown = [ what for what in outputs if what not in OUTPUT_DATES ]
+    if unknown:
+        raise ConfigError( f'outputs: unknown tables {unknown}, expected {list( OUTPUT_DATES )}' )
+
+    targets = list( settings.get( 'targets' ) or [] ) + list( outputs )
+    if settings.get( 'hist_daily' ):
+        targets.append( 'hist_dis_dict' )
+    if not targets:
+        return None
+
+    return list( dict.fromkeys( targets + list( OUTPUT_CLEAN.values() ) ) )
+
+def run( config_file, overrides = None, status = False ):
+
+    '''
+    Run the ENSO.ipynb chain (load, prepare, merge, clean, export) from a config file.
+
+    Parameters
+    ---------
+
+      config_file
+        JSON or YAML config (see read_config)
+
+      overrides
+        Settings replacing those of the config file (command line options)
+
+      status
+        Only report the stages that would be recomputed
+
+    Returns
+    --------
+
+      Exit code
+    '''
+
+    from .pipeline import enso_stages, run_pipeline, stale_stages, stage_keys
+    from .prep     import create_folders
+
+    config = read_config( config_file )
+    config.update( { k: v for k, v in ( overrides or {} ).items() if v is not None } )
+    stage_args, settings = split_config( config )
+
+    configure( verbose = settings.get( 'verbose' ), trace_memory = settings.get( 'trace_memory' ) )
+    if settings.get( 'events' ):
+        add_hook( jsonl_sink( settings['events'] ) )
+
+    stages    = enso_stages( **stage_args )
+    targets   = _targets( settings )
+    store_dir = settings.get( 'store_dir', 'Data/Pipeline' )
+
+    unknown = [ t for t in ( targets or [] ) + list( settings.get( 'force' ) or [] ) if t not in stages ]
+    if unknown:
+        raise ConfigError( f'Unknown stages: {unknown}. Stages: {sorted( stages )}' )
+
+    # a missing input folder would otherwise load as an empty table
+    missing = sorted( { f for name in stage_keys( stages, targets ) for f in stages[name]['files'] if not os.path.exists( f ) } )
+    if missing:
+        raise ConfigError( f'Missing inputs: {missing}' )
+
+    if status:
+        stale = stale_stages( stages, store_dir, targets )
+        for name in stale:
+            print( name )
+        return EXIT_STALE if stale else EXIT_OK
+
+    for folder in settings.get( 'folders' ) or []:
+        create_folders( folder )
+
+    outputs = run_pipeline( stages, targets, store_dir, force = settings.get( 'force' ) or () )
+    written = export_outputs( outputs, settings )
+    log( f'Run finished: {len( outputs )} stages, {len( written )} exports', files = written )
+
+    return EXIT_OK
+
+def parse_args( argv = None ):
+
+    parser = argparse.ArgumentParser( prog = 'python -m Code', description = 'Headless ENSO discharge / rainfall pipeline' )
+    sub    = parser.add_subparsers( dest = 'command', required = True )
+
+    for name, help in [ ( 'run', 'run the pipeline and its exports' ),
+                        ( 'status', 'list the stages a run would recompute (exit 3 if any)' ) ]:
+        p = sub.add_parser( name, help = help )
+        p.add_argument( 'config', help = 'JSON or YAML config file' )
+        p.add_argument( '--targets', nargs = '+', help = 'stages to compute (default: all, or those the exports need)' )
+        p.add_argument( '--store-dir', help = 'directory of the stored stage outputs' )
+        if name == 'run':
+            p.add_argument( '--force', nargs = '+', help = 'stages to recompute even if up to date' )
+            p.add_argument( '--n-jobs', type = int, help = 'workers of the loaders' )
+            p.add_argument( '--backend', choices = [ 'process', 'thread' ], help = 'worker pool' )
+            p.add_argument( '--cache-dir', help = 'snapshot cache of the Excel / csv readers' )
+            p.add_argument( '--verbose', type = int, help = '0 silent, 1 stages, 2 files / years' )
+            p.add_argument( '--events', help = 'append instrumentation events to this JSON lines file' )
+
+    return parser.parse_args( argv )
+
+def main( argv = None ):
+
+    '''
+    Command line entry point: python -m Code run config.yaml
+
+    Returns
+    --------
+
+      Exit code: 0 done, 1 a stage or export failed, 2 bad config or arguments,
+      3 (status) stages out of date, 130 interrupted
+    '''
+
+    os.environ.setdefault( 'MPLBACKEND', 'Agg' )
+
+    try:
+        args = parse_args( argv )
+    except SystemExit as e:
+        return EXIT_CONFIG if e.code else EXIT_OK
+
+    overrides = { k: v for k, v in vars( args ).items() if k not in ( 'command', 'config' ) }
+
+    try:
+        return run( args.config, overrides, status = args.command == 'status' )
+    except ConfigError as e:
+        print( f'error: {e}', file = sys.stderr )
+        return EXIT_CONFIG
+    except KeyboardInterrupt:
+        print( 'interrupted', file = sys.stderr )
+        return EXIT_INTERRUPT
+    except Exception:
+        traceback.print_exc()
+        return EXIT_FAILED
@@ -0,0 +1,173 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented
+
+
+MONTHS = np.arange( 1, 13 )
+
+# statistics of every station and month, in the order of the last axis of the cube
+STATS = [ 'count', 'mean', 'std', 'min', 'q1', 'median', 'q3', 'max', 'whislo', 'whishi', 'cilo', 'cihi' ]
+
+
+def _month_cube( values, month ):
+
+    '''
+    Stations x 12 x years array of a dates x stations table: the values of every
+    month of the year side by side on the last axis, NaN padded.
+    '''
+
+    order = np.argsort( month, kind = 'stable' )
+    m     = month[order]
+    start = np.searchsorted( m, MONTHS )
+    slot  = np.arange( len( m ) ) - start[m - 1]
+    width = int( slot.max() ) + 1 if len( m ) else 1
+
+    cube = np.full( ( values.shape[1], 12, width ), np.nan )
+    cube[:, m - 1, slot] = values[order].T
+
+    return cube
+
+@instrumented
+def climatology_cube( df, date_name = 'date', whis = 1.0, quantiles = (), autorange = True ):
+
+    '''
+    Month of year statistics of every station (or cleaned group) in one vectorised
+    pass. The box plot statistics follow matplotlib's boxplot (whis, autorange,
+    notches at median -/+ 1.57 IQR / sqrt(n)), so plots can draw them with ax.bxp.
+
+    Parameters
+    ---------
+
+      df
+        Wide table with a date column and one column per station, e.g. output_rainfall.csv
+        or clean_to_wide( cleaned, 'data_mean' )
+
+      date_name
+        Column Name of date
+
+      whis
+        Whisker reach in IQRs beyond the quartiles (boxplot whis; True is 1.0)
+
+      quantiles
+        Extra quantiles (0-1) stored as statistics q<percent>, e.g. 0.1 -> q10
+
+      autorange
+        As in boxplot: whiskers at min / max where the IQR is 0
+
+    Returns
+    --------
+
+      Dictionary with stations, months, stats (names along the last axis), values
+      (stations x 12 x stats array), fliers (table of station, month, value outside
+      the whiskers) and date_name
+    '''
+
+    stations = [ c for c in df.columns if c not in ( date_name, 'month' ) ]
+    dates    = pd.DatetimeIndex( df[date_name] )
+    values   = df[stations].to_numpy( dtype = float )[~dates.isna()]
+    cube     = _month_cube( values, dates[~dates.isna()].month.to_numpy( dtype = int ) )
+    extra    = [ f'q{100 * q:g}' for q in quantiles ]
+
+    with warnings.catch_warnings(), np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        warnings.simplefilter( 'ignore', RuntimeWarning )
+
+        count = ( ~np.isnan( cube ) ).sum( axis = -1 ).astype( float )
+        q1, median, q3 = np.nanpercentile( cube, [ 25, 50, 75 ], axis = -1 )
+        qs    = np.nanpercentile( cube, [ 100 * q for q in quantiles ], axis = -1 ) if quantiles else []
+        vmin  = np.nanmin( cube, axis = -1 )
+        vmax  = np.nanmax( cube, axis = -1 )
+        iqr   = q3 - q1
+
+        lo = np.where( ( iqr == 0 ) & autorange, vmin, q1 - float( whis ) * iqr )
+        hi = np.where( ( iqr == 0 ) & autorange, vmax, q3 + float( whis ) * iqr )
+
+        whishi = np.nanmax( np.where( cube <= hi[..., None], cube, np.nan ), axis = -1 )
+        whislo = np.nanmin( np.where( cube >= lo[..., None], cube, np.nan ), axis = -1 )
+        whishi = np.where( np.isnan( whishi ) | ( whishi < q3 ), q3, whishi )
+        whislo = np.where( np.isnan( whislo ) | ( whislo > q1 ), q1, whislo )
+
+        notch  = 1.57 * iqr / np.sqrt( count )
+
+        values = np.stack( [ count, np.nanmean( cube, axis = -1 ), np.nanstd( cube, axis = -1, ddof = 1 ), vmin,
+                             q1, median, q3, vmax, whislo, whishi, median - notch, median + notch, *qs ], axis = -1 )
+
+    outside = ( cube < whislo[..., None] ) | ( cube > whishi[..., None] )
+    s, m, _ = np.nonzero( outside )
+
+    return { 'stations' : stations,
+             'months'   : MONTHS,
+             'stats'    : STATS + extra,
+             'values'   : values,
+             'fliers'   : pd.DataFrame( { 'station': np.asarray( stations, dtype = object )[s],
+                                          'month'  : MONTHS[m],
+                                          'value'  : cube[outside] } ),
+             'date_name': date_name }
+
+def cube_stat( cube, stat = 'mean' ):
+
+    'One statistic of a climatology cube as a table of months (rows) by stations'
+
+    return pd.DataFrame( cube['values'][:, :, cube['stats'].index( stat )].T,
+                         index = pd.Index( cube['months'], name = 'month' ), columns = cube['stations'] )
+
+def bxp_stats( cube, station ):
+
+    '''
+    Box plot statistics of one station, by month, as the list of dictionaries ax.bxp takes.
+    '''
+
+    k    = cube['stations'].index( station )
+    pick = { name: cube['values'][k, :, i] for i, name in enumerate( cube['stats'] ) }
+    fl   = cube['fliers']
+    fl   = fl[fl['station'] == station]
+
+    return [ { 'label' : int( m ),
+               'mean'  : pick['mean'][j],
+               'med'   : pick['median'][j],
+               'q1'    : pick['q1'][j],
+               'q3'    : pick['q3'][j],
+               'iqr'   : pick['q3'][j] - pick['q1'][j],
+               'cilo'  : pick['cilo'][j],
+               'cihi'  : pick['cihi'][j],
+               'whislo': pick['whislo'][j],
+               'whishi': pick['whishi'][j],
+               'fliers': fl.loc[fl['month'] == m, 'value'].to_numpy() }
+             for j, m in enumerate( cube['months'] ) ]
+
+def monthly_anomaly( df, cube, stat = 'mean', date_name = None ):
+
+    '''
+    Departure of every value from its station's month of year climatology.
+
+    Parameters
+    ---------
+
+      df
+        Wide table with the date column and station columns of the cube
+
+      cube
+        climatology_cube output
+
+      stat
+        Climatology subtracted (mean or median)
+
+      date_name
+        Column Name of date, default the cube's
+
+    Returns
+    --------
+
+      Table like df with the anomalies
+    '''
+
+    date_name = date_name or cube['date_name']
+    stations  = [ s for s in cube['stations'] if s in df.columns ]
+    month     = pd.DatetimeIndex( df[date_name] ).month.to_numpy()
+    clim      = cube_stat( cube, stat )[stations].to_numpy()
+
+    out = df.copy()
+    out[stations] = df[stations].to_numpy( dtype = float ) - clim[month - 1]
+
+    return out
@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented, log
+
+
+# prefixed columns of the rainfall csvs that are not stations (hist_year, mid_month, ...)
+HELPER_COLUMNS = ( 'year', 'month', 'day' )
+
+
+def station_name( column, prefix, aliases = None ):
+
+    '''
+    Station name of a prefixed column as merge_dis_data and ENSO.ipynb match them: the
+    first word after the prefix, lower case (historical_Mambusao_River -> mambusao),
+    then mapped through aliases (spelling variants, e.g. {'cotobato': 'cotabato'}).
+    '''
+
+    name = str( column )[len( prefix ):].split( '_' )[0].lower()
+
+    return ( aliases or {} ).get( name, name )
+
+def _source_table( df, prefix, date_name, aliases = None ):
+
+    'Dates, values and station names (see station_name) of one source'
+
+    cols = [ c for c in df.columns if c != date_name and str( c ).lower().startswith( prefix.lower() )
+             and str( c )[len( prefix ):].lower() not in HELPER_COLUMNS ]
+    stations = [ station_name( c, prefix, aliases ) for c in cols ]
+
+    twice = sorted( { s for s in stations if stations.count( s ) > 1 } )
+    if twice:
+        raise ValueError( f'Columns of source {prefix!r} with the same station name: '
+                          f'{[ c for c, s in zip( cols, stations ) if s in twice ]}, map them apart with aliases' )
+
+    return pd.DatetimeIndex( df[date_name] ), df[cols].to_numpy( dtype = float ), stations
+
+def _precedence( stations, sources, precedence ):
+
+    '''
+    Stations x sources array of source numbers in order of preference, -1 padded
+    where a station leaves sources out.
+    '''
+
+    order = np.tile( np.arange( len( sources ) ), ( len( stations ), 1 ) )
+
+    for station, srcs in ( precedence or {} ).items():
+        if station not in stations:
+            continue
+        unknown = [ s for s in srcs if s not in sources ]
+        if unknown:
+            raise KeyError( f'Precedence of {station}: unknown sources {unknown}' )
+        row = [ sources.index( s ) for s in srcs ]
+        order[stations.index( station )] = row + [ -1 ] * ( len( sources ) - len( row ) )
+
+    return order
+
+@instrumented
+def coalesce_sources( sources, precedence = None, date_name = 'Date', prefixes = None, aliases = None ):
+
+    '''
+    Coalesce N sources of the same stations (modern, historical, mid century, HESS)
+    in one vectorised pass: every value comes from the first source, in the station's
+    order of precedence, that has it. Which source that was is kept as a bit-packed
+    provenance array.
+
+    Parameters
+    ---------
+
+      sources
+        Dictionary of source name -> wide table (date column and one column per
+        station), in the default order of precedence, e.g.
+        {'mod': df_rain_mod, 'hist': df_rain_hist, 'mid': df_rain_mid}
+
+      precedence
+        Dictionary of station -> list of source names overriding the default order.
+        Sources left out are not used for that station (replaces the drop lists).
+
+      date_name
+        Column Name of date in every source
+
+      prefixes
+        Dictionary of source name -> column prefix, default '<source>_'. Station names
+        are the first word after the prefix, lower case (see station_name), so
+        mod_iloilo, hist_iloilo and mid_iloilo are one station iloilo, and
+        hess_mambusao and historical_Mambusao_River one station mambusao.
+
+      aliases
+        Dictionary of station name -> name it is merged under, for spelling variants
+        between sources, e.g. {'cotobato': 'cotabato'}
+
+    Returns
+    --------
+
+      Dictionary with
+        merged    : wide table with the date column and one column per station
+        dates, stations, sources, date_name
+        directory : station name -> row of the provenance arrays
+        chosen    : source of every value, as bits planes of the code (0 missing, k + 1
+                    source k) packed along dates: array (bits x stations x date bytes)
+        available : sources x stations x date bytes, packed mask of the values each source has
+        single    : stations found in one source only (not coalesced with any other)
+    '''
+
+    names  = list( sources )
+    tables = { s: _source_table( df, ( prefixes or {} ).get( s, f'{s}_' ), date_name, aliases ) for s, df in sources.items() }
+
+    dates    = pd.DatetimeIndex( np.unique( np.concatenate( [ t[0].to_numpy() for t in tables.values() ] ) ) )
+    stations = list( dict.fromkeys( st for t in tables.values() for st in t[2] ) )
+    pos      = { st: j for j, st in enumerate( stations ) }
+
+    # sources x dates x stations, plus an empty source for the -1 padding of the precedence
+    stack = np.full( ( len( names ) + 1, len( dates ), len( stations ) ), np.nan )
+    for k, s in enumerate( names ):
+        d, values, cols = tables[s]
+        stack[k][np.ix_( dates.get_indexer( d ), [ pos[c] for c in cols ] )] = values
+
+    order   = _precedence( stations, names, precedence )
+    columns = np.arange( len( stations ) )
+    ranked  = stack[order.T[:, None, :], np.arange( len( dates ) )[None, :, None], columns[None, None, :]]
+
+    valid  = ~np.isnan( ranked )
+    first  = valid.argmax( axis = 0 )
+    merged = np.take_along_axis( ranked, first[None], axis = 0 )[0]
+    code   = np.where( valid.any( axis = 0 ), order[columns, first] + 1, 0 )
+
+    bits   = max( len( names ).bit_length(), 1 )
+    planes = ( code.T[None] >> np.arange( bits )[:, None, None] ) & 1
+
+    df = pd.DataFrame( merged, columns = stations )
+    df.insert( 0, date_name, dates )
+
+    count  = sum( np.isin( stations, t[2] ) for t in tables.values() )
+    single = [ st for st, c in zip( stations, count ) if c == 1 ]
+    if single and len( names ) > 1:
+        log( f'Stations in one source only: {single}', level = 2, stations = single )
+
+    return { 'merged'   : df,
+             'dates'    : dates,
+             'stations' : stations,
+             'directory': pos,
+             'sources'  : names,
+             'date_name': date_name,
+             'chosen'   : np.packbits( planes.astype( bool ), axis = -1 ),
+             'available': np.packbits( ~np.isnan( stack[:-1] ).transpose( 0, 2, 1 ), axis = -1 ),
+             'single'   : single }
+
+def _names( result, stations ):
+
+    'Station name or list of names, None for all stations of a coalesce_sources result'
+
+    if stations is None:
+        return result['stations']
+
+    return [ stations ] if isinstance( stations, str ) else list( stations )
+
+def provenance_codes( result, stations = None ):
+
+    '''
+    Source codes (0 missing, k + 1 source k) of some stations, unpacking only their rows.
+
+    Returns
+    --------
+
+      Array (dates x stations) of uint8 codes
+    '''
+
+    names = _names( result, stations )
+    rows  = [ result['directory'][s] for s in names ]
+    bits  = np.unpackbits( result['chosen'][:, rows, :], axis = -1, count = len( result['dates'] ) )
+
+    return ( bits << np.arange( len( bits ), dtype = np.uint8 )[:, None, None] ).sum( axis = 0, dtype = np.uint8 ).T
+
+def provenance( result, stations = None ):
+
+    '''
+    Source of every merged value as a wide table of categoricals (NaN where missing).
+
+    Parameters
+    ---------
+
+      result
+        coalesce_sources output
+
+      stations
+        Station name or list of names, None for all
+    '''
+
+    codes = provenance_codes( result, stations )
+    names = _names( result, stations )
+
+    df = pd.DataFrame( { s: pd.Categorical.from_codes( codes[:, j].astype( int ) - 1, categories = result['sources'] )
+                         for j, s in enumerate( names ) } )
+    df.insert( 0, result['date_name'], result['dates'] )
+
+    return df
+
+def provenance_counts( result ):
+
+    'Number of merged values taken from every source: table of stations x sources'
+
+    codes  = provenance_codes( result )
+    counts = ( codes[:, :, None] == np.arange( 1, len( result['sources'] ) + 1 ) ).sum( axis = 0 )
+
+    return pd.DataFrame( counts, index = pd.Index( result['stations'], name = 'station' ), columns = result['sources'] )
+
+def availability( result, source, stations = None ):
+
+    'Dates x stations mask of the values source has, whether or not they were chosen'
+
+    names = _names( result, stations )
+    rows  = [ result['directory'][s] for s in names ]
+    mask  = np.unpackbits( result['available'][result['sources'].index( source ), rows, :], axis = -1,
+                           count = len( result['dates'] ) )
+
+    return mask.T.astype( bool )
@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented
+
+
+def _code_dtype( n ):
+
+    'Smallest signed integer type holding codes 0..n-1'
+
+    for dtype in ( np.int8, np.int16, np.int32 ):
+        if n <= np.iinfo( dtype ).max:
+            return dtype
+
+    return np.int64
+
+def _empty( stations, dates, date_name, dtype ):
+
+    return { 'date_name': date_name,
+             'stations' : np.asarray( stations, dtype = object ),
+             'dates'    : np.asarray( dates ),
+             'station'  : np.zeros( 0, _code_dtype( len( stations ) ) ),
+             'date'     : np.zeros( 0, _code_dtype( len( dates ) ) ),
+             'value'    : np.zeros( 0, dtype ),
+             'offsets'  : np.zeros( len( stations ) + 1, np.int64 ),
+             'valid'    : np.packbits( np.zeros( ( len( dates ), len( stations ) ), bool ), axis = None ) }
+
+def _records( values, valid, dtype ):
+
+    'Codes and values of the valid cells of a dates x stations block, station by station'
+
+    date, station = np.nonzero( valid.T )[::-1]
+
+    return station, date, values.T[valid.T].astype( dtype )
+
+@instrumented
+def to_compact( df, date_name = 'Date', dtype = np.float64 ):
+
+    '''
+    Compact store of a wide table (one date column and one column per station, NaN
+    where missing): one record per non-missing value with categorical station and
+    date codes, grouped by station.
+
+    Parameters
+    ---------
+
+      df
+        Wide table, e.g. output_discharge.csv (date_name = 'Year') or output_rainfall.csv (date_name = 'Date')
+
+      date_name
+        Column Name of date
+
+      dtype
+        Value type. The default float64 round trips bit exact; np.float32 halves the
+        values but keeps only ~7 significant digits (lossy, opt in).
+
+    Returns
+    --------
+
+      Dictionary with
+        stations : station names in column order (the station categories)
+        dates    : the date column, row by row (the date categories)
+        station, date, value : one entry per non-missing value
+        offsets  : records of station k are offsets[k]:offsets[k+1]
+        valid    : dates x stations validity mask packed 8 cells per byte
+    '''
+
+    stations = [ c for c in df.columns if c != date_name ]
+    values   = df[stations].to_numpy( dtype = float )
+    valid    = ~np.isnan( values )
+
+    store = _empty( stations, df[date_name].to_numpy(), date_name, dtype )
+    station, date, value = _records( values, valid, dtype )
+
+    store['station'] = station.astype( store['station'].dtype )
+    store['date']    = date.astype( store['date'].dtype )
+    store['value']   = value
+    store['offsets'] = np.concatenate( [ [0], np.cumsum( valid.sum( axis = 0 ) ) ] )
+    store['valid']   = np.packbits( valid, axis = None )
+
+    return store
+
+@instrumented
+def read_compact_csv( filename, date_name = 'Date', dtype = np.float64, chunksize = 100_000 ):
+
+    '''
+    Compact store of a wide csv (output_discharge.csv, output_rainfall.csv) read in
+    chunks, so the float64 wide table is never held in memory at once.
+
+    Parameters
+    ---------
+
+      filename
+        Wide csv with a date column and one column per station
+
+      date_name
+        Column Name of date
+
+      dtype
+        Value type of the store, float64 (lossless) by default, np.float32 to opt in to a lossy, smaller store
+
+      chunksize
+        Rows read per chunk
+
+    Returns
+    --------
+
+      Compact store (see to_compact)
+    '''
+
+    dates, stations, valids, recs = [], None, [], []
+    n_rows = 0
+
+    for chunk in pd.read_csv( filename, chunksize = chunksize, parse_dates = [ date_name ] ):
+        if stations is None:
+            stations = [ c for c in chunk.columns if c != date_name ]
+        values = chunk[stations].to_numpy( dtype = dtype )
+        valid  = ~np.isnan( values )
+        station, date, value = _records( values, valid, dtype )
+
+        dates.append( chunk[date_name].to_numpy() )
+        valids.append( valid )
+        recs.append( ( station, date + n_rows, value ) )
+        n_rows += len( chunk )
+
+    if stations is None:
+        header = pd.read_csv( filename, nrows = 0 )
+        return _empty( [ c for c in header.columns if c != date_name ], np.zeros( 0, 'datetime64[ns]' ), date_name, dtype )
+
+    store   = _empty( stations, np.concatenate( dates ), date_name, dtype )
+    station = np.concatenate( [ r[0] for r in recs ] )
+    order   = np.argsort( station, kind = 'stable' )
+    valid   = np.vstack( valids )
+
+    store['station'] = station[order].astype( store['station'].dtype )
+    store['date']    = np.concatenate( [ r[1] for r in recs ] )[order].astype( store['date'].dtype )
+    store['value']   = np.concatenate( [ r[2] for r in recs ] )[order]
+    store['offsets'] = np.concatenate( [ [0], np.cumsum( valid.sum( axis = 0 ) ) ] )
+    store['valid']   = np.packbits( valid, axis = None )
+
+    return store
+
+def valid_mask( store ):
+
+    'Unpacked dates x stations validity mask of a compact store'
+
+    shape = ( len( store['dates'] ), len( store['stations'] ) )
+
+    return np.unpackbits( store['valid'], count = shape[0] * shape[1] ).reshape( shape ).astype( bool )
+
+@instrumented
+def to_wide( store, stations = None, dtype = np.float64 ):
+
+    '''
+    Wide table of a compact store, in the layout it was built from: the date column
+    first, then one column per station in the original order, NaN where missing.
+
+    Parameters
+    ---------
+
+      store
+        Compact store (see to_compact)
+
+      stations
+        Subset of station names to unpack, None for all
+
+      dtype
+        Value type of the station columns
+
+    Returns
+    --------
+
+      Wide table
+    '''
+
+    names = list( store['stations'] ) if stations is None else list( stations )
+    pos   = { s: k for k, s in enumerate( store['stations'] ) }
+    out   = np.full( ( len( store['dates'] ), len( names ) ), np.nan, dtype = dtype )
+
+    for j, name in enumerate( names ):
+        k = pos[name]
+        a, b = store['offsets'][k], store['offsets'][k + 1]
+        out[store['date'][a:b], j] = store['value'][a:b]
+
+    df = pd.DataFrame( out, columns = names )
+    df.insert( 0, store['date_name'], store['dates'] )
+
+    return df
+
+def to_long( store, stations = None ):
+
+    '''
+    Long table of a compact store with categorical station ids.
+
+    Parameters
+    ---------
+
+      store
+        Compact store (see to_compact)
+
+      stations
+        Subset of station names, None for all
+
+    Returns
+    --------
+
+      Table with station (categorical), date and value, one row per non-missing value, grouped by station
+    '''
+
+    if stations is None:
+        sel = slice( None )
+    else:
+        pos = { s: k for k, s in enumerate( store['stations'] ) }
+        sel = np.concatenate( [ np.arange( store['offsets'][pos[s]], store['offsets'][pos[s] + 1] ) for s in stations ]
+                              or [ np.zeros( 0, int ) ] )
+
+    return pd.DataFrame( {
+        'station': pd.Categorical.from_codes( store['station'][sel], categories = store['stations'] ),
+        'date'   : store['dates'][store['date'][sel]],
+        'value'  : store['value'][sel],
+    } )
+
+def nbytes( store ):
+
+    'Memory used by the arrays of a compact store, station names excluded'
+
+    return sum( v.nbytes for k, v in store.items() if isinstance( v, np.ndarray ) and k != 'stations' )
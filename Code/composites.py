@@ -0,0 +1,152 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .enso       import clean_to_wide, monthly_values
+from .instrument import instrumented, log
+
+
+def event_onsets( events, event = 1 ):
+
+    '''
+    Onset months of the episodes of one kind.
+
+    Parameters
+    ---------
+
+      events
+        enso_events output
+
+      event
+        1 for El Nino, -1 for La Nina
+
+    Returns
+    --------
+
+      DatetimeIndex of the first month of every episode
+    '''
+
+    ev = events[( events['episode'] > 0 ) & ( events['event'] == event )]
+
+    return pd.DatetimeIndex( ev.groupby( 'episode' )['date'].min().to_numpy() )
+
+def epoch_windows( x, rows, before, after ):
+
+    '''
+    Windows of rows - before .. rows + after of every column of x, cut from one
+    strided view of the NaN padded array (no copy until the onsets are picked).
+
+    Parameters
+    ---------
+
+      x
+        Array (months x stations) on a gap free monthly calendar
+
+      rows
+        Onset rows; may lie outside x as long as the window overlaps it
+
+      before, after
+        Months kept before and after the onset
+
+    Returns
+    --------
+
+      Array (onsets x stations x lags)
+    '''
+
+    pad    = before + after
+    padded = np.concatenate( [ np.full( ( pad, x.shape[1] ), np.nan ), x, np.full( ( pad, x.shape[1] ), np.nan ) ] )
+    view   = sliding_window_view( padded, before + after + 1, axis = 0 )
+
+    return view[np.asarray( rows, dtype = int ) - before + pad]
+
+@instrumented
+def superposed_epoch( data, onsets, before = 12, after = 24, date_name = 'date', column = None ):
+
+    '''
+    Superposed epoch composites: every station's series cut around every event onset
+    and averaged lag by lag.
+
+    Parameters
+    ---------
+
+      data
+        Dictionary of cleaned tables by climate type (clean_data_groups output), one
+        clean_data output table, or a wide table with one column per station
+        (output_discharge.csv with date_name = 'Year', output_rainfall.csv, ...)
+
+      onsets
+        Onset dates (any day of the month), e.g. event_onsets( enso_events(...) )
+
+      before, after
+        Months kept before and after the onset: lags -before .. +after
+
+      date_name
+        Column Name of date
+
+      column
+        Series composited. Cleaned tables (dictionary or one clean_data table, told
+        apart from wide tables by its data_scaled column): the name of the cleaning
+        step (default data_deseason12); wide tables: a station column or a list of
+        them (default all)
+
+    Returns
+    --------
+
+      Dictionary with lags, stations, onsets (onset months used), windows (onsets x
+      stations x lags array) and the per lag arrays (stations x lags) mean, std
+      (across onsets), count (onsets with data) and sem
+    '''
+
+    cleaned = isinstance( data, dict ) or 'data_scaled' in data.columns
+    if cleaned and column is not None and not isinstance( column, str ):
+        raise ValueError( f'column must be the name of one cleaning step for cleaned tables, got {column!r}' )
+
+    if isinstance( data, dict ):
+        data     = clean_to_wide( data, column or 'data_deseason12', date_name )
+        stations = [ c for c in data.columns if c != date_name ]
+    elif cleaned:
+        # one clean_data table: its cleaning steps are not stations, one step is composited
+        stations = [ column or 'data_deseason12' ]
+    elif column is None:
+        stations = [ c for c in data.columns if c != date_name ]
+    else:
+        stations = [ column ] if isinstance( column, str ) else list( column )
+
+    months, x = monthly_values( data, date_name, stations )
+
+    onset = pd.DatetimeIndex( pd.to_datetime( list( onsets ) ) ).to_period( 'M' ).unique().sort_values()
+    rows  = onset.asi8 - months[0].ordinal
+    keep  = ( rows >= -after ) & ( rows <= len( months ) - 1 + before )
+    if ( ~keep ).any():
+        log( f'Superposed epoch: {int( ( ~keep ).sum() )} onsets without data in their window dropped', level = 2 )
+
+    windows = epoch_windows( x, rows[keep], before, after )
+    count   = ( ~np.isnan( windows ) ).sum( axis = 0 )
+
+    with warnings.catch_warnings(), np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        warnings.simplefilter( 'ignore', RuntimeWarning )
+        mean = np.nanmean( windows, axis = 0 )
+        std  = np.nanstd( windows, axis = 0, ddof = 1 )
+        sem  = std / np.sqrt( count )
+
+    return { 'lags'    : np.arange( -before, after + 1 ),
+             'stations': stations,
+             'onsets'  : onset[keep].to_timestamp(),
+             'windows' : windows,
+             'mean'    : mean,
+             'std'     : std,
+             'count'   : count,
+             'sem'     : sem }
+
+def composite_table( composite ):
+
+    'Tidy table of a superposed_epoch composite: station, lag, mean, std, count and sem'
+
+    S, L = composite['mean'].shape
+
+    return pd.DataFrame( { 'station': np.repeat( composite['stations'], L ),
+                           'lag'    : np.tile( composite['lags'], S ),
+                           **{ k: composite[k].ravel() for k in [ 'mean', 'std', 'count', 'sem' ] } } )
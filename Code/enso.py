@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented
+
+
+INDEX_COLUMN = 'ssta (°C)'
+
+
+def clean_to_wide( cleaned, column = 'data_deseason12', date_name = 'date' ):
+
+    '''
+    One column of the cleaned data of every criteria group as a wide table.
+
+    Parameters
+    ---------
+
+      cleaned
+        Dictionary of cleaned tables by criteria category (clean_data_groups output)
+
+      column
+        Cleaning step to keep (data_scaled, data_detrend_P, data_deseason, data_deseason12, ...)
+
+      date_name
+        Column Name of date in the cleaned tables
+
+    Returns
+    --------
+
+      Table with the date column and one column per criteria category
+    '''
+
+    series = [ df.set_index( date_name )[column].rename( c ) for c, df in cleaned.items() ]
+
+    return pd.concat( series, axis = 1 ).sort_index().rename_axis( date_name ).reset_index()
+
+def monthly_matrix( df, index_qc, date_name = 'date', index_column = INDEX_COLUMN ):
+
+    '''
+    Stations and index on one gap free monthly calendar, so a lag of k months is a
+    shift of k rows.
+
+    Parameters
+    ---------
+
+      df
+        Wide table with a date column and one column per station or criteria group
+
+      index_qc
+        Index data (prep_index_data output, dates in column date)
+
+      date_name
+        Column Name of date in df
+
+      index_column
+        Column of index_qc with the index values
+
+    Returns
+    --------
+
+      Monthly dates, array (months x stations) of station values, array (months) of index values, station names
+    '''
+
+    stations = [ c for c in df.columns if c != date_name ]
+    x_dates  = pd.to_datetime( df[date_name] ).dt.to_period( 'M' )
+    y_dates  = pd.to_datetime( index_qc['date'] ).dt.to_period( 'M' )
+    months   = pd.period_range( min( x_dates.min(), y_dates.min() ), max( x_dates.max(), y_dates.max() ), freq = 'M' )
+
+    _, x = monthly_values( df, date_name, stations, months )
+    y = pd.Series( index_qc[index_column].to_numpy( dtype = float ), index = y_dates ).groupby( level = 0 ).mean()
+
+    return months.to_timestamp(), x, y.reindex( months ).to_numpy(), stations
+
+def monthly_values( df, date_name, stations, months = None ):
+
+    '''
+    Station columns of a wide table as an array on a gap free monthly calendar
+    (values in the same month averaged).
+
+    Returns
+    --------
+
+      Monthly calendar (PeriodIndex, from the first to the last date of df unless
+      months is given) and array (months x stations), NaN where missing
+    '''
+
+    dates = pd.to_datetime( df[date_name] ).dt.to_period( 'M' )
+    x     = pd.DataFrame( df[stations].to_numpy( dtype = float ), index = dates ).groupby( level = 0 ).mean()
+
+    if months is None:
+        months = pd.period_range( dates.min(), dates.max(), freq = 'M' )
+
+    return months, x.reindex( months ).to_numpy()
+
+def shifted( y, lags ):
+
+    'Columns y(t - lag) for every lag, NaN where shifted outside the series'
+
+    out = np.full( ( len( y ), len( lags ) ), np.nan )
+    for j, lag in enumerate( lags ):
+        if lag >= 0:
+            out[lag:, j] = y[:len( y ) - lag]
+        else:
+            out[:lag, j] = y[-lag:]
+
+    return out
+
+def pearson_columns( x, Y ):
+
+    '''
+    Pearson correlation of every column of x with every column of Y over the rows
+    where both are present (pairwise complete), with six matrix products.
+
+    Parameters
+    ---------
+
+      x
+        Array (months x stations), NaN where missing
+
+      Y
+        Array (months x k), NaN where missing
+
+    Returns
+    --------
+
+      Arrays (stations x k) of correlations and of the number of months used
+    '''
+
+    mx, my = ~np.isnan( x ), ~np.isnan( Y )
+    x0, y0 = np.where( mx, x, 0 ), np.where( my, Y, 0 )
+
+    # centre first, Pearson does not depend on it but the sums of squares stay well conditioned
+    x0 = np.where( mx, x0 - x0.sum( axis = 0 ) / np.maximum( mx.sum( axis = 0 ), 1 ), 0 )
+    y0 = np.where( my, y0 - y0.sum() / max( my.sum(), 1 ), 0 )
+    mx, my = mx.astype( float ), my.astype( float )
+
+    n   = mx.T @ my
+    sx  = x0.T @ my
+    sy  = mx.T @ y0
+    sxx = ( x0 * x0 ).T @ my
+    syy = mx.T @ ( y0 * y0 )
+    sxy = x0.T @ y0
+
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        cov = n * sxy - sx * sy
+        var = ( n * sxx - sx * sx ) * ( n * syy - sy * sy )
+        r   = np.clip( cov / np.sqrt( var ), -1, 1 )
+    r[~( var > 0 )] = np.nan
+
+    return r, n.astype( int )
+
+def lagged_pearson( x, y, lags ):
+
+    '''
+    Pearson correlation of every column of x with y(t - lag) for every lag, for all
+    stations and lags at once (see pearson_columns).
+
+    Parameters
+    ---------
+
+      x
+        Array (months x stations), NaN where missing
+
+      y
+        Array (months) of index values, NaN where missing
+
+      lags
+        Lags in months. Positive lags correlate the stations with the index lag months earlier (index leads).
+
+    Returns
+    --------
+
+      Arrays (stations x lags) of correlations and of the number of months used
+    '''
+
+    return pearson_columns( np.asarray( x, dtype = float ), shifted( np.asarray( y, dtype = float ), list( lags ) ) )
+
+@instrumented
+def lag_correlation( df, index_qc, lags = range( -24, 25 ), date_name = 'date', index_column = INDEX_COLUMN,
+                     min_periods = 24 ):
+
+    '''
+    Pearson correlation between every station (or criteria group) and the Nino 3.4
+    index at every lag.
+
+    Parameters
+    ---------
+
+      df
+        Wide table with a date column and one column per station, e.g. clean_to_wide
+        output or output_discharge.csv (date_name = 'Year')
+
+      index_qc
+        Index data (prep_index_data output)
+
+      lags
+        Lags in months. Positive lags: the index leads the station by lag months.
+
+      date_name
+        Column Name of date in df
+
+      index_column
+        Column of index_qc with the index values
+
+      min_periods
+        Fewest overlapping months for a correlation, NaN below
+
+    Returns
+    --------
+
+      Tidy table with station, lag, r and n (months used), one row per station and lag
+    '''
+
+    lags = list( lags )
+    _, x, y, stations = monthly_matrix( df, index_qc, date_name, index_column )
+    r, n = lagged_pearson( x, y, lags )
+    r[n < min_periods] = np.nan
+
+    return pd.DataFrame( { 'station': np.repeat( stations, len( lags ) ),
+                           'lag'    : np.tile( lags, len( stations ) ),
+                           'r'      : r.ravel(),
+                           'n'      : n.ravel() } )
+
+def peak_lag( df_corr ):
+
+    '''
+    Lag of the strongest (largest absolute) correlation of every station.
+
+    Parameters
+    ---------
+
+      df_corr
+        lag_correlation output
+
+    Returns
+    --------
+
+      Table with one row per station: station, lag, r and n at the peak
+    '''
+
+    df_corr = df_corr.dropna( subset = [ 'r' ] )
+    best    = df_corr['r'].abs().groupby( df_corr['station'], sort = False ).idxmax()
+
+    return df_corr.loc[best.to_numpy()].reset_index( drop = True )
@@ -0,0 +1,286 @@
+import os
+import json
+import shutil
+import warnings
+import numpy as np
+import pandas as pd
+
+from .clean_data import detrend_deseason
+from .enso       import INDEX_COLUMN, shifted, pearson_columns
+from .instrument import instrumented, log
+
+
+GRID_VERSION = 1
+
+# maps written by gridded_enso_maps: file -> dtype, with a lag axis or not
+MAPS = { 'r'       : ( np.float32, True ),
+         'n'       : ( np.int32, True ),
+         'peak_r'  : ( np.float32, False ),
+         'peak_lag': ( np.float32, False ),
+         'trend'   : ( np.float32, False ),
+         'months'  : ( np.int32, False ) }
+
+
+def create_grid( folder, dates, shape, dtype = np.float32, lat = None, lon = None ):
+
+    '''
+    Create an empty gridded rainfall store to be filled chunk by chunk: values.npy
+    (cells x dates, so the series of every cell is one contiguous row, as in the
+    output stores), dates.npy and meta.json.
+
+    Parameters
+    ---------
+
+      folder
+        Store folder, e.g. Data/Files/grid_rain
+
+      dates
+        Monthly dates of the grid
+
+      shape
+        Spatial shape of the grid, (ny, nx) or (cells,)
+
+      dtype
+        Value type on disk
+
+      lat, lon
+        Optional coordinates of the rows (ny) and columns (nx) of the grid
+
+    Returns
+    --------
+
+      Writable memory-mapped array (cells x dates), NaN filled
+    '''
+
+    shape = tuple( int( s ) for s in np.atleast_1d( shape ) )
+    dates = pd.to_datetime( pd.Series( dates ) ).to_numpy( dtype = 'datetime64[ns]' )
+    if np.isnat( dates ).any():
+        raise ValueError( f'Grid {folder}: missing dates' )
+
+    os.makedirs( folder, exist_ok = True )
+    np.save( os.path.join( folder, 'dates.npy' ), dates )
+    for name, values in ( ( 'lat', lat ), ( 'lon', lon ) ):
+        if values is not None:
+            np.save( os.path.join( folder, f'{name}.npy' ), np.asarray( values, dtype = float ) )
+    with open( os.path.join( folder, 'meta.json' ), 'w' ) as f:
+        json.dump( { 'version': GRID_VERSION,
+                     'shape'  : list( shape ),
+                     'dtype'  : np.dtype( dtype ).name,
+                     'cells'  : int( np.prod( shape ) ),
+                     'dates'  : len( dates ) }, f, indent = 1 )
+
+    values = np.lib.format.open_memmap( os.path.join( folder, 'values.npy' ), mode = 'w+', dtype = dtype,
+                                        shape = ( int( np.prod( shape ) ), len( dates ) ) )
+    values[:] = np.nan
+
+    return values
+
+def open_grid( folder, mode = 'r' ):
+
+    '''
+    Open a gridded rainfall store without reading its values.
+
+    Returns
+    --------
+
+      Dictionary with meta (meta.json), values (memory-mapped cells x dates array),
+      dates, shape (spatial shape) and lat / lon when stored
+    '''
+
+    with open( os.path.join( folder, 'meta.json' ) ) as f:
+        meta = json.load( f )
+
+    grid = { 'meta'  : meta,
+             'values': np.load( os.path.join( folder, 'values.npy' ), mmap_mode = mode ),
+             'dates' : pd.DatetimeIndex( np.load( os.path.join( folder, 'dates.npy' ) ) ),
+             'shape' : tuple( meta['shape'] ) }
+    for name in ( 'lat', 'lon' ):
+        if os.path.exists( os.path.join( folder, f'{name}.npy' ) ):
+            grid[name] = np.load( os.path.join( folder, f'{name}.npy' ) )
+
+    return grid
+
+def _calendar( dates, index_qc, index_column ):
+
+    '''
+    Gap free monthly calendar of the grid and the index, the row of every grid date
+    on it and the index values on it.
+    '''
+
+    g_dates = dates.to_period( 'M' )
+    y_dates = pd.to_datetime( index_qc['date'] ).dt.to_period( 'M' )
+    months  = pd.period_range( min( g_dates.min(), y_dates.min() ), max( g_dates.max(), y_dates.max() ), freq = 'M' )
+    y       = pd.Series( index_qc[index_column].to_numpy( dtype = float ), index = y_dates ).groupby( level = 0 ).mean()
+
+    if g_dates.has_duplicates:
+        raise ValueError( 'Grid dates must be monthly, one per month' )
+
+    return months, months.get_indexer( g_dates ), y.reindex( months ).to_numpy()
+
+def _chunk_maps( block, rows, Y, n_months, lags, column, degree, windows, min_periods ):
+
+    '''
+    Cleaning chain and lagged correlations of one chunk of cells (dates x cells).
+
+    Returns
+    --------
+
+      Dictionary of the maps of the chunk (cells first), as in MAPS
+    '''
+
+    # dry (0 mm) months have no log, they are left out as the loaders mask them (qc.DRY)
+    block = np.where( block > 0, block, np.nan )
+
+    # cells without data (sea, outside the product) are all NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter( 'ignore', RuntimeWarning )
+        steps = detrend_deseason( block, degree, windows )
+
+    x       = np.full( ( n_months, block.shape[1] ), np.nan )
+    x[rows] = steps[column]
+    r, n    = pearson_columns( x, Y )
+    r[n < min_periods] = np.nan
+
+    has  = ~np.isnan( r ).all( axis = 1 )
+    best = np.argmax( np.where( np.isnan( r ), -1, np.abs( r ) ), axis = 1 )
+
+    # change of the fitted polynomial trend over the record, in standard deviations of the log rainfall
+    valid = steps['valid']
+    first = valid.argmax( axis = 0 )
+    last  = len( valid ) - 1 - valid[::-1].argmax( axis = 0 )
+    cols  = np.arange( block.shape[1] )
+    trend = steps['trend'][last, cols] - steps['trend'][first, cols]
+
+    return { 'r'       : r,
+             'n'       : n,
+             'peak_r'  : np.where( has, r[cols, best], np.nan ),
+             'peak_lag': np.where( has, np.asarray( lags, dtype = float )[best], np.nan ),
+             'trend'   : np.where( valid.any( axis = 0 ), trend, np.nan ),
+             'months'  : valid.sum( axis = 0 ) }
+
+@instrumented
+def gridded_enso_maps( grid_folder, index_qc, folder, lags = range( -24, 25 ), chunk = 1024,
+                       column = 'data_deseason12', index_column = INDEX_COLUMN, degree = 3,
+                       windows = ( 6, 12 ), min_periods = 24 ):
+
+    '''
+    Per-cell ENSO maps of a gridded rainfall product. The grid is read from its
+    memory-mapped store chunk cells at a time, every chunk goes through the clean_data
+    chain vectorised across its cells (log, scaling, polynomial detrending and rolling
+    deseasoning, see detrend_deseason) and is correlated with the index at every lag.
+    The maps are written to memory-mapped files as the chunks finish, so neither the
+    cube nor the maps are held in memory. The folder is replaced atomically.
+
+    Parameters
+    ---------
+
+      grid_folder
+        Gridded rainfall store (see create_grid), monthly totals. Months of 0 mm or
+        less are left out, as they have no log.
+
+      index_qc
+        Index data (prep_index_data output)
+
+      folder
+        Output folder of the maps, e.g. Data/Files/grid_enso
+
+      lags
+        Lags in months. Positive lags: the index leads the rainfall by lag months.
+
+      chunk
+        Cells per chunk. Memory grows with chunk x dates.
+
+      column
+        Cleaning step correlated with the index (data_scaled, data_detrend_P,
+        data_deseason, data_deseason12)
+
+      index_column
+        Column of index_qc with the index values
+
+      degree, windows
+        Polynomial degree and deseasoning windows of detrend_deseason
+
+      min_periods
+        Fewest overlapping months for a correlation, NaN below
+
+    Returns
+    --------
+
+      Dictionary of the maps (see open_maps)
+    '''
+
+    grid   = open_grid( grid_folder )
+    values = grid['values']
+    lags   = list( lags )
+    cells  = values.shape[0]
+
+    months, rows, y = _calendar( grid['dates'], index_qc, index_column )
+    Y = shifted( y, lags )
+
+    tmp = f'{folder.rstrip( os.sep )}.{os.getpid()}.tmp'
+    shutil.rmtree( tmp, ignore_errors = True )
+    os.makedirs( tmp )
+
+    maps = {}
+    for name, ( dtype, lagged ) in MAPS.items():
+        shape = grid['shape'] + ( ( len( lags ), ) if lagged else () )
+        maps[name] = np.lib.format.open_memmap( os.path.join( tmp, f'{name}.npy' ), mode = 'w+', dtype = dtype, shape = shape )
+
+    flat = { name: m.reshape( ( cells, -1 ) if MAPS[name][1] else cells ) for name, m in maps.items() }
+
+    for start in range( 0, cells, chunk ):
+        stop  = min( start + chunk, cells )
+        block = np.asarray( values[start:stop], dtype = float ).T
+        for name, out in _chunk_maps( block, rows, Y, len( months ), lags, column, degree, windows, min_periods ).items():
+            flat[name][start:stop] = out
+        log( f'Grid cells {start}-{stop} of {cells}', level = 2 )
+
+    for m in maps.values():
+        m.flush()
+    del maps, flat
+
+    with open( os.path.join( tmp, 'meta.json' ), 'w' ) as f:
+        json.dump( { 'version'     : GRID_VERSION,
+                     'grid'        : os.path.abspath( grid_folder ),
+                     'shape'       : list( grid['shape'] ),
+                     'lags'        : lags,
+                     'column'      : column,
+                     'index_column': index_column,
+                     'degree'      : degree,
+                     'windows'     : list( windows ),
+                     'min_periods' : min_periods,
+                     'first'       : str( grid['dates'].min().date() ),
+                     'last'        : str( grid['dates'].max().date() ) }, f, indent = 1 )
+
+    old = f'{folder.rstrip( os.sep )}.{os.getpid()}.old'
+    if os.path.exists( folder ):
+        os.replace( folder, old )
+    os.replace( tmp, folder )
+    shutil.rmtree( old, ignore_errors = True )
+
+    return open_maps( folder )
+
+def open_maps( folder ):
+
+    '''
+    Open the maps written by gridded_enso_maps without reading them.
+
+    Returns
+    --------
+
+      Dictionary with meta (meta.json) and one memory-mapped array per map:
+        r, n      : correlation and months used at every lag (grid shape x lags)
+        peak_r    : strongest (largest absolute) correlation over the lags
+        peak_lag  : its lag, NaN where no lag has min_periods months
+        trend     : change of the fitted polynomial trend from the first to the last
+                    month, in standard deviations of the log rainfall
+        months    : months of every cell used by the cleaning (positive rainfall)
+    '''
+
+    with open( os.path.join( folder, 'meta.json' ) ) as f:
+        maps = { 'meta': json.load( f ) }
+
+    for name in MAPS:
+        maps[name] = np.load( os.path.join( folder, f'{name}.npy' ), mmap_mode = 'r' )
+
+    return maps
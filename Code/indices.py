@@ -0,0 +1,227 @@
+import os
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented, log
+
+
+# missing value codes of the NOAA / BoM index files
+INDEX_NA_VALUES = [ -99.9, -99.99, -999, -999.9, -9999 ]
+
+EVENT_NAMES = { 1: 'El Nino', -1: 'La Nina' }
+
+
+def index_dates( column ):
+
+    '''
+    Month start dates of an index time column, inferred from its values instead of
+    an assumed calendar.
+
+    Parameters
+    ---------
+
+      column
+        Decimal years (1854.042 mid month or 1854.0 month start), yyyymm integers
+        or date strings (1854-01, 1854-01-15, ...)
+
+    Returns
+    --------
+
+      DatetimeIndex of month starts
+    '''
+
+    values = pd.Series( column ).reset_index( drop = True )
+
+    if pd.api.types.is_numeric_dtype( values ):
+        v = values.to_numpy( dtype = float )
+        if np.nanmin( v ) > 10000:
+            year, month = v // 100, v % 100
+        else:
+            # month start (k/12) and mid month ((k + 0.5)/12) fractions both land in month k + 1
+            year  = np.floor( v )
+            month = np.floor( ( v - year ) * 12 + 0.25 ) + 1
+        dates = pd.to_datetime( { 'year': year, 'month': month, 'day': np.ones( len( v ) ) }, errors = 'coerce' )
+    else:
+        dates = pd.to_datetime( values.astype( str ).str.strip(), errors = 'coerce' )
+
+    return pd.DatetimeIndex( dates ).to_period( 'M' ).to_timestamp()
+
+def read_index( filename, na_values = INDEX_NA_VALUES ):
+
+    '''
+    Read one monthly climate index file.
+
+    Parameters
+    ---------
+
+      filename
+        csv with a time column (see index_dates) and a value column, or a year column
+        followed by twelve monthly columns (NOAA PSL / BoM layout)
+
+      na_values
+        Missing value codes
+
+    Returns
+    --------
+
+      Series of index values by month start date, sorted
+    '''
+
+    df = pd.read_csv( filename, na_values = na_values )
+
+    if df.shape[1] >= 13:
+        year   = df.iloc[:, 0].to_numpy( dtype = float )
+        values = df.iloc[:, 1:13].to_numpy( dtype = float )
+        dates  = pd.to_datetime( { 'year' : np.repeat( year, 12 ),
+                                   'month': np.tile( np.arange( 1, 13 ), len( year ) ),
+                                   'day'  : 1 } )
+        series = pd.Series( values.ravel(), index = pd.DatetimeIndex( dates ) )
+    else:
+        series = pd.Series( df.iloc[:, 1].to_numpy( dtype = float ), index = index_dates( df.iloc[:, 0] ) )
+
+    return series[series.index.notna()].groupby( level = 0 ).mean()
+
+@instrumented
+def index_registry( sources, parent_dir = None, na_values = INDEX_NA_VALUES ):
+
+    '''
+    Load several climate indices once onto one shared, gap free monthly calendar
+    spanning all of them.
+
+    Parameters
+    ---------
+
+      sources
+        Dictionary of index name -> csv file, e.g. {'nino34': 'nino3.4a_rel.csv', 'oni': 'oni.csv', 'soi': 'soi.csv'}
+
+      parent_dir
+        Folder of relative file names
+
+      na_values
+        Missing value codes
+
+    Returns
+    --------
+
+      Table with the date column (month starts) and one column per index
+    '''
+
+    series = {}
+    for name, filename in sources.items():
+        path = filename if parent_dir is None else os.path.join( parent_dir, filename )
+        log( f'Load index {name}', level = 2 )
+        series[name] = read_index( path, na_values )
+
+    starts = [ s.index.min() for s in series.values() if len( s ) ]
+    ends   = [ s.index.max() for s in series.values() if len( s ) ]
+    dates  = pd.date_range( min( starts ), max( ends ), freq = 'MS' ) if starts else pd.DatetimeIndex( [] )
+
+    df = pd.DataFrame( { name: s.reindex( dates ).to_numpy() for name, s in series.items() }, index = dates )
+
+    return df.rename_axis( 'date' ).reset_index()
+
+def event_labels( values, threshold = 0.5, min_duration = 5, window = 3 ):
+
+    '''
+    El Nino (1) / La Nina (-1) / neutral (0) label of every month, from run lengths:
+    an episode is a run of at least min_duration consecutive months beyond the
+    threshold of the window month running mean.
+
+    Parameters
+    ---------
+
+      values
+        Monthly index values on a gap free calendar, NaN where missing (a missing
+        month ends a run)
+
+      threshold
+        Anomaly threshold, or a pair (La Nina, El Nino) of thresholds, e.g. (-0.5, 0.5)
+
+      min_duration
+        Fewest consecutive months of an episode
+
+      window
+        Centred running mean applied first (3 gives the NOAA ONI definition on Nino 3.4
+        anomalies; use 1 for an index that is already smoothed, like ONI)
+
+    Returns
+    --------
+
+      Arrays of labels (int8) and episode numbers (0 for neutral months, then 1, 2, ...
+      in time order)
+    '''
+
+    lo, hi = ( -abs( threshold ), abs( threshold ) ) if np.isscalar( threshold ) else threshold
+
+    x = pd.Series( np.asarray( values, dtype = float ) ).rolling( window, center = True ).mean().to_numpy()
+    with np.errstate( invalid = 'ignore' ):
+        state = np.where( x >= hi, 1, np.where( x <= lo, -1, 0 ) ).astype( np.int8 )
+
+    if not len( state ):
+        return state, np.zeros( 0, int )
+
+    starts  = np.concatenate( [ [0], np.flatnonzero( np.diff( state ) ) + 1 ] )
+    lengths = np.diff( np.append( starts, len( state ) ) )
+    keep    = ( state[starts] != 0 ) & ( lengths >= min_duration )
+
+    labels  = np.repeat( np.where( keep, state[starts], 0 ), lengths ).astype( np.int8 )
+    episode = np.repeat( np.where( keep, np.cumsum( keep ), 0 ), lengths )
+
+    return labels, episode
+
+@instrumented
+def enso_events( index, column, date_name = 'date', threshold = 0.5, min_duration = 5, window = 3 ):
+
+    '''
+    Label El Nino and La Nina episodes of an index (see event_labels).
+
+    Parameters
+    ---------
+
+      index
+        Monthly index table, e.g. index_registry or prep_index_data output
+
+      column
+        Index column, e.g. 'ssta (°C)' or a registry name. Flip the sign of indices
+        whose El Nino phase is negative (SOI) before classifying.
+
+      date_name
+        Column Name of date
+
+      threshold, min_duration, window
+        As in event_labels
+
+    Returns
+    --------
+
+      Table with date, the smoothed index, event (1 El Nino, -1 La Nina, 0 neutral)
+      and episode (number of the episode, 0 for neutral months), one row per month
+    '''
+
+    dates  = pd.DatetimeIndex( pd.to_datetime( index[date_name] ) ).to_period( 'M' )
+    series = pd.Series( index[column].to_numpy( dtype = float ), index = dates ).groupby( level = 0 ).mean()
+    series = series.reindex( pd.period_range( series.index.min(), series.index.max(), freq = 'M' ) )
+
+    labels, episode = event_labels( series.to_numpy(), threshold, min_duration, window )
+
+    return pd.DataFrame( { 'date'    : series.index.to_timestamp(),
+                           'smoothed': series.rolling( window, center = True ).mean().to_numpy(),
+                           'event'   : labels,
+                           'episode' : episode } )
+
+def event_episodes( events ):
+
+    '''
+    One row per episode of enso_events output: episode, event name, start and end
+    months, duration in months and peak (largest absolute smoothed value).
+    '''
+
+    ev   = events[events['episode'] > 0]
+    peak = ev['smoothed'].abs().groupby( ev['episode'] ).idxmax()
+    agg  = ev.groupby( 'episode' ).agg( event = ( 'event', 'first' ), start = ( 'date', 'min' ),
+                                       end = ( 'date', 'max' ), months = ( 'date', 'size' ) )
+
+    agg['event'] = agg['event'].map( EVENT_NAMES )
+    agg['peak']  = ev.loc[peak.to_numpy(), 'smoothed'].to_numpy()
+
+    return agg.reset_index()
@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import contextlib
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# 0 prints nothing, 1 prints the stage messages ('Prep Modern data'), 2 also the per file / year messages
+VERBOSE = 1
+
+# trace Python allocations with tracemalloc to report the peak memory of every call (slow)
+TRACE_MEMORY = False
+
+_hooks = []
+_local = threading.local()
+
+
+def configure( verbose = None, trace_memory = None ):
+
+    '''
+    Set how much is printed and whether peak memory is traced.
+
+    Parameters
+    ---------
+
+      verbose
+        0 = silent, 1 = stage messages, 2 = also per file / year messages. None keeps the current level.
+
+      trace_memory
+        Trace allocations with tracemalloc so every call event has peak_mb. Slows
+        the traced code down noticeably. None keeps the current setting.
+    '''
+
+    global VERBOSE, TRACE_MEMORY
+
+    if verbose is not None:
+        VERBOSE = verbose
+    if trace_memory is not None:
+        TRACE_MEMORY = trace_memory
+
+def add_hook( hook ):
+
+    '''
+    Register a function called with every event dictionary.
+
+    Events are 'call' (an instrumented function returned), 'error' (it raised) and
+    'message' (a progress message). Process workers started with fork inherit the
+    hooks registered before the pool was created.
+    '''
+
+    if hook not in _hooks:
+        _hooks.append( hook )
+
+    return hook
+
+def remove_hook( hook ):
+
+    if hook in _hooks:
+        _hooks.remove( hook )
+
+def jsonl_sink( path ):
+
+    '''
+    Hook appending every event as one JSON line to path. Lines are written with a
+    single append so events of parallel workers do not interleave.
+
+    Returns
+    --------
+
+      The hook, to pass to add_hook / remove_hook
+    '''
+
+    def sink( event ):
+        line = json.dumps( event, default = str ) + '\n'
+        with open( path, 'a' ) as f:
+            f.write( line )
+
+    return sink
+
+@contextlib.contextmanager
+def recording( hook ):
+
+    'Register hook for the duration of a with block'
+
+    add_hook( hook )
+    try:
+        yield hook
+    finally:
+        remove_hook( hook )
+
+def _emit( event ):
+
+    for hook in list( _hooks ):
+        hook( event )
+
+def log( message, level = 1, **fields ):
+
+    '''
+    Progress message. Printed when level <= VERBOSE and sent to the hooks as a
+    'message' event with the extra fields (e.g. station, year).
+    '''
+
+    if level <= VERBOSE:
+        print( message )
+
+    if _hooks:
+        stack = _stack()
+        _emit( { 'event'  : 'message',
+                 'message': message,
+                 'level'  : level,
+                 'stage'  : stack[-1]['stage'] if stack else None,
+                 'context': stack[-1]['context'] if stack else None,
+                 'time'   : time.time(),
+                 'pid'    : os.getpid(),
+                 **fields } )
+
+def _stack():
+
+    if not hasattr( _local, 'stack' ):
+        _local.stack = []
+
+    return _local.stack
+
+def describe( value ):
+
+    '''
+    Rows, columns and NaN fraction of a table-like value: DataFrame, Series, array,
+    the first table of a tuple, or the tables of a dictionary (rows summed).
+
+    Returns
+    --------
+
+      Dictionary with rows, cols and nan_fraction (None where they do not apply)
+    '''
+
+    if isinstance( value, tuple ):
+        value = next( ( v for v in value if isinstance( v, ( pd.DataFrame, pd.Series, np.ndarray, dict ) ) ), None )
+
+    if isinstance( value, dict ):
+        parts = [ describe( v.get( 'data' ) if isinstance( v, dict ) else v ) for v in value.values() ]
+        parts = [ p for p in parts if p['rows'] is not None ]
+        if not parts:
+            return { 'rows': None, 'cols': None, 'nan_fraction': None }
+        cells = sum( p['rows'] * ( p['cols'] or 1 ) for p in parts )
+        nans  = sum( p['rows'] * ( p['cols'] or 1 ) * ( p['nan_fraction'] or 0 ) for p in parts )
+        return { 'rows': sum( p['rows'] for p in parts ), 'cols': None,
+                 'nan_fraction': nans / cells if cells else None }
+
+    if isinstance( value, pd.Series ):
+        value = value.to_frame()
+
+    if isinstance( value, pd.DataFrame ):
+        numeric = value.select_dtypes( 'number' )
+        return { 'rows': value.shape[0], 'cols': value.shape[1],
+                 'nan_fraction': float( numeric.isna().to_numpy().mean() ) if numeric.size else None }
+
+    if isinstance( value, np.ndarray ) and value.ndim:
+        nan = float( np.isnan( value ).mean() ) if value.dtype.kind == 'f' and value.size else None
+        return { 'rows': value.shape[0], 'cols': value.shape[1] if value.ndim > 1 else 1, 'nan_fraction': nan }
+
+    return { 'rows': None, 'cols': None, 'nan_fraction': None }
+
+def _max_rss_mb():
+
+    'Peak resident memory of this process so far'
+
+    if resource is None:
+        return None
+    rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+def _context( args, kwargs ):
+
+    'File, folder or station a call works on: the first string argument'
+
+    for value in list( args ) + list( kwargs.values() ):
+        if isinstance( value, str ):
+            return value
+
+    return None
+
+def _first_table( args, kwargs ):
+
+    for value in list( args ) + list( kwargs.values() ):
+        if isinstance( value, ( pd.DataFrame, pd.Series, np.ndarray, dict ) ):
+            return value
+
+    return None
+
+def instrumented( func ):
+
+    '''
+    Decorator emitting a 'call' event (or 'error' event) for every call of func with
+    wall time, rows / columns / NaN fraction of the first table argument and of the
+    result, peak memory and the enclosing instrumented call. Without hooks func is
+    called directly, so the overhead is one check per call.
+    '''
+
+    stage = f'{func.__module__.split( "." )[-1]}.{func.__qualname__}'
+
+    @functools.wraps( func )
+    def wrapper( *args, **kwargs ):
+
+        if not _hooks:
+            return func( *args, **kwargs )
+
+        # calls without a file / station argument inherit the context of the enclosing call
+        stack = _stack()
+        frame = { 'stage'  : stage,
+                  'context': _context( args, kwargs ) or ( stack[-1]['context'] if stack else None ),
+                  'peak'   : 0 }
+        if TRACE_MEMORY:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                frame['started'] = True
+            frame['base'], outer = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max( stack[-1]['peak'], outer )
+            tracemalloc.reset_peak()
+
+        event = { 'event'  : 'call',
+                  'stage'  : stage,
+                  'context': frame['context'],
+                  'parent' : stack[-1]['stage'] if stack else None,
+                  'depth'  : len( stack ),
+                  'pid'    : os.getpid(),
+                  'start'  : time.time() }
+        event.update( { f'{k}_in': v for k, v in describe( _first_table( args, kwargs ) ).items() if k != 'nan_fraction' } )
+
+        stack.append( frame )
+        t0 = time.perf_counter()
+        try:
+            result = func( *args, **kwargs )
+        except Exception as e:
+            event.update( { 'event': 'error', 'error': f'{type( e ).__name__}: {e}' } )
+            raise
+        else:
+            event.update( { f'{k}_out': v for k, v in describe( result ).items() } )
+            event['nan_fraction'] = event.pop( 'nan_fraction_out' )
+            return result
+        finally:
+            event['seconds'] = time.perf_counter() - t0
+            stack.pop()
+            if TRACE_MEMORY and tracemalloc.is_tracing():
+                peak = max( tracemalloc.get_traced_memory()[1], frame['peak'] )
+                event['peak_mb'] = ( peak - frame['base'] ) / 2**20
+                if stack:
+                    stack[-1]['peak'] = max( stack[-1]['peak'], peak )
+                if frame.get( 'started' ):
+                    tracemalloc.stop()
+            event['max_rss_mb'] = _max_rss_mb()
+            _emit( event )
+
+    return wrapper
+
+def read_events( path ):
+
+    '''
+    Events of a JSON-lines sink as a table.
+
+    Parameters
+    ---------
+
+      path
+        File written by jsonl_sink
+
+    Returns
+    --------
+
+      Table with one row per event, in the order they were written
+    '''
+
+    with open( path ) as f:
+        return pd.DataFrame( [ json.loads( line ) for line in f if line.strip() ] )
@@ -1,9 +1,11 @@
 import pandas as pd
+import numpy as np
 import os
-import glob
-from IPython.display import display
 
+from .instrument import instrumented
 
+
+@instrumented
 def get_his_dis( df ):
     
     '''
@@ -22,17 +24,21 @@ def get_his_dis( df ):
     
     '''
     
-    df['splice'] = df.apply(lambda x: str(x['Unnamed: 12']).startswith('19') and 
-                                      str(x['Unnamed: 16']).startswith('MEAN'), axis = 1)
+    # a year block starts on the row with the year (19xx) in column 12 and MEAN... in column 16.
+    # numpy's astype(str) always copies; Series.astype(str) can write through to unpickled frames
+    df['splice'] = np.char.startswith( df['Unnamed: 12'].to_numpy().astype(str), '19' ) & \
+                   np.char.startswith( df['Unnamed: 16'].to_numpy().astype(str), 'MEAN' )
     
-    return df[df['splice']==True][['splice','Unnamed: 12']].index
+    return df.index[df['splice'].to_numpy()]
 
+@instrumented
 def get_drainage( df ):
     
     'Getting drainage area from historical discharge excel sheets in units of sq kms'
     
     return df.iloc[9,6]
 
+@instrumented
 def extract_file( folder ):
     
     '''    
@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented
+
+
+STORE_VERSION = 1
+
+
+@instrumented
+def write_output_store( df, folder, date_name = 'Date', dtype = np.float64 ):
+
+    '''
+    Write a wide output table (output_discharge.csv / output_rainfall.csv layout) as a
+    memory-mappable store: values.npy (stations x dates, so every station is one
+    contiguous row), dates.npy (sorted) and meta.json with the station directory.
+    The folder is replaced atomically.
+
+    Parameters
+    ---------
+
+      df
+        Wide table with a date column and one column per station
+
+      folder
+        Store folder, e.g. Data/Files/output_discharge
+
+      date_name
+        Column Name of date
+
+      dtype
+        Value type on disk
+    '''
+
+    df       = df.sort_values( date_name, kind = 'stable' )
+    stations = [ c for c in df.columns if c != date_name ]
+    # view drops the dtype metadata tables unpickled from the pipeline store carry (np.save warns)
+    dates    = pd.to_datetime( df[date_name] ).to_numpy( dtype = 'datetime64[ns]' ).view( 'datetime64[ns]' )
+
+    if np.isnat( dates ).any():
+        raise ValueError( f'Output store {folder}: missing dates in column {date_name}' )
+
+    tmp = f'{folder.rstrip( os.sep )}.{os.getpid()}.tmp'
+    shutil.rmtree( tmp, ignore_errors = True )
+    os.makedirs( tmp )
+
+    np.save( os.path.join( tmp, 'values.npy' ), np.ascontiguousarray( df[stations].to_numpy( dtype = dtype ).T ) )
+    np.save( os.path.join( tmp, 'dates.npy' ), dates )
+    with open( os.path.join( tmp, 'meta.json' ), 'w' ) as f:
+        json.dump( { 'version'  : STORE_VERSION,
+                     'date_name': date_name,
+                     'stations' : stations,
+                     'dtype'    : np.dtype( dtype ).name,
+                     'shape'    : [ len( stations ), len( dates ) ] }, f, indent = 1 )
+
+    old = f'{folder.rstrip( os.sep )}.{os.getpid()}.old'
+    if os.path.exists( folder ):
+        os.replace( folder, old )
+    os.replace( tmp, folder )
+    shutil.rmtree( old, ignore_errors = True )
+
+def open_output_store( folder ):
+
+    '''
+    Open an output store without reading its values.
+
+    Returns
+    --------
+
+      Dictionary with meta (meta.json), values (memory-mapped stations x dates array),
+      dates and the station directory (name -> row of values)
+    '''
+
+    with open( os.path.join( folder, 'meta.json' ) ) as f:
+        meta = json.load( f )
+
+    return { 'meta'     : meta,
+             'values'   : np.load( os.path.join( folder, 'values.npy' ), mmap_mode = 'r' ),
+             'dates'    : np.load( os.path.join( folder, 'dates.npy' ) ),
+             'directory': { s: i for i, s in enumerate( meta['stations'] ) } }
+
+@instrumented
+def read_output_store( store, stations = None, start = None, end = None ):
+
+    '''
+    Slice of an output store. Only the requested rows and date range are read from disk.
+
+    Parameters
+    ---------
+
+      store
+        Store folder or the dictionary returned by open_output_store (keep it open
+        for repeated queries)
+
+      stations
+        Station name or list of names, None for all
+
+      start, end
+        First and last date (inclusive), None for open ends
+
+    Returns
+    --------
+
+      Wide table with the date column and one column per requested station, in the
+      layout the store was written from
+    '''
+
+    if isinstance( store, str ):
+        store = open_output_store( store )
+
+    meta  = store['meta']
+    dates = store['dates']
+
+    if stations is None:
+        stations = meta['stations']
+    elif isinstance( stations, str ):
+        stations = [ stations ]
+
+    missing = [ s for s in stations if s not in store['directory'] ]
+    if missing:
+        raise KeyError( f'Stations not in output store: {missing}' )
+
+    lo = 0 if start is None else np.searchsorted( dates, np.datetime64( pd.Timestamp( start ), 'ns' ), 'left' )
+    hi = len( dates ) if end is None else np.searchsorted( dates, np.datetime64( pd.Timestamp( end ), 'ns' ), 'right' )
+
+    rows   = [ store['directory'][s] for s in stations ]
+    values = np.array( [ store['values'][r, lo:hi] for r in rows ] ).reshape( len( rows ), hi - lo )
+
+    df = pd.DataFrame( values.T.astype( float ), columns = list( stations ) )
+    df.insert( 0, meta['date_name'], dates[lo:hi] )
+
+    return df
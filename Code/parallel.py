@@ -0,0 +1,79 @@
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def n_workers( n_jobs ):
+
+    'Number of workers for n_jobs. None or a negative value uses every core (-1 = all, -2 = all but one)'
+
+    cpus = os.cpu_count() or 1
+
+    if n_jobs is None:
+        return cpus
+    if n_jobs < 0:
+        return max( 1, cpus + 1 + n_jobs )
+
+    return max( 1, n_jobs )
+
+def _call_with_timings( func, filename ):
+
+    'func(filename) in a process worker, with the cache timings it recorded there (see cache_report)'
+
+    from . import cache
+
+    # the worker's records of earlier files were sent back with their results
+    cache._timings.clear()
+    result = func( filename )
+
+    return result, list( cache._timings )
+
+def map_files( func, files, n_jobs = 1, backend = 'process' ):
+
+    '''
+    Apply func to every file, optionally on a pool of workers.
+
+    Parameters
+    ---------
+
+      func
+        Function of one file name. Must be defined at module level for the process backend.
+
+      files
+        File names. They are sorted so the results do not depend on the order the
+        operating system lists a folder in.
+
+      n_jobs
+        Number of workers. 1 runs serially in this process, None or -1 uses every core.
+
+      backend
+        'process' (ProcessPoolExecutor) or 'thread' (ThreadPoolExecutor)
+
+    Returns
+    --------
+
+      List of func results in sorted file order, regardless of which worker finished first.
+    '''
+
+    if backend not in ( 'process', 'thread' ):
+        raise ValueError( f"backend must be 'process' or 'thread', got {backend!r}" )
+
+    files   = sorted( files )
+    workers = min( n_workers( n_jobs ), max( 1, len( files ) ) )
+
+    if workers == 1:
+        return [ func( f ) for f in files ]
+
+    if backend == 'thread':
+        with ThreadPoolExecutor( max_workers = workers ) as pool:
+            return list( pool.map( func, files ) )
+
+    from . import cache
+
+    # the cache timings of the workers are sent back with the results, so cache_report counts them
+    with ProcessPoolExecutor( max_workers = workers ) as pool:
+        results = list( pool.map( partial( _call_with_timings, func ), files ) )
+    for _, timings in results:
+        cache._timings.extend( timings )
+
+    return [ result for result, _ in results ]
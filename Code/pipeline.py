@@ -0,0 +1,495 @@
+import os
+import sys
+import ast
+import json
+import glob
+import pickle
+import hashlib
+import inspect
+import functools
+import numpy as np
+import pandas as pd
+
+from .prepare_data import prep_index_data, prep_mod_rain_data, prep_rain_data, prep_mod_dis_data, \
+                          load_his_dis_data, load_his_dis_monthly, merge_rain_data, merge_dis_data, align_stations
+from .coalesce     import coalesce_sources
+from .compact      import to_compact, to_wide
+from .clean_data   import clean_data_groups
+from .climatology  import climatology_cube
+from .enso         import INDEX_COLUMN, clean_to_wide
+from .indices      import index_registry, enso_events
+from .instrument   import log
+
+
+def stage( func, inputs = (), params = None, files = (), options = None, compact = None ):
+
+    '''
+    Declare a pipeline stage.
+
+    Parameters
+    ---------
+
+      func
+        Function computing the stage. Called as func(*upstream outputs, **params, **options).
+
+      inputs
+        Names of the upstream stages, their outputs are passed in this order
+
+      params
+        Keyword arguments of func, part of the stage key
+
+      files
+        Source files or folders read by func. A change of size or mtime of any file
+        below them changes the stage key.
+
+      options
+        Keyword arguments of func that do not change its output (cache directory,
+        number of workers). Not part of the stage key.
+
+      compact
+        Date column of a wide table output (one column per station, mostly NaN), stored
+        as a lossless compact store (see compact.py) instead of the wide table
+
+    Returns
+    --------
+
+      Stage dictionary
+    '''
+
+    return { 'func'   : func,
+             'inputs' : list( inputs ),
+             'params' : dict( params or {} ),
+             'files'  : list( files ),
+             'options': dict( options or {} ),
+             'compact': compact }
+
+def _source( obj ):
+
+    try:
+        return inspect.getsource( obj )
+    except ( OSError, TypeError ):
+        return ''
+
+@functools.lru_cache( maxsize = None )
+def _module_constants( module ):
+
+    'Source of the top level statements of a module other than functions and classes (its constants)'
+
+    source = _source( sys.modules[module] )
+    try:
+        tree = ast.parse( source )
+    except SyntaxError:
+        return source
+
+    return '\n'.join( ast.get_source_segment( source, node ) or '' for node in tree.body
+                      if not isinstance( node, ( ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef ) ) )
+
+def _code_sources( func, package, found ):
+
+    '''
+    Source of func and of everything of package it uses, followed through the names
+    of its code: functions (unwrapped from their decorators), classes, modules and the
+    constants of the modules (as written in the source, not their run time values,
+    which hold state such as the verbosity).
+    '''
+
+    func = inspect.unwrap( func )
+    code = getattr( func, '__code__', None )
+    key  = f'{getattr( func, "__module__", "" )}.{getattr( func, "__qualname__", repr( func ) )}'
+    if code is None or key in found:
+        return
+    found[key] = _source( func )
+
+    names, codes = set(), [ code ]
+    while codes:
+        c = codes.pop()
+        names.update( c.co_names )
+        codes += [ k for k in c.co_consts if inspect.iscode( k ) ]
+
+    for name in sorted( names ):
+        obj = func.__globals__.get( name )
+        if inspect.ismodule( obj ):
+            if obj.__name__.split( '.' )[0] == package:
+                found.setdefault( obj.__name__, _source( obj ) )
+        elif inspect.isfunction( obj ) or inspect.isclass( obj ):
+            if getattr( obj, '__module__', '' ).split( '.' )[0] == package:
+                if inspect.isclass( obj ):
+                    found.setdefault( f'{obj.__module__}.{obj.__qualname__}', _source( obj ) )
+                else:
+                    _code_sources( obj, package, found )
+        elif name in func.__globals__ and func.__module__ in sys.modules:
+            found.setdefault( f'{func.__module__}:constants', _module_constants( func.__module__ ) )
+
+def _func_id( func ):
+
+    '''
+    Name and source of a stage function and of the package functions, classes and
+    constants it uses (see _code_sources), so editing the function or anything it calls
+    (read_mod_rain_file below mod_rain_stage, the QC of the loaders, ...) invalidates
+    its outputs
+    '''
+
+    name    = f'{getattr( func, "__module__", "" )}.{getattr( func, "__qualname__", repr( func ) )}'
+    found   = {}
+    _code_sources( func, name.split( '.' )[0], found )
+    sources = json.dumps( sorted( found.items() ) )
+
+    return f'{name}:{hashlib.sha1( sources.encode() ).hexdigest()}'
+
+def _files_id( paths ):
+
+    'Size and mtime of every file below paths'
+
+    entries = []
+    for path in paths:
+        names = [ path ] if os.path.isfile( path ) else \
+                sorted( f for f in glob.glob( os.path.join( path, '**', '*' ), recursive = True ) if os.path.isfile( f ) )
+        for name in names:
+            st = os.stat( name )
+            entries.append( [ name, st.st_size, st.st_mtime_ns ] )
+
+    return entries
+
+def _pack( output, date_name ):
+
+    'Compact store of a wide table output of float stations, other outputs unchanged'
+
+    if date_name is None or not isinstance( output, pd.DataFrame ) or date_name not in output.columns or \
+       not isinstance( output.index, pd.RangeIndex ) or output.columns.duplicated().any() or \
+       not all( dt == np.float64 for c, dt in output.dtypes.items() if c != date_name ):
+        return output
+
+    return { 'compact': to_compact( output, date_name ) }
+
+def _unpack( stored ):
+
+    'Output of a stored stage, wide again if it was compacted'
+
+    if isinstance( stored, dict ) and set( stored ) == { 'compact' }:
+        return to_wide( stored['compact'] )
+
+    return stored
+
+def _order( stages, targets ):
+
+    'Stages needed for targets, upstream first'
+
+    order, seen = [], set()
+
+    def visit( name, path ):
+        if name in path:
+            raise ValueError( f'Cycle in pipeline stages: {" -> ".join( path + [ name ] )}' )
+        if name in seen:
+            return
+        if name not in stages:
+            raise KeyError( f'Unknown pipeline stage {name!r}' )
+        for upstream in stages[name]['inputs']:
+            visit( upstream, path + [ name ] )
+        seen.add( name )
+        order.append( name )
+
+    for name in targets:
+        visit( name, [] )
+
+    return order
+
+def stage_keys( stages, targets = None ):
+
+    '''
+    Key of every stage: a hash of its function (with the code it calls), parameters,
+    source files and the keys of its upstream stages. A stage is recomputed only when
+    its key changes, which happens exactly for the stages downstream of a change.
+
+    Parameters
+    ---------
+
+      stages
+        Dictionary of stages by name (see stage)
+
+      targets
+        Stages of interest, None for all
+
+    Returns
+    --------
+
+      Dictionary of keys by stage name, upstream first
+    '''
+
+    keys = {}
+    for name in _order( stages, list( stages ) if targets is None else targets ):
+        s    = stages[name]
+        spec = json.dumps( [ _func_id( s['func'] ),
+                             s['params'],
+                             _files_id( s['files'] ),
+                             [ keys[u] for u in s['inputs'] ] ], sort_keys = True, default = repr )
+        keys[name] = hashlib.sha1( spec.encode() ).hexdigest()
+
+    return keys
+
+def _store_path( store_dir, name, key ):
+
+    return os.path.join( store_dir, f'{name}-{key}.pkl' )
+
+def stale_stages( stages, store_dir, targets = None ):
+
+    'Names of the stages that run_pipeline would recompute'
+
+    keys = stage_keys( stages, targets )
+
+    return [ name for name, key in keys.items() if not os.path.exists( _store_path( store_dir, name, key ) ) ]
+
+def run_pipeline( stages, targets = None, store_dir = 'Data/Pipeline', force = () ):
+
+    '''
+    Run the stages needed for targets, reusing every stored output whose key is
+    unchanged. Stored outputs of up-to-date stages are only loaded when a target or a
+    stage being recomputed needs them.
+
+    Parameters
+    ---------
+
+      stages
+        Dictionary of stages by name (see stage)
+
+      targets
+        Names of the stages to return, None for all
+
+      store_dir
+        Directory with the stored stage outputs (one pickle per stage and key, wide
+        tables of stages declared compact as compact stores)
+
+      force
+        Names of stages to recompute even if their key is unchanged
+
+    Returns
+    --------
+
+      Dictionary of the outputs of targets
+    '''
+
+    targets = list( stages ) if targets is None else list( targets )
+    keys    = stage_keys( stages, targets )
+    outputs = {}
+
+    os.makedirs( store_dir, exist_ok = True )
+
+    def get( name ):
+
+        if name in outputs:
+            return outputs[name]
+
+        path = _store_path( store_dir, name, keys[name] )
+
+        if name not in force and os.path.exists( path ):
+            log( f'Load stage {name}', pipeline_stage = name )
+            with open( path, 'rb' ) as f:
+                outputs[name] = _unpack( pickle.load( f ) )
+            return outputs[name]
+
+        s    = stages[name]
+        args = [ get( upstream ) for upstream in s['inputs'] ]
+        log( f'Run stage {name}', pipeline_stage = name )
+        outputs[name] = s['func']( *args, **s['params'], **s['options'] )
+
+        # drop outputs of earlier keys of this stage, then store atomically
+        for old in glob.glob( _store_path( store_dir, name, '*' ) ):
+            os.remove( old )
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open( tmp, 'wb' ) as f:
+            pickle.dump( _pack( outputs[name], s['compact'] ), f, protocol = pickle.HIGHEST_PROTOCOL )
+        os.replace( tmp, path )
+
+        return outputs[name]
+
+    return { name: get( name ) for name in targets }
+
+
+def read_table( filename ):
+
+    'pd.read_csv as a stage function'
+
+    return pd.read_csv( filename )
+
+def mod_rain_stage( folder, **kwargs ):
+
+    'prep_mod_rain_data table as a stage function'
+
+    return prep_mod_rain_data( folder, **kwargs )[0]
+
+def rain_stage( filename, labelname, **kwargs ):
+
+    'prep_rain_data table as a stage function'
+
+    return prep_rain_data( filename, labelname, **kwargs )[0]
+
+def mod_dis_stage( folder, **kwargs ):
+
+    'prep_mod_dis_data table as a stage function'
+
+    return prep_mod_dis_data( folder, **kwargs )[0]
+
+def clean_stage( df, crit_data, index_qc, crit_label, crit_name, date_name ):
+
+    'clean_data_groups as a stage function'
+
+    return clean_data_groups( df, crit_data, crit_label, crit_name, date_name, index_qc )
+
+def rain_sources_stage( df_rain_mod, df_rain_hist, df_rain_mid, precedence, aliases = None ):
+
+    'coalesce_sources of modern, historical and mid century rainfall (preferred in that order)'
+
+    return coalesce_sources( { 'mod': df_rain_mod, 'hist': df_rain_hist, 'mid': df_rain_mid }, precedence, 'Date',
+                             aliases = aliases )
+
+def dis_sources_stage( df_hess, hist_dis, precedence, aliases = None ):
+
+    'coalesce_sources of HESS and historical discharge (HESS preferred)'
+
+    hist = align_stations( [ v.set_index( 'Year' )[k] for k, v in hist_dis.items() ], list( hist_dis ), 'Year' )
+
+    return coalesce_sources( { 'hess': df_hess, 'historical': hist }, precedence, 'Year', aliases = aliases )
+
+def climatology_stage( df, cleaned, date_name ):
+
+    'Climatology cube of every station of df and every cleaned criteria group (data_mean) in one pass'
+
+    groups = clean_to_wide( cleaned, 'data_mean' )
+
+    return climatology_cube( pd.concat( [ df.rename( columns = { date_name: 'date' } ), groups ], ignore_index = True ), 'date' )
+
+def merge_rain_sources( df_rain_mod, df_rain_hist, df_rain_mid, hist_drop_list, hist_rename, mid_drop_list ):
+
+    '''
+    Merge modern, historical and mid century rainfall as done in ENSO.ipynb: modern +
+    historical first, renamed with hist_rename, then merged with mid century.
+
+    Returns
+    --------
+
+      Table with monthly rainfall totals by station. Units in mm.
+    '''
+
+    rain_list_mod  = [ key.split('mod_')[-1].lower() for key in df_rain_mod.columns ]
+    rain_list_mod.remove('date')
+
+    rain_list_hist = [ key.split('hist_')[-1].lower() for key in df_rain_hist.columns ][4:]
+    rain_list_mid  = [ key.split('mid_')[-1].lower() for key in df_rain_mid.columns ][4:]
+
+    df_rain_mod_hist = merge_rain_data( df_rain_hist, df_rain_mod.copy(), rain_list_hist, rain_list_mod,
+                                        hist_drop_list, 'mod' ).rename( columns = hist_rename )
+
+    rain_list_mod_hist = [ key.split('_')[-1].lower() for key in df_rain_mod_hist.columns ]
+    rain_list_mod_hist.remove('date')
+
+    return merge_rain_data( df_rain_mid, df_rain_mod_hist, rain_list_mid, rain_list_mod_hist,
+                            mid_drop_list, 'mod_hist' )
+
+def enso_stages( files_folder = 'Data/Files', modern_folder = 'Modern/', hess_folder = 'HESS/',
+                 historical_folder = 'Historical/', index_file = 'nino3.4a_rel',
+                 hist_drop_list = (), hist_rename = None, mid_drop_list = (), hess_drop_list = (),
+                 crit_name = 'Climate Type', cache_dir = None, n_jobs = 1, backend = 'process', indices = None,
+                 precedence = None, station_aliases = None, infer_index_dates = False ):
+
+    '''
+    The ENSO.ipynb chain as pipeline stages: index and source loaders, rainfall and
+    discharge merges, then the cleaned data of every criteria group.
+
+    Parameters
+    ---------
+
+      files_folder
+        Folder with the index csv, the rainfall csvs and the criteria tables
+
+      modern_folder, hess_folder, historical_folder
+        Folders with the Modern rainfall, Modern (HESS) discharge and Historical discharge workbooks
+
+      index_file
+        Name (without .csv) of the index file in files_folder
+
+      infer_index_dates
+        Date the index rows from their Year values instead of the fixed calendar
+        (see prep_index_data)
+
+      hist_drop_list, hist_rename, mid_drop_list
+        Columns dropped / renamed when merging modern with historical and mid century rainfall
+
+      hess_drop_list
+        Columns dropped when merging HESS with historical discharge
+
+      crit_name
+        Criteria column used to group the stations (Climate Type or CPE)
+
+      cache_dir, n_jobs, backend
+        Snapshot cache and worker pool of the loaders (see cache.py and parallel.py)
+
+      indices
+        Dictionary of index name -> csv file in files_folder loaded by the indices stage
+        (index_registry), e.g. {'oni': 'oni.csv', 'soi': 'soi.csv'}. None skips the stage.
+
+      precedence
+        Dictionary of station -> ordered list of sources of the rain_sources and
+        dis_sources stages (see coalesce_sources)
+
+      station_aliases
+        Dictionary of station name -> name it is merged under in the rain_sources and
+        dis_sources stages, for spelling variants, e.g. {'cotobato': 'cotabato'}
+
+    Returns
+    --------
+
+      Dictionary of stages. The cleaned data are the stages clean_dis and clean_rain, the month of year
+      statistics of stations and groups (climatology_cube) climatology_dis and climatology_rain,
+      the El Nino / La Nina labels of the index (enso_events) events and the coalesced sources
+      with provenance rain_sources and dis_sources.
+    '''
+
+    load     = { 'cache_dir': cache_dir, 'n_jobs': n_jobs, 'backend': backend }
+    hist_csv = os.path.join( files_folder, '1901_1940Rainfall.csv' )
+    mid_csv  = os.path.join( files_folder, 'Rainfall1951_1990.csv' )
+    crit_dis = os.path.join( files_folder, 'CriteriaTableDis_HESS.csv' )
+    crit_rain= os.path.join( files_folder, 'CriteriaTableRain_HESS.csv' )
+
+    stages = {
+        'index'        : stage( prep_index_data, params = { 'parent_dir': files_folder, 'filename': index_file,
+                                                            'title': index_file, 'infer_dates': infer_index_dates },
+                                files = [ os.path.join( files_folder, f'{index_file}.csv' ) ] ),
+        'rain_mod'     : stage( mod_rain_stage, params = { 'folder': modern_folder }, files = [ modern_folder ],
+                                options = load, compact = 'Date' ),
+        'rain_hist'    : stage( rain_stage, params = { 'filename': hist_csv, 'labelname': 'hist' }, files = [ hist_csv ],
+                                options = { 'cache_dir': cache_dir }, compact = 'Date' ),
+        'rain_mid'     : stage( rain_stage, params = { 'filename': mid_csv, 'labelname': 'mid' }, files = [ mid_csv ],
+                                options = { 'cache_dir': cache_dir }, compact = 'Date' ),
+        'hess'         : stage( mod_dis_stage, params = { 'folder': hess_folder }, files = [ hess_folder ],
+                                options = load, compact = 'Year' ),
+        'hist_dis_dict': stage( load_his_dis_data, params = { 'folder': historical_folder }, files = [ historical_folder ],
+                                options = load ),
+        'hist_dis'     : stage( load_his_dis_monthly, params = { 'folder': historical_folder }, files = [ historical_folder ],
+                                options = load ),
+        'rain'         : stage( merge_rain_sources, inputs = [ 'rain_mod', 'rain_hist', 'rain_mid' ],
+                                params = { 'hist_drop_list': list( hist_drop_list ),
+                                           'hist_rename'   : dict( hist_rename or {} ),
+                                           'mid_drop_list' : list( mid_drop_list ) }, compact = 'Date' ),
+        'discharge'    : stage( merge_dis_data, inputs = [ 'hess', 'hist_dis' ],
+                                params = { 'drop_list': list( hess_drop_list ) }, compact = 'Year' ),
+        'rain_sources' : stage( rain_sources_stage, inputs = [ 'rain_mod', 'rain_hist', 'rain_mid' ],
+                                params = { 'precedence': dict( precedence or {} ),
+                                           'aliases'   : dict( station_aliases or {} ) } ),
+        'dis_sources'  : stage( dis_sources_stage, inputs = [ 'hess', 'hist_dis' ],
+                                params = { 'precedence': dict( precedence or {} ),
+                                           'aliases'   : dict( station_aliases or {} ) } ),
+        'criteria_dis' : stage( read_table, params = { 'filename': crit_dis }, files = [ crit_dis ] ),
+        'criteria_rain': stage( read_table, params = { 'filename': crit_rain }, files = [ crit_rain ] ),
+        'clean_dis'    : stage( clean_stage, inputs = [ 'discharge', 'criteria_dis', 'index' ],
+                                params = { 'crit_label': 'River Name', 'crit_name': crit_name, 'date_name': 'Year' } ),
+        'clean_rain'   : stage( clean_stage, inputs = [ 'rain', 'criteria_rain', 'index' ],
+                                params = { 'crit_label': 'Station Name', 'crit_name': crit_name, 'date_name': 'Date' } ),
+        'climatology_dis' : stage( climatology_stage, inputs = [ 'discharge', 'clean_dis' ], params = { 'date_name': 'Year' } ),
+        'climatology_rain': stage( climatology_stage, inputs = [ 'rain', 'clean_rain' ], params = { 'date_name': 'Date' } ),
+        'events'       : stage( enso_events, inputs = [ 'index' ], params = { 'column': INDEX_COLUMN } ),
+    }
+
+    if indices:
+        stages['indices'] = stage( index_registry, params = { 'sources': dict( indices ), 'parent_dir': files_folder },
+                                   files = [ os.path.join( files_folder, f ) for f in indices.values() ] )
+
+    return stages
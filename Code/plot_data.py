@@ -1,15 +1,82 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-import datetime
 #import geopandas as gpd
 #import contextily as cx
-import seaborn as sns
 
-from matplotlib.pyplot import cm
-from IPython.display import display
+from .climatology import climatology_cube, cube_stat, bxp_stats
 
-def logscaled_plot(df_final, savefolder, savelabel):
+def use_headless_backend():
+    
+    'Switch matplotlib to the non-interactive Agg backend (batch jobs, servers without a display)'
+    
+    plt.switch_backend( 'Agg' )
+
+def _finish( fig, show, savefile = None ):
+    
+    'Save the figure to savefile (if given), then show it, or leave it to the caller (close) when show is False'
+    
+    if savefile:
+        fig.savefig( savefile, dpi = 600 )
+    if show:
+        plt.show()
+    
+    return fig
+
+def trend_plot( diagnostics, show = True ):
+    
+    '''
+    FIGURE OF SCALED DATA AND POLYNOMIAL TREND
+    
+    Parameters
+    ---------
+      
+      diagnostics
+        Diagnostics returned by clean_data(..., return_diagnostics=True)
+      show
+        plt.show() the figure
+    
+    Returns
+    --------
+      
+      Figure
+    '''
+    
+    fig = plt.figure()
+    plt.plot(diagnostics['data_scaled'])
+    plt.plot(diagnostics['trend'])
+    plt.ylabel('Scaled Data')
+    plt.title('Polynomial Trend')
+    
+    return _finish( fig, show )
+
+def residual_plot( diagnostics, show = True ):
+    
+    '''
+    FIGURE OF THE RESIDUAL (SCALED DATA - TREND)
+    
+    Parameters
+    ---------
+      
+      diagnostics
+        Diagnostics returned by clean_data(..., return_diagnostics=True)
+      show
+        plt.show() the figure
+    
+    Returns
+    --------
+      
+      Figure
+    '''
+    
+    fig = plt.figure()
+    plt.plot(diagnostics['residual'])
+    plt.ylabel('Scaled Data')
+    plt.title('Residual:Trend substracted from data')
+    
+    return _finish( fig, show )
+
+def logscaled_plot(df_final, savefolder, savelabel, show = True, save = False):
     
     '''
     FIGURE OF MEAN, LOG, SCALED data
@@ -23,6 +90,10 @@ def logscaled_plot(df_final, savefolder, savelabel):
         figures_folder > where figures are stored
       savelabel
         Climate_Type_1_Station_Name'
+      show
+        plt.show() the figure
+      save
+        Save the figure as savefolder/raw_<savelabel>.eps
     
     Returns
     --------
@@ -52,10 +123,10 @@ def logscaled_plot(df_final, savefolder, savelabel):
     plt.title(f'Scale of Subset Data (Log), {mean_scale}')
     plt.ylabel('Scaled Data')
     plt.xlabel('Time')
-    #plt.savefig(f'{savefolder}/raw_{savelabel}.eps', dpi = 600)
-    plt.show()
     
-def detrend_plot(df, savefolder, savelabel):
+    return _finish( fig, show, f'{savefolder}/raw_{savelabel}.eps' if save else None )
+    
+def detrend_plot(df, savefolder, savelabel, show = True, save = True):
     '''
     FIGURE OF DETREND AND DESEASONED data
     
@@ -68,6 +139,10 @@ def detrend_plot(df, savefolder, savelabel):
         figures_folder > where figures are stored
       savelabel
         Climate_Type_1_Station_Name'
+      show
+        plt.show() the figure
+      save
+        Save the figure as savefolder/detrend_<savelabel>.eps
     
     Returns
     --------
@@ -83,10 +158,10 @@ def detrend_plot(df, savefolder, savelabel):
     plt.ylabel('Scaled De-Trend and De-Season Discharge (monthly)')
     plt.xlabel('Time')
     plt.legend(loc=4)
-    plt.savefig(f'{savefolder}/detrend_{savelabel}.eps', dpi = 600)
-    plt.show()
     
-def data_enso_plot(df_final,savefolder,savelabel, color_plot):
+    return _finish( fig, show, f'{savefolder}/detrend_{savelabel}.eps' if save else None )
+    
+def data_enso_plot(df_final,savefolder,savelabel, color_plot, crit_name, crit_number, crit_label, show = True, save = False):
     '''
     CLEAN DATA FIGURES with ENSO
     
@@ -101,6 +176,16 @@ def data_enso_plot(df_final,savefolder,savelabel, color_plot):
         Climate_Type_1_Station_Name'
       color_plot
         CTI - black ; CTII - green ; CTIII - orange; CTIV - brown
+      crit_name
+        Climate Type or CPE
+      crit_number
+        Category of the criteria, e.g. I through IV
+      crit_label
+        River = River Discharge; Rainfall = Station Name
+      show
+        plt.show() the figure
+      save
+        Save the figure as savefolder/one_plot<savelabel>.eps
     
     Returns
     --------
@@ -124,11 +209,12 @@ def data_enso_plot(df_final,savefolder,savelabel, color_plot):
     ax2.set_ylabel('Nino 3.4 rel (°C)', color='k')
     ax2.set_xlabel('Time (CE)')
     ax1.legend(loc='best')
-    #plt.savefig(f'{savefolder}/one_plot{savelabel}.eps', dpi = 600)
-    plt.show()
+    
+    return _finish( fig, show, f'{savefolder}/one_plot{savelabel}.eps' if save else None )
 
     
-def climatology_plot( df_final, savefolder, crit_name, crit_number ):
+def climatology_plot( df_final, savefolder, crit_name, crit_number, show = True, cube = None, station = 'data_mean',
+                      save = False ):
     ''' 
     Climatologies as box plots
     
@@ -141,25 +227,56 @@ def climatology_plot( df_final, savefolder, crit_name, crit_number ):
         Station and River name
       crit_number
         I through IV
+      show
+        plt.show() the figure
+      cube
+        Precomputed climatology_cube holding station (e.g. the climatology_rain pipeline
+        stage); None computes it from df_final
+      station
+        Column of the cube to draw
+      save
+        Save the figure as savefolder/BoxPlot_<crit_name>_<crit_number>.eps
     
     Returns
     --------
       
       Daily Historical Discharge Data Table.
     ''' 
-    month_list = [ i for i in range(1,13) ]
-    print(month_list)
-    month_group  = []
-
-    for  group in df_final.groupby( df_final['month'] ):
-        month_group.append( list(group[1]['data_mean']) ) 
+    if cube is None:
+        cube = climatology_cube( df_final[['date','data_mean']], 'date' )
+    stats = bxp_stats( cube, station )
 
     fig, ax = plt.subplots(figsize=(15,7), nrows = 1, ncols =2 )
-    ax[0].boxplot( list(month_group), whis=True, positions=month_list, notch=1, autorange=True, showfliers=True )
+    ax[0].bxp( stats, positions=cube['months'], shownotches=True, showfliers=True )
     plt.xlabel('Months')
     plt.ylabel('(mm/month)')
-    ax[1].boxplot( list(month_group), whis=True, positions=month_list, notch=1, autorange=True, showfliers=False )
+    ax[1].bxp( stats, positions=cube['months'], shownotches=True, showfliers=False )
     plt.title(f'{crit_name} {crit_number}')
     plt.ylim( [0,1200] )
-    #plt.savefig(f'{savefolder}/BoxPlot_Discharge_CT IV.eps', dpi = 600)
-    plt.show()
\ No newline at end of file
+    
+    return _finish( fig, show, f'{savefolder}/BoxPlot_{crit_name}_{crit_number}.eps' if save else None )
+
+def climatology_bar( cube, station, savefile = None, stat = 'mean', color = 'maroon', show = True ):
+    
+    '''
+    Month of year climatology of one station as a bar chart
+    
+    Parameters
+    ---------
+      
+      cube
+        climatology_cube output
+      station
+        Station (column) name
+      savefile
+        Figure file, None to skip saving
+      stat
+        Statistic of the cube drawn (mean, median, q90, ...)
+      show
+        plt.show() the figure
+    '''
+    fig = plt.figure()
+    plt.bar( cube['months'], cube_stat( cube, stat )[station], color = color, width = 0.6 )
+    plt.xlabel( 'Month' )
+    
+    return _finish( fig, show, savefile )
\ No newline at end of file
@@ -1,14 +1,67 @@
 import pandas as pd
 import numpy as np
-import datetime
 #import contextily as cx
-import xlrd
 import os
 import glob
-from IPython.display import display
-from functools import reduce
+from functools import partial
 
-def prep_index_data( parent_dir, filename, title ):
+from .indices    import index_dates
+from .cache      import cached_read_excel, cached_read_csv, HAS_PARQUET
+from .instrument import instrumented, log
+from .load_data  import get_his_dis, get_drainage, extract_file
+from .parallel   import map_files
+from .qc         import qc_flags, apply_flags, monthly_totals, loader_options, NO_DATA
+
+@instrumented
+def align_stations( series, labels, date_name = 'Date' ):
+    
+    '''
+    Align station series onto one shared, sorted date index in a single pass. 
+    Replaces chains of pairwise outer merges, whose cost grows quadratically with 
+    the number of stations.
+    
+    Parameters
+    ---------
+      
+      series
+        List of Series indexed by date, one per station
+        
+      labels
+        Station labels, one per series
+        
+      date_name
+        Name of the date column of the output
+    
+    Returns
+    --------
+      
+      Table with the date column followed by one float column per station. 
+      Dates missing from a station are NaN.
+    '''
+    
+    if len( series ) == 0:
+        return pd.DataFrame( columns = [date_name] + list( labels ) )
+    
+    dates = pd.DatetimeIndex( np.unique( np.concatenate( [ s.index.to_numpy( dtype = 'datetime64[ns]' ) 
+                                                          for s in series ] ) ) )
+    dates = dates[dates.notna()]
+    
+    values = np.full( ( len( dates ), len( series ) ), np.nan )
+    for j, s in enumerate( series ):
+        pos  = dates.get_indexer( s.index )
+        keep = pos >= 0
+        values[pos[keep], j] = pd.to_numeric( s, errors = 'coerce' ).to_numpy( dtype = float )[keep]
+    
+    df = pd.DataFrame( values, columns = list( labels ) )
+    df.insert( 0, date_name, dates )
+    
+    return df
+
+# first month of the fixed index calendar (the month start after 1854-01-15)
+INDEX_START = '1854-02-01'
+
+@instrumented
+def prep_index_data( parent_dir, filename, title, infer_dates = False ):
     
     '''
     Load Indices Dataset and add Quality Contorl (QC) indeces
@@ -26,6 +79,11 @@ def prep_index_data( parent_dir, filename, title ):
     
       title
         column name of Index data. Not used
+        
+      infer_dates
+        False: row k is dated INDEX_START + k months, the calendar the notebook results
+        were made with (it labels every row one month after its Year value).
+        True: dates from the Year column (index_dates), e.g. 1854.042 is 1854-01.
     
     Returns
     --------
@@ -33,19 +91,69 @@ def prep_index_data( parent_dir, filename, title ):
       Dataframe containing monthly indeces
     '''
     
-    print( 'Prep Index data' )
+    log( 'Prep Index data' )
     
     file = os.path.join( parent_dir, f'{filename}.csv'  )
     df   = pd.read_csv( file )
     
     df.columns = [ 'Year','ssta (°C)' ]
-    df['time'] = pd.DataFrame( {'time': pd.date_range('1854-01-15','2021-07-15', 
-                      freq='MS').strftime('%Y-%m').tolist()} )
-    df['date'] = pd.to_datetime( df['time'] )
+    if infer_dates:
+        df['date'] = index_dates( df['Year'] )
+    else:
+        df['date'] = pd.date_range( INDEX_START, periods = len( df ), freq = 'MS' )
+    df['time'] = df['date'].dt.strftime('%Y-%m')
+    df         = df[[ 'Year','ssta (°C)','time','date' ]]
     
     return df
     
-def prep_mod_rain_data( folder ):
+@instrumented
+def read_mod_rain_file( filename, cache_dir = None, qc = None ):
+    
+    '''
+    Read one Modern rainfall workbook and sum it to monthly totals over the valid days.
+    
+    Parameters
+    ---------
+      
+      filename
+        Excel file with daily rainfall of one station
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+        
+      qc
+        QC options (see qc.loader_options). Blanks and 99.99 are flagged missing, 
+        months without valid days or summing to zero are NaN.
+    
+    Returns
+    --------
+      
+      Station label (mod_<station>)
+      Dataframe containing monthly totals (Prpmm, units in mm) and their QC flags (qc, uint8)
+    '''
+    
+    df = cached_read_excel( filename, cache_dir, header = 0 )
+    
+    options, masks = loader_options( qc, MOD_RAIN_SENTINELS )
+    values, flags  = qc_flags( df['PRCP Inch'], **options )
+    
+    date = assemble_dates( df['YEAR'], df['MONTH'], df['DAY'] )
+    if np.isnat( date ).any():
+        row = int( np.argmax( np.isnat( date ) ) )
+        raise ValueError( f'{filename}: invalid date {df.loc[row, ["YEAR", "MONTH", "DAY"]].tolist()}' )
+    
+    month = monthly_totals( values, date, flags, masks['mask'], masks['min_days'] )
+    
+    df_2 = pd.DataFrame( { 'Date' : month['months'],
+                           'Prpmm': apply_flags( month['sums'], month['flags'], masks['month_mask'] )[:, 0],
+                           'qc'   : month['flags'][:, 0] } )
+    
+    label = f"mod_{filename.split('/')[-1].split('.')[0].lower()}"
+    
+    return label, df_2
+    
+@instrumented
+def prep_mod_rain_data( folder, cache_dir = None, n_jobs = 1, backend = 'process', qc = None, return_flags = False ):
     
     '''
     Prepare Modern rainfall data. 
@@ -56,65 +164,98 @@ def prep_mod_rain_data( folder ):
       folder
         Input data file name
         
-      labelname
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+        
+      n_jobs
+        Number of workers reading the files (see parallel.py). 1 reads serially.
+        
+      backend
+        'process' or 'thread' pool
+        
+      qc
+        QC options of the daily values and monthly totals (see qc.loader_options)
+        
+      return_flags
+        Also return the monthly QC flags
     
     Returns
     --------
       
-      Dataframe containing monthly totals. Units in mm.
+      Dataframe containing monthly totals. Units in mm. Stations in sorted file order.
       Label of rain stations
+      Table of uint8 QC flags in the layout of the totals (see qc.py), if return_flags
     '''
-    print( 'Prep Modern data' )
+    log( 'Prep Modern data' )
     
     all_files = glob.glob( folder + '/*.xlsx' )
     
-    l_df_rain = []
-    l_label   = ['Date']
-    rain_dic  = {}
+    results   = map_files( partial( read_mod_rain_file, cache_dir = cache_dir, qc = qc ), all_files, n_jobs, backend )
+    
+    l_df_rain = [ df_2 for _, df_2 in results ]
+    l_label   = ['Date'] + [ label for label, _ in results ]
 
-    for filename in all_files:
-        
-        df = pd.read_excel( filename, header = 0 )
+    df_final_rain = align_stations( [ df_2.set_index( 'Date' )['Prpmm'] for df_2 in l_df_rain ], l_label[1:], 'Date' )
+    
+    if return_flags:
+        return df_final_rain, l_label, _align_flags( [ df_2.set_index( 'Date' )['qc'] for df_2 in l_df_rain ], 
+                                                     l_label[1:], 'Date' )
+    
+    return df_final_rain, l_label
 
-        df['PRCP Inch'] = df['PRCP Inch'].replace(' ',np.NaN).astype(float)
-        #df['PRCP Inch'] = df['PRCP Inch'].replace(0,np.NaN).astype(float)
+def _align_flags( series, labels, date_name ):
+    
+    'align_stations of QC flag series, dates missing from a station flagged NO_DATA'
+    
+    df   = align_stations( series, labels, date_name )
+    cols = list( labels )
+    df[cols] = df[cols].fillna( NO_DATA ).astype( np.uint8 )
     
-        df.replace(99.99, np.nan, inplace=True)
-        df['Date'] = df.apply( lambda x: datetime.datetime( int(x['YEAR']), int(x['MONTH']), int(x['DAY']) ), axis = 1 )
+    return df
+    
+    
+# column names of year, month and day in the daily rainfall grids (1901_1940Rainfall.csv, Rainfall1951_1990.csv)
+RAIN_DATE_COLUMNS = {'Unnamed: 0':'year', 'Unnamed: 1':'month', 'name':'day'}
 
-        df['Prpmm'] = df['PRCP Inch'] 
-        
-        df_mon_sum  = df.resample('MS', on = 'Date').sum().reset_index()
-        df_mon_sum.replace(0.0, np.nan, inplace = True)
-        df_mon_sum.replace(0.00, np.nan, inplace = True)
-        df_2        = df_mon_sum.drop( ['YEAR','MONTH','DAY', 'PRCP Inch'],axis = 1 )
-        l_df_rain.append(df_2)
-        #display(df_2)
-        
-        # appending year and label
-        temp_label = f"mod_{filename.split('/')[-1].split('.')[0].lower()}"
-        l_label.append(temp_label)
+# missing value markers of the daily rainfall grids, the Modern rainfall workbooks and the HESS discharge
+RAIN_NA_VALUES     = ['?']
+RAIN_MISSING       = -999
+MOD_RAIN_SENTINELS = ( 99.99, )
+DIS_SENTINELS      = ( 0, )
 
-    #df_final_rain = reduce( lambda left,right: pd.merge( left,right,on='Date', how='outer', suffixes = ('','') ), l_df_rain[:2] )
+def _rain_monthly( df_p, labelname, options, masks ):
     
-    for i, x in enumerate( l_df_rain ):
-        
-        if i == 0: 
-            df_final_rain = x
-        else:
-            df_final_rain = pd.merge( df_final_rain, x, on = 'Date', how = 'outer', suffixes = (l_label[i],l_label[i+1]))  
-        
-    df_final_rain = df_final_rain.drop(['Unnamed: 4'],axis = 1)
-    df_final_rain.columns = l_label
+    'Monthly sums and QC flags of a typed chunk of a daily rainfall grid, as labelled columns'
     
-    return df_final_rain, l_label
+    values, flags = qc_flags( df_p.to_numpy(), **options )
+    
+    date = assemble_dates( values[:, 0], values[:, 1], values[:, 2] )
+    if np.isnat( date ).any():
+        row = int( np.argmax( np.isnat( date ) ) )
+        raise ValueError( f'Invalid date in rainfall grid: {values[row, :3].tolist()}' )
     
+    names   = [ RAIN_DATE_COLUMNS.get( label, label ) for label in df_p.columns ]
+    columns = [ f"{labelname}_{label.lower()}" for label in names ]
+    month   = monthly_totals( values, date, flags, masks['mask'], masks['min_days'] )
     
-def prep_rain_data( filename, labelname ):
+    index = pd.DatetimeIndex( month['months'], name = 'Date' )
+    
+    return pd.DataFrame( month['sums'], index = index, columns = columns ), \
+           pd.DataFrame( month['flags'], index = index, columns = columns )
+
+@instrumented
+def prep_rain_data( filename, labelname, cache_dir = None, stations = None, chunksize = None, qc = None, 
+                    return_flags = False ):
     
     '''
     Prepare historical and mid(gridded century) data.
     
+    The two metadata rows below the header are skipped, '?' is read as missing and 
+    every column is parsed as float while reading, dates are assembled from the year, 
+    month and day columns in one vectorised step. -999 is flagged as a sentinel (see 
+    qc.py) and left out of the monthly sums, months without valid days or summing to 
+    zero are NaN.
+    
     Parameters
     ---------
       
@@ -124,37 +265,76 @@ def prep_rain_data( filename, labelname ):
       labelname
         Data label name. hist for historical data and mid for mid
         century data. 
+        
+      cache_dir
+        Snapshot cache directory for the csv file (see cache.py). None disables caching.
+        
+      stations
+        Station columns to read (names as in the file header, kept in file order), None for all
+        
+      chunksize
+        Read and sum this many daily rows at a time instead of the whole file. Rows 
+        of a month that continues in the next chunk are carried over, so the monthly
+        sums are the same as without chunks. Not cached.
+        
+      qc
+        QC options of the daily values and monthly totals (see qc.loader_options)
+        
+      return_flags
+        Also return the monthly QC flags
     
     Returns
     --------
       
       Dataframe containing monthly totals. Units in mm.
+      Its columns
+      Table of uint8 QC flags in the layout of the totals, if return_flags
     
     '''
-    print( 'Prep Historical/Mid data' )
+    log( 'Prep Historical/Mid data' )
     
-    df_p      = pd.read_csv( filename )
+    header  = pd.read_csv( filename, nrows = 0 ).columns
+    columns = list( RAIN_DATE_COLUMNS ) + [ c for c in header if c not in RAIN_DATE_COLUMNS and 
+                                            ( stations is None or c in stations ) ]
+    read_kw = dict( skiprows = [1, 2], usecols = columns, na_values = RAIN_NA_VALUES, 
+                    dtype = { c: float for c in columns } )
     
-    df_p      = df_p.iloc[2:].reset_index() \
-                             .drop( columns='index' ) \
-                             .rename(columns = {'Unnamed: 0':'year','Unnamed: 1':'month', 'name':'day'} ) \
-                             .replace('?',-999) \
-                             .replace(0.0,np.nan) \
-                             .astype(float)
+    options, masks = loader_options( qc, ( RAIN_MISSING, ) )
     
-    df_p.replace(-999, np.nan, inplace=True)
-    #df_p.replace(0.0, np.nan, inplace = True)
-    df_p.columns = [ f"{labelname}_{label.lower()}" for label in df_p.columns  ]
-    df_p
+    if chunksize is None:
+        df_p = cached_read_csv( filename, cache_dir, **read_kw )[columns]
+        sums, flags = _rain_monthly( df_p, labelname, options, masks )
     
-    df_p['Date'] = df_p.apply(lambda x: datetime.datetime( int(x[f'{labelname}_year']), int(x[f'{labelname}_month']), 
-                                           int(x[f'{labelname}_day'])), axis = 1 )
-
-    df_2= df_p.resample('MS', on='Date').sum().reset_index()
-    df_2.replace(0.0, np.nan, inplace = True)
+    else:
+        parts, carry = [], None
+        for chunk in pd.read_csv( filename, chunksize = chunksize, **read_kw ):
+            chunk = chunk[columns] if carry is None else pd.concat( [ carry, chunk[columns] ], ignore_index = True )
+            
+            # hold back the rows of the last month, it may continue in the next chunk
+            month = chunk[columns[0]].to_numpy() * 12 + chunk[columns[1]].to_numpy()
+            last  = month == month[-1]
+            carry = chunk[last]
+            if ( ~last ).any():
+                parts.append( _rain_monthly( chunk[~last], labelname, options, masks ) )
+        
+        if carry is not None and len( carry ):
+            parts.append( _rain_monthly( carry, labelname, options, masks ) )
+        
+        # months are complete in every part; months between parts have no data
+        sums   = pd.concat( [ p[0] for p in parts ] )
+        flags  = pd.concat( [ p[1] for p in parts ] )
+        months = pd.date_range( sums.index.min(), sums.index.max(), freq = 'MS', name = 'Date' )
+        sums, flags = sums.reindex( months, fill_value = 0 ), flags.reindex( months, fill_value = NO_DATA )
+    
+    df_2 = pd.DataFrame( apply_flags( sums.to_numpy(), flags.to_numpy(), masks['month_mask'] ), 
+                         index = sums.index, columns = sums.columns ).reset_index()
+    
+    if return_flags:
+        return df_2, df_2.columns, flags.reset_index()
     
     return df_2, df_2.columns
     
+@instrumented
 def prep_his_dis_dic( df_index,df ):
 
     '''
@@ -184,7 +364,7 @@ def prep_his_dis_dic( df_index,df ):
     for i in df_index:
         # get year
         year=df['Unnamed: 12'].loc[i]
-        print( f'Prep Historical Discharge Data for {year}' )
+        log( f'Prep Historical Discharge Data for {year}', level = 2, year = year )
         # slicing for days
         df_temp = df.loc[i+2:i+34].dropna(axis=1, how = 'all')
         
@@ -200,7 +380,317 @@ def prep_his_dis_dic( df_index,df ):
         
     return dic_temp
 
-def prep_mod_dis_data( folder ): 
+def assemble_dates( year, month, day ):
+
+    '''
+    Vectorised datetime.datetime(year, month, day) over integer arrays.
+    
+    Returns
+    --------
+      
+      datetime64[ns] array, NaT where the day does not exist in that month
+    '''
+    
+    year  = np.asarray( year, dtype = np.int64 )
+    month = np.asarray( month, dtype = np.int64 )
+    day   = np.asarray( day, dtype = np.int64 )
+    
+    first = ( ( year - 1970 ) * 12 + month - 1 ).astype( 'datetime64[M]' )
+    n_day = ( ( first + 1 ).astype( 'datetime64[D]' ) - first.astype( 'datetime64[D]' ) ).astype( np.int64 )
+    date  = ( first.astype( 'datetime64[D]' ) + ( day - 1 ) ).astype( 'datetime64[ns]' )
+    
+    date[( day < 1 ) | ( day > n_day ) | ( month < 1 ) | ( month > 12 )] = np.datetime64( 'NaT' )
+    
+    return date
+
+# month labels used in the header row of the historical discharge year blocks
+MONTH_LOOKUP = {'JAN':1, 'FEB':2,  'MAR':3, 'APR':4,'MAY':5, 'JUN':6, 'JUL':7, 'AUG':8,
+                'SEP':9, 'SEPT':9,'OCT':10, 'NOV':11, 'DEC':12}
+
+@instrumented
+def prep_his_dis_long( df_index, df, station ):
+
+    '''
+    Reshape every year block of a Historical Discharge sheet into one long table in a 
+    single pass. Block layout (relative to the year row i found by get_his_dis): row 
+    i+2 holds the month names, row i+3 the units and rows i+4 to i+34 days 1 to 31.
+        
+    Parameters
+    ---------
+      
+      df_index
+        Index of the year rows, output of get_his_dis
+        
+      df
+        Excel Data for Historical Drainage 
+        
+      station
+        Station label stored in the station column
+    
+    Returns
+    --------
+      
+      Table with station, date, day and discharge (l/sec) sorted by date. Days that
+      do not exist (e.g. 30 FEB) are dropped, missing readings are kept as NaN.
+    
+    '''
+    
+    values = df.drop( columns = ['splice'], errors = 'ignore' ).to_numpy( dtype = object )
+    n_rows = len( values )
+    pos    = df.index.get_indexer( df_index )
+    years  = pd.to_numeric( df['Unnamed: 12'].to_numpy()[pos] ).astype( int )
+    
+    # month number of every column of every block header row, 0 if not a month
+    header = values[np.minimum( pos + 2, n_rows - 1 )]
+    months = pd.Series( np.char.upper( np.char.strip( header.ravel().astype( str ) ) ) ) \
+                                        .map( MONTH_LOOKUP ).fillna( 0 ).to_numpy( dtype = int ) \
+                                        .reshape( header.shape )
+    months[pos + 2 >= n_rows] = 0
+    
+    # (block, day, column) cube of the 31 day rows of every block
+    rows   = pos[:, None] + np.arange( 4, 35 )
+    inside = rows < n_rows
+    cube   = values[np.minimum( rows, n_rows - 1 )]
+    cube[~inside] = np.nan
+    
+    block, col = np.nonzero( months )
+    flat       = cube[block, :, col]
+    
+    n_days = flat.shape[1]
+    year   = np.repeat( years[block], n_days )
+    month  = np.repeat( months[block, col], n_days )
+    day    = np.tile( np.arange( 1, n_days + 1 ), len( block ) )
+    
+    date = assemble_dates( year, month, day )
+    
+    df_long = pd.DataFrame( {
+        'station'  : station,
+        'date'     : date,
+        'day'      : day,
+        'discharge': pd.to_numeric( pd.Series( flat.ravel() ), errors = 'coerce' ).to_numpy( dtype = float ),
+    } )
+    df_long = df_long[df_long['date'].notna()].sort_values( 'date', kind = 'stable' ).reset_index( drop = True )
+    
+    return df_long
+
+@instrumented
+def read_his_dis_file( name, cache_dir = None ):
+
+    '''
+    Read one Historical Discharge workbook.
+    
+    Parameters
+    ---------
+      
+      name
+        Excel file with historical discharge data of one river
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+    
+    Returns
+    --------
+      
+      Key (<folder>_<river>)
+      Dictionary with the yearly data tables, the drainage area and the long daily
+      table of the same sheet (prep_his_dis_long)
+    
+    '''
+    
+    label = name.split('/')[-1] \
+                .split('.')[0] \
+                .replace(' ', '_') \
+                .replace('(', '') \
+                .replace(')', '')
+    fol   = name.split('/')[-2].lower()
+    log( label, level = 2 )
+    
+    df_excel = cached_read_excel( name, cache_dir )
+    df_index = get_his_dis( df_excel )
+    
+    return f"{fol}_{label}", { 'data'    : prep_his_dis_dic( df_index, df_excel ),
+                               'drainage': get_drainage( df_excel ),
+                               'long'    : prep_his_dis_long( df_index, df_excel, f"{fol}_{label}" ) }
+
+@instrumented
+def load_his_dis_data( folder, cache_dir = None, n_jobs = 1, backend = 'process' ):
+
+    '''
+    Load every Historical Discharge workbook in folder into the dictionary used by 
+    prep_his_dis_data and dump_inst_hist_dis.
+    Example: dic_data['historical_Maragayap']['data'][1922]
+    
+    Parameters
+    ---------
+      
+      folder
+        Folder name where historical discharge files are stored
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+        
+      n_jobs
+        Number of workers reading the files (see parallel.py). 1 reads serially.
+        
+      backend
+        'process' or 'thread' pool
+    
+    Returns
+    --------
+      
+      Dictionary with Historical Drainage Data and drainage areas, in sorted file order
+    
+    '''
+    
+    results = map_files( partial( read_his_dis_file, cache_dir = cache_dir ), extract_file( folder ), n_jobs, backend )
+        
+    return dict( results )
+
+@instrumented
+def read_his_dis_long( name, cache_dir = None ):
+
+    '''
+    Read one Historical Discharge workbook as a long daily table (see prep_his_dis_long).
+    
+    Parameters
+    ---------
+      
+      name
+        Excel file with historical discharge data of one river
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+    
+    Returns
+    --------
+      
+      Long table with station, date, day and discharge (l/sec)
+      Drainage area in sq kms
+    
+    '''
+    
+    label = name.split('/')[-1] \
+                .split('.')[0] \
+                .replace(' ', '_') \
+                .replace('(', '') \
+                .replace(')', '')
+    fol   = name.split('/')[-2].lower()
+    
+    df_excel = cached_read_excel( name, cache_dir )
+    df_index = get_his_dis( df_excel )
+    
+    return prep_his_dis_long( df_index, df_excel, f"{fol}_{label}" ), get_drainage( df_excel )
+
+@instrumented
+def load_his_dis_long( folder, cache_dir = None, n_jobs = 1, backend = 'process' ):
+
+    '''
+    Load every Historical Discharge workbook in folder as one long daily table.
+    
+    Parameters
+    ---------
+      
+      folder
+        Folder name where historical discharge files are stored
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+        
+      n_jobs
+        Number of workers reading the files (see parallel.py). 1 reads serially.
+        
+      backend
+        'process' or 'thread' pool
+    
+    Returns
+    --------
+      
+      Long table with station (categorical, sorted), date, day and discharge (l/sec)
+      Dictionary of drainage areas (sq kms) by station
+    
+    '''
+    
+    results  = map_files( partial( read_his_dis_long, cache_dir = cache_dir ), extract_file( folder ), n_jobs, backend )
+    
+    df_long  = pd.concat( [ d for d, _ in results ], ignore_index = True )
+    stations = [ d['station'].iat[0] for d, _ in results if len( d ) ]
+    drainage = { d['station'].iat[0]: area for d, area in results if len( d ) }
+    df_long['station'] = pd.Categorical( df_long['station'], categories = stations )
+    
+    return df_long, drainage
+
+@instrumented
+def load_his_dis_monthly( folder, cache_dir = None, n_jobs = 1, backend = 'process', min_fraction = 0.0, month_days = 30 ):
+
+    '''
+    Monthly Historical Discharge of every workbook in folder, parsed straight into the
+    long daily table (load_his_dis_long) without the per year tables. Same output as
+    prep_his_dis_data( load_his_dis_data( folder ) ).
+    
+    Parameters
+    ---------
+      
+      folder
+        Folder name where historical discharge files are stored
+        
+      cache_dir, n_jobs, backend
+        See load_his_dis_long
+        
+      min_fraction
+        Fewest valid days per month, as a fraction of its days (see prep_his_dis_monthly)
+        
+      month_days
+        Days per month of the l/sec to mm/month conversion (see prep_his_dis_monthly)
+    
+    Returns
+    --------
+      
+      Table with Historical Discharge data per station. Units of mm/month.
+    
+    '''
+    
+    log( 'Prep Historic Discharge Data' ) 
+    
+    df_long, drainage = load_his_dis_long( folder, cache_dir, n_jobs, backend )
+    
+    return his_dis_monthly_dict( prep_his_dis_monthly( df_long, drainage, min_fraction, month_days ) )
+
+@instrumented
+def read_mod_dis_file( filename, cache_dir = None ):
+    
+    '''
+    Read one Modern Discharge workbook (from Ibarra et al. 2020).
+    
+    Parameters
+    ---------
+      
+      filename
+        Excel file with monthly discharge of one river
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+  
+    Returns
+    --------
+      
+      River label (hess_<river>)
+      Table with date and discharge in mm/month
+    '''
+    
+    df = cached_read_excel(filename, cache_dir, header=0)
+
+    label = 'hess_'+df.iat[0,1].split(sep=' River')[0].lower()
+    
+    # reading only needed rows and columns
+    df = df.iloc[4:-1, 0:2]
+    
+    # changing column to date time as soon as reading it in
+    df['Major River Basin'] = pd.to_datetime( df.iloc[: , 0], yearfirst = True )
+    
+    return label, df
+
+@instrumented
+def prep_mod_dis_data( folder, cache_dir = None, n_jobs = 1, backend = 'process', qc = None, return_flags = False ): 
     
     '''
         
@@ -210,56 +700,63 @@ def prep_mod_dis_data( folder ):
       folder
         Directory to where Modern Discharge data (from Ibarra et al.   
         2020) is stored 
+        
+      cache_dir
+        Snapshot cache directory for the Excel files (see cache.py). None disables caching.
+        
+      n_jobs
+        Number of workers reading the files (see parallel.py). 1 reads serially.
+        
+      backend
+        'process' or 'thread' pool
+        
+      qc
+        QC options (see qc.loader_options). Zeros are flagged as missing.
+        
+      return_flags
+        Also return the QC flags
          
   
     Returns
     --------
       
-      df_final    = Table with Discharge data in mm/month. 
+      df_final    = Table with Discharge data in mm/month. Rivers in sorted file order.
       hess_labels = Discharge River Names as labels 
+      df_flags    = Table of uint8 QC flags in the layout of df_final, if return_flags
     
     '''
     
-    print( 'Prep Modern Discharge Data' ) 
+    log( 'Prep Modern Discharge Data' ) 
     
     
     directory = folder
     all_files = glob.glob(directory + '/*.xlsx')
     
-    l_df = []
-    l_label = ['Year']
-    hess_dic = {}
+    results = map_files( partial( read_mod_dis_file, cache_dir = cache_dir ), all_files, n_jobs, backend )
     
-    for filename in all_files:
-
-        df = pd.read_excel(filename, header=0)
-
-        # appending year and label
-        temp_label = 'hess_'+df.iat[0,1].split(sep=' River')[0].lower()
-        l_label.append(temp_label)
-        
-        # reading only needed rows and columns
-        df = df.iloc[4:-1, 0:2]
-        
-        # changing column to date time as soon as reading it in
-        df['Major River Basin'] = pd.to_datetime( df.iloc[: , 0], yearfirst = True )
-        l_df.append(df)
+    l_df    = [ df for _, df in results ]
+    l_label = ['Year'] + [ label for label, _ in results ]
     
-    # merging based on time
-    df_final = reduce(lambda left,right: pd.merge(left,right,on='Major River Basin', how = 'outer'), l_df)
+    # aligning all rivers on one date index
+    df_final = align_stations( [ df.set_index( 'Major River Basin' ).iloc[:, 0] for df in l_df ], l_label[1:], 'Year' )
 
-    df_final.columns = l_label
     # storing hess_labels
     hess_labels      = df_final.columns
-
-    df_final         = df_final.sort_values(by='Year')
     
-    df_final.replace( 0, np.nan, inplace = True )
-    df_final = df_final.reset_index( drop=True )
+    # zeros are missing values in the HESS workbooks
+    options, masks = loader_options( qc, DIS_SENTINELS )
+    values, flags  = qc_flags( df_final[hess_labels[1:]].to_numpy(), **options )
+    df_final[hess_labels[1:]] = apply_flags( values, flags, masks['mask'] )
+    
+    if return_flags:
+        df_flags = pd.DataFrame( flags, columns = hess_labels[1:] )
+        df_flags.insert( 0, 'Year', df_final['Year'] )
+        return df_final, hess_labels, df_flags
     
     return df_final, hess_labels
 
 
+@instrumented
 def merge_rain_data( df_a, df_b, list_a, list_b, drop_list, mlabel): 
 
     '''
@@ -292,34 +789,183 @@ def merge_rain_data( df_a, df_b, list_a, list_b, drop_list, mlabel):
       Table with Discharge data and labels. Units of mm/month. 
     
     '''
-    for clean_name, name in zip( 
-            list_a, 
-            df_a.columns[4:] 
-        ):
+    names = list( df_a.columns[4:] )
+    
+    # Outer join data A (historical) and data B (modern) data on dates, once for all stations
+    df_a  = df_a.set_index( 'Date' )[names]
+    df_b  = df_b.set_index( 'Date' )
+    dates = df_b.index.union( df_a.index )
+    df_a  = df_a.reindex( dates )
+    df_b  = df_b.reindex( dates )
+    
+    columns = { c: df_b[c] for c in df_b.columns }
+    
+    for clean_name, name in zip( list_a, names ):
+        
+        columns[name] = df_a[name]
+        
+        if clean_name in list_b:
 
-        # Outer join data A (historical) and data B (modern) data on dates
-        df_b = df_b.merge( 
-            df_a[['Date',name]], 
-            how      = 'outer', 
-            on       = 'Date',  
-            validate = '1:1' 
-        )
+            # Coalesce data B (modern) and data A (historical) rain data
+            columns[clean_name] = columns[ f'{mlabel}_{clean_name}' ].combine_first( df_a[ name ] )
 
-        # Sort by date
-        df_b = df_b.sort_values('Date').reset_index(drop=True)  
+    df_b = pd.DataFrame( columns, index = dates ).rename_axis( 'Date' ).reset_index()
+    df_b = df_b.drop( drop_list , axis =1 )
+    
+    return df_b
 
+@instrumented
+def merge_dis_data( df_hess, hist_dis, drop_list ):
 
-        if clean_name in list_b:
+    '''
+    Merge Modern (HESS) and Historical discharge. Rivers present in both datasets are
+    coalesced into a column named after the river, preferring HESS values.
+        
+    Parameters
+    ---------
+      
+      df_hess
+        Modern discharge table, output of prep_mod_dis_data
+        
+      hist_dis
+        Dictionary of historical discharge tables, output of prep_his_dis_data
+        
+      drop_list
+         list of column names that will be dropped 
+  
+    Returns
+    --------
+      
+      Table with Discharge data and labels. Units of mm/month. 
+    
+    '''
+    
+    hist   = align_stations( [ v.set_index( 'Year' )[k] for k, v in hist_dis.items() ], list( hist_dis ), 'Year' )
+    
+    dates  = pd.DatetimeIndex( df_hess['Year'] ).union( pd.DatetimeIndex( hist['Year'] ) )
+    hess   = df_hess.set_index( 'Year' ).reindex( dates )
+    hist   = hist.set_index( 'Year' ).reindex( dates )
+    
+    columns = { c: hess[c] for c in hess.columns }
+    
+    for river_name in hist_dis:
+        
+        columns[river_name] = hist[river_name]
+        river_name_clean    = river_name.split('_')[1].lower()
+        
+        if f'hess_{river_name_clean}' in columns:
+            columns[river_name_clean] = columns[f'hess_{river_name_clean}'].combine_first( hist[river_name] )
+    
+    df_final = pd.DataFrame( columns, index = dates ).rename_axis( 'Year' ).reset_index()
+    
+    return df_final.drop( drop_list, axis = 1 )
 
-            # Coalesce data B (modern) and data A (historical) rain data
-            df_b[clean_name] = df_b[ f'{mlabel}_{clean_name}' ].combine_first( df_b[ name ])
+def _excel_cell( value ):
+    
+    'Cell value as to_excel writes it: missing values as empty cells, numpy scalars as Python values'
+    
+    if value is None or ( isinstance( value, float ) and np.isnan( value ) ) or value is pd.NaT:
+        return None
+    if isinstance( value, np.generic ):
+        return value.item()
+    
+    return value
 
+def _write_sheets( filename, sheets ):
+    
+    '''
+    Write (sheet name, table) pairs into one workbook with the openpyxl write-only 
+    writer, which streams every sheet to disk as it is written. Cells are laid out 
+    as DataFrame.to_excel does (index in the first column, header in the first row).
+    '''
+    
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Border, Side, Alignment
+    
+    wb     = Workbook( write_only = True )
+    thin   = Side( style = 'thin' )
+    font   = Font( bold = True )
+    border = Border( left = thin, right = thin, top = thin, bottom = thin )
+    align  = Alignment( horizontal = 'center', vertical = 'top' )
+    
+    def header( ws, value ):
+        # header and index cells styled as to_excel does
+        cell           = WriteOnlyCell( ws, value = _excel_cell( value ) )
+        cell.font      = font
+        cell.border    = border
+        cell.alignment = align
+        return cell
+    
+    for name, df in sheets:
+        ws = wb.create_sheet( title = name )
+        ws.append( [ _excel_cell( df.index.name ) ] + [ header( ws, c ) for c in df.columns ] )
+        for label, row in zip( df.index, df.itertuples( index = False, name = None ) ):
+            ws.append( [ header( ws, label ) ] + [ _excel_cell( v ) for v in row ] )
+    
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    wb.save( tmp )
+    os.replace( tmp, filename )
+    
+    return filename
 
-    df_b = df_b.drop( drop_list , axis =1 )
+def _write_station_workbook( item, folder ):
     
-    return df_b
+    'Workbook of the daily data of one station, one sheet per year (sharded export)'
+    
+    k, v = item
+    
+    return _write_sheets( os.path.join( folder, f'{k}.xlsx' ), 
+                          [ ( f'{k}-{year}', df_daily ) for year, df_daily in v['data'].items() ] )
 
-def dump_inst_hist_dis( dict_hist ):
+def hist_daily_long( dict_hist ):
+    
+    '''
+    Daily data of all stations and years as one long table.
+    
+    Parameters
+    ---------
+      
+      dict_hist
+        Historical Daily Discharge Data. 
+    
+    Returns
+    --------
+      
+      Table with station, date and discharge (l/sec) sorted by station and date. Days
+      that do not exist (e.g. 30 FEB) are dropped, missing readings are kept as NaN.
+    '''
+    
+    parts = []
+    for k, v in dict_hist.items():
+        for year, df_daily in v['data'].items():
+            months = [ c for c in df_daily.columns if str( c ).strip().upper() in MONTH_LOOKUP ]
+            values = df_daily[months].to_numpy( dtype = object )
+            day    = pd.to_numeric( df_daily['DAY'], errors = 'coerce' ).to_numpy()
+            month  = np.array( [ MONTH_LOOKUP[str( c ).strip().upper()] for c in months ] )
+            
+            ok   = ~np.isnan( day )
+            date = assemble_dates( np.full( ( ok.sum(), len( months ) ), int( year ) ), 
+                                   np.broadcast_to( month, ( ok.sum(), len( months ) ) ), 
+                                   np.repeat( day[ok][:, None], len( months ), axis = 1 ) )
+            parts.append( pd.DataFrame( { 
+                'station'  : k,
+                'date'     : date.T.ravel(),
+                'discharge': pd.to_numeric( pd.Series( values[ok].T.ravel() ), errors = 'coerce' ).to_numpy( dtype = float ),
+            } ) )
+    
+    if not parts:
+        return pd.DataFrame( { 'station': pd.Categorical( [] ), 'date': pd.to_datetime( [] ), 'discharge': [] } )
+    
+    df_long = pd.concat( parts, ignore_index = True )
+    df_long = df_long[df_long['date'].notna()].sort_values( ['station', 'date'], kind = 'stable' ).reset_index( drop = True )
+    df_long['station'] = df_long['station'].astype( 'category' )
+    
+    return df_long
+
+@instrumented
+def dump_inst_hist_dis( dict_hist, filename = 'Data/Requests/hist_daily.xlsx', mode = 'excel', n_jobs = 1, 
+                        backend = 'process' ):
     '''
     Dump daily data (l/sec) into excel file
     
@@ -328,26 +974,145 @@ def dump_inst_hist_dis( dict_hist ):
       
       dict
         Historical Daily Discharge Data. 
+        
+      filename
+        Output file. For mode 'sharded' the folder (filename without extension) that 
+        gets one workbook per station.
+        
+      mode
+        'excel'    one workbook, one sheet per station and year, streamed to disk sheet by sheet
+        'sharded'  one workbook per station (sheets per year), written in parallel
+        'columnar' one long table (station, date, discharge) as Parquet if pyarrow is 
+                   installed, csv otherwise
+        
+      n_jobs, backend
+        Workers for mode 'sharded' (see parallel.py)
+    
+    Returns
+    --------
       
+      List of the files written
     '''
     
-    with pd.ExcelWriter('Data/Requests/hist_daily.xlsx') as writer:      
+    folder = os.path.dirname( filename )
+    if folder:
+        os.makedirs( folder, exist_ok = True )
     
-        for k,v in dict_hist.items():
-
-            for year, df_daily in v['data'].items():
+    if mode == 'excel':
+        return [ _write_sheets( filename, ( ( f'{k}-{year}', df_daily ) for k,v in dict_hist.items() 
+                                                                      for year, df_daily in v['data'].items() ) ) ]
+    
+    if mode == 'sharded':
+        folder = os.path.splitext( filename )[0]
+        os.makedirs( folder, exist_ok = True )
+        return map_files( partial( _write_station_workbook, folder = folder ), list( dict_hist.items() ), n_jobs, backend )
+    
+    if mode == 'columnar':
+        df_long = hist_daily_long( dict_hist )
+        base    = os.path.splitext( filename )[0]
+        if HAS_PARQUET:
+            df_long.to_parquet( f'{base}.parquet', index = False )
+            return [ f'{base}.parquet' ]
+        df_long.to_csv( f'{base}.csv', index = False )
+        return [ f'{base}.csv' ]
+    
+    raise ValueError( f"mode must be 'excel', 'sharded' or 'columnar', got {mode!r}" )
+    
+@instrumented
+def prep_his_dis_monthly( df_long, drainage, min_fraction = 0.0, month_days = 30 ):
+    
+    '''
+    Monthly discharge of every station from a long daily table in one vectorised pass.
+    Change from l/sec (instantaneous) to mm/month:
+    [ [ Q (mean discharge) / A (drainage area) ] * 3600 * 24 * n of days ] / 10^6
+    
+    Parameters
+    ---------
+      
+      df_long
+        Long daily table with station, date and discharge (l/sec), output of 
+        load_his_dis_long or hist_daily_long
+        
+      drainage
+        Dictionary of drainage areas (sq kms) by station
+        
+      min_fraction
+        Fewest valid days, as a fraction of the days of the month, for a monthly 
+        value. Months below are NaN. 0 keeps every month with a reading.
+        
+      month_days
+        n of days of the conversion: 30 for every month, as the notebook outputs 
+        were made, or None for the actual length of each month
+    
+    Returns
+    --------
+      
+      Table with station (categorical), Year (month start), discharge (mm/month), 
+      valid_days and days, sorted by station and month
+    
+    '''
+    
+    station = pd.Categorical( df_long['station'] )
+    codes   = station.codes.astype( np.int64 )
+    month   = df_long['date'].to_numpy( dtype = 'datetime64[ns]' ).astype( 'datetime64[M]' ).astype( np.int64 )
+    q       = df_long['discharge'].to_numpy( dtype = float )
+    
+    first = month.min() if len( month ) else 0
+    span  = month.max() - first + 1 if len( month ) else 1
+    
+    # one group per station and month
+    keys, inv = np.unique( codes * span + ( month - first ), return_inverse = True )
+    valid     = ~np.isnan( q )
+    total     = np.bincount( inv, weights = np.where( valid, q, 0 ), minlength = len( keys ) )
+    n_valid   = np.bincount( inv, weights = valid, minlength = len( keys ) ).astype( int )
+    
+    st    = keys // span
+    start = ( keys % span + first ).astype( 'datetime64[M]' )
+    days  = ( ( start + 1 ).astype( 'datetime64[D]' ) - start.astype( 'datetime64[D]' ) ).astype( int )
+    area  = np.array( [ drainage[c] for c in station.categories ], dtype = float )[st]
+    
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        discharge = total / n_valid / area * 0.0864 * ( days if month_days is None else month_days )
+    discharge[( n_valid == 0 ) | ( n_valid < min_fraction * days )] = np.nan
+    
+    return pd.DataFrame( {
+        'station'   : pd.Categorical.from_codes( st, categories = station.categories ),
+        'Year'      : start.astype( 'datetime64[ns]' ),
+        'discharge' : discharge,
+        'valid_days': n_valid,
+        'days'      : days,
+    } )
 
-                  df_daily.to_excel( writer, sheet_name= f'{k}-{year}' )
-              
+def his_dis_monthly_dict( df_monthly, stations = None ):
     
-def prep_his_dis_data( dict_hist ):
+    '''
+    prep_his_dis_monthly output as the dictionary of prep_his_dis_data: one table 
+    (Year and a column named after the station) per station, in the order of stations.
+    '''
+    
+    stations = list( df_monthly['station'].cat.categories ) if stations is None else list( stations )
+    groups   = { k: g for k, g in df_monthly.groupby( 'station', observed = True ) }
+    
+    return { k: groups[k][['Year', 'discharge']].rename( columns = { 'discharge': k } ).reset_index( drop = True ) 
+             for k in stations if k in groups }
+
+@instrumented
+def prep_his_dis_data( dict_hist, min_fraction = 0.0, month_days = 30 ):
     
     ''' 
     Parameters
     ---------
       
       dict
-        Historical Daily Discharge Data. 
+        Historical Daily Discharge Data (load_his_dis_data output). The long daily
+        tables read with the workbooks are used when every station has one, the
+        yearly tables otherwise.
+        
+      min_fraction
+        Fewest valid days per month, as a fraction of its days (see prep_his_dis_monthly)
+        
+      month_days
+        Days per month of the l/sec to mm/month conversion (see prep_his_dis_monthly)
          
   
     Returns
@@ -357,36 +1122,13 @@ def prep_his_dis_data( dict_hist ):
     
     '''
     
-    print( 'Prep Historic Discharge Data' ) 
+    log( 'Prep Historic Discharge Data' ) 
     
-    dict_final = {}
+    if dict_hist and all( 'long' in v for v in dict_hist.values() ):
+        df_long = pd.concat( [ v['long'] for v in dict_hist.values() ], ignore_index = True )
+    else:
+        df_long = hist_daily_long( dict_hist )
     
-    for k,v in dict_hist.items():
-        
-        dict_final[k] = [] 
-
-        for year,df_daily in v['data'].items():
-            # Change from l/sec (instantaneous) to mm/month
-            # [ [ Q (mean discharge) / A (drainage area) ] * 3600 * 24 * n of days ] / 10^6
-
-            df_discharge = df_daily.copy()
-            
-            df_discharge = ( (( ( df_discharge.mean()/ v['drainage'] ) * 0.0864 * 30)).to_frame() )
-
-            
-            df_discharge = df_discharge.iloc[2: , :]
-            df_discharge.columns = [k]
-            df_discharge.index.names = ['Year']
-            df_discharge.reset_index(inplace=True)
-            look_up = {'JAN':1, 'FEB':2,  'MAR':3, 'APR':4,'MAY':5,
-                       'JUN':6, 'JUL':7, 'AUG':8 , 'SEPT':9,'OCT':10, 'NOV':11, 'DEC':12}
-            df_discharge['Year'] = df_discharge['Year'].map(lambda x: look_up[x])
-            df_discharge['Year'] = df_discharge['Year'].map(lambda x: datetime.datetime(year,x,1))
-            dict_final[k].append( df_discharge )
-
-        dict_final[k] = pd.concat(dict_final[k]).reset_index(drop=True)
+    monthly = prep_his_dis_monthly( df_long, { k: v['drainage'] for k, v in dict_hist.items() }, min_fraction, month_days )
     
-    return dict_final
-
-
-
+    return his_dis_monthly_dict( monthly, dict_hist )
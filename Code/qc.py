@@ -0,0 +1,229 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from .instrument import instrumented
+
+
+# QC flag bits, one uint8 per value. A value (or month) is used where none of the bits of the mask is set.
+MISSING  = 1      # NaN or unreadable in the input
+SENTINEL = 2      # missing value marker (99.99, -999, ...)
+RANGE    = 4      # outside the valid range
+FLATLINE = 8      # part of a run of the same non zero value
+OUTLIER  = 16     # robust z-score above the threshold
+NO_DATA  = 32     # month without any valid day
+FEW_DAYS = 64     # month with fewer valid days than required
+DRY      = 128    # month of valid days summing to zero
+
+FLAGS = { 'missing': MISSING, 'sentinel': SENTINEL, 'range': RANGE, 'flatline': FLATLINE,
+          'outlier': OUTLIER, 'no_data': NO_DATA, 'few_days': FEW_DAYS, 'dry': DRY }
+
+# default masks of values and of monthly totals. DRY is masked as the loaders always
+# did (log scaling in clean_data), leave it out to keep real dry months
+MASK       = MISSING | SENTINEL | RANGE | FLATLINE | OUTLIER
+MONTH_MASK = NO_DATA | FEW_DAYS | DRY
+
+
+def _flat_runs( values, min_run ):
+
+    'Mask of the values in runs of at least min_run equal, non zero consecutive values of every column'
+
+    same = np.zeros( values.shape, dtype = bool )
+    same[1:] = ( values[1:] == values[:-1] ) & ( values[1:] != 0 )
+
+    # run numbers unique over the columns (every column starts a run)
+    ids  = np.cumsum( ~same.T.ravel() ) - 1
+    size = np.bincount( ids )[ids].reshape( values.shape[::-1] ).T
+
+    return ( size >= min_run ) & ( values != 0 ) & ~np.isnan( values )
+
+@instrumented
+def qc_flags( values, sentinels = (), valid_range = None, min_run = None, outlier_z = None ):
+
+    '''
+    Per-value QC flags in one vectorised pass over an array of values.
+
+    Parameters
+    ---------
+
+      values
+        Array (rows x columns, rows in time order) or table of numbers. Anything
+        that is not a number (' ', '?') is flagged MISSING.
+
+      sentinels
+        Missing value markers, flagged SENTINEL
+
+      valid_range
+        (lowest, highest) valid value, either None for no bound. Values outside are flagged RANGE.
+
+      min_run
+        Flag FLATLINE the runs of at least min_run equal consecutive values (zeros,
+        e.g. dry spells, excepted). None skips the check.
+
+      outlier_z
+        Flag OUTLIER the values whose robust z-score (distance to the median of the
+        column's unflagged values over 1.4826 MAD) is above outlier_z. Where the MAD is
+        0, as for daily rainfall with mostly dry days, the scale is 1.2533 times the
+        mean absolute deviation from the median instead; constant columns have no
+        outliers. None skips the check.
+
+    Returns
+    --------
+
+      Array of values as float (NaN where not a number), array of uint8 flags of the same shape
+    '''
+
+    if isinstance( values, ( pd.DataFrame, pd.Series ) ):
+        values = values.apply( pd.to_numeric, errors = 'coerce' ) if values.ndim == 2 else pd.to_numeric( values, errors = 'coerce' )
+    values = np.array( values, dtype = float )
+
+    flags  = np.where( np.isnan( values ), MISSING, 0 ).astype( np.uint8 )
+
+    if len( sentinels ):
+        flags |= np.isin( values, np.asarray( sentinels, dtype = float ) ) * np.uint8( SENTINEL )
+
+    if valid_range is not None:
+        lo, hi = valid_range
+        with np.errstate( invalid = 'ignore' ):
+            out = ( values < ( -np.inf if lo is None else lo ) ) | ( values > ( np.inf if hi is None else hi ) )
+        flags |= ( out & ( flags == 0 ) ) * np.uint8( RANGE )
+
+    if min_run is not None and values.size:
+        flat = _flat_runs( np.where( flags & ( MISSING | SENTINEL ), np.nan, values ).reshape( len( values ), -1 ), min_run )
+        flags |= flat.reshape( values.shape ) * np.uint8( FLATLINE )
+
+    if outlier_z is not None and values.size:
+        x = np.where( flags, np.nan, values ).reshape( len( values ), -1 )
+        # columns without unflagged values have no median
+        with warnings.catch_warnings(), np.errstate( invalid = 'ignore', divide = 'ignore' ):
+            warnings.simplefilter( 'ignore', RuntimeWarning )
+            dev   = np.abs( x - np.nanmedian( x, axis = 0 ) )
+            mad   = np.nanmedian( dev, axis = 0 )
+            # MAD is 0 when most values equal the median (dry days of daily rainfall):
+            # fall back to the mean absolute deviation, both scaled to a normal sigma
+            scale = np.where( mad > 0, 1.4826 * mad, 1.2533 * np.nanmean( dev, axis = 0 ) )
+            z     = dev / np.where( scale > 0, scale, np.nan )
+        flags |= ( z > outlier_z ).reshape( values.shape ) * np.uint8( OUTLIER )
+
+    return values, flags
+
+def loader_options( qc, sentinels = () ):
+
+    '''
+    Split the qc option dictionary of a loader (prep_mod_rain_data, prep_rain_data,
+    prep_mod_dis_data), e.g. {'valid_range': (0, 500), 'min_run': 10, 'month_mask': NO_DATA}.
+
+    Parameters
+    ---------
+
+      qc
+        Dictionary of qc_flags arguments plus mask, month_mask and min_days, or None
+
+      sentinels
+        Missing value markers of the source, used unless qc gives sentinels
+
+    Returns
+    --------
+
+      Dictionary of qc_flags keyword arguments, and a dictionary with mask, month_mask and min_days
+    '''
+
+    options = { 'sentinels': sentinels, **( qc or {} ) }
+    masks   = { k: options.pop( k, default ) for k, default in ( ( 'mask', MASK ), ( 'month_mask', MONTH_MASK ), ( 'min_days', 0 ) ) }
+
+    unknown = sorted( set( options ) - { 'sentinels', 'valid_range', 'min_run', 'outlier_z' } )
+    if unknown:
+        raise KeyError( f'Unknown QC options: {unknown}' )
+
+    return options, masks
+
+def apply_flags( values, flags, mask = MASK ):
+
+    'Copy of values with NaN wherever one of the bits of mask is flagged'
+
+    return np.where( flags & mask, np.nan, values )
+
+@instrumented
+def monthly_totals( values, dates, flags, mask = MASK, min_days = 0 ):
+
+    '''
+    Monthly sums of daily values over the valid days, with the number of valid days
+    and monthly flags, on a gap free monthly calendar. Unlike a resample sum, a
+    month without valid days (NO_DATA) is kept apart from a dry month (DRY).
+
+    Parameters
+    ---------
+
+      values
+        Array (days x columns) of daily values
+
+      dates
+        Day of every row, in any order
+
+      flags
+        qc_flags of values
+
+      mask
+        Flags of the days left out of the sums
+
+      min_days
+        Months with valid days but fewer than min_days are flagged FEW_DAYS
+
+    Returns
+    --------
+
+      Dictionary with
+        months : first day of every month (DatetimeIndex)
+        sums   : array (months x columns), 0 where no valid day
+        days   : array (months x columns) of valid days
+        flags  : array (months x columns) of uint8 month flags, with the flags of the
+                 days of the month combined (bitwise or)
+    '''
+
+    values, flags = np.asarray( values, dtype = float ), np.asarray( flags, dtype = np.uint8 )
+    if values.ndim == 1:
+        values, flags = values[:, None], flags[:, None]
+
+    month = pd.DatetimeIndex( dates ).to_period( 'M' )
+    code  = np.asarray( month.year, dtype = np.int64 ) * 12 + np.asarray( month.month ) - 1
+    order = np.argsort( code, kind = 'stable' )
+    code  = code[order]
+
+    first  = int( code[0] ) if len( code ) else 0
+    n      = int( code[-1] ) - first + 1 if len( code ) else 0
+    starts = np.flatnonzero( np.r_[ True, code[1:] != code[:-1] ] ) if len( code ) else np.zeros( 0, int )
+    rows   = code[starts] - first
+
+    valid = ( flags[order] & mask ) == 0
+    sums  = np.zeros( ( n, values.shape[1] ) )
+    days  = np.zeros( ( n, values.shape[1] ), dtype = np.int64 )
+    month_flags = np.zeros( ( n, values.shape[1] ), dtype = np.uint8 )
+    if len( code ):
+        sums[rows]        = np.add.reduceat( np.where( valid, values[order], 0 ), starts, axis = 0 )
+        days[rows]        = np.add.reduceat( valid.astype( np.int64 ), starts, axis = 0 )
+        month_flags[rows] = np.bitwise_or.reduceat( flags[order], starts, axis = 0 )
+
+    month_flags |= ( days == 0 ) * np.uint8( NO_DATA )
+    month_flags |= ( ( days > 0 ) & ( days < min_days ) ) * np.uint8( FEW_DAYS )
+    month_flags |= ( ( days > 0 ) & ( sums == 0 ) ) * np.uint8( DRY )
+
+    months = pd.period_range( pd.Period( year = first // 12, month = first % 12 + 1, freq = 'M' ), periods = n,
+                              freq = 'M' ).to_timestamp() if n else pd.DatetimeIndex( [] )
+
+    return { 'months': months, 'sums': sums, 'days': days, 'flags': month_flags }
+
+def flag_counts( flags, columns = None ):
+
+    '''
+    Number of values with every flag, by column.
+
+    Returns
+    --------
+
+      Table of columns x flag names
+    '''
+
+    flags = np.asarray( flags ).reshape( len( flags ), -1 )
+
+    return pd.DataFrame( { name: ( ( flags & bit ) > 0 ).sum( axis = 0 ) for name, bit in FLAGS.items() },
+                         index = columns )
@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+from functools import partial
+
+from .enso       import INDEX_COLUMN, monthly_matrix, shifted, pearson_columns
+from .instrument import instrumented
+from .parallel   import map_files
+
+
+def block_indices( rng, n_rows, block, n_resamples ):
+
+    '''
+    Circular moving-block bootstrap rows: every resample joins random blocks of
+    block consecutive rows (wrapping at the end) until it has n_rows rows.
+
+    Returns
+    --------
+
+      Array (n_resamples x n_rows) of row indices
+    '''
+
+    n_blocks = -( -n_rows // block )
+    starts   = rng.integers( 0, n_rows, ( n_resamples, n_blocks ) )
+
+    return ( ( starts[:, :, None] + np.arange( block ) ) % n_rows ).reshape( n_resamples, -1 )[:, :n_rows]
+
+def _station_side( x ):
+
+    '''
+    Station terms of the correlation sums, fixed for every resample: masks, centred
+    values and squares stacked for the matrix products of _resampled_r.
+    '''
+
+    mx = ~np.isnan( x )
+    x0 = np.where( mx, x - np.where( mx, x, 0 ).sum( axis = 0 ) / np.maximum( mx.sum( axis = 0 ), 1 ), 0 )
+    mx = mx.astype( float )
+
+    return { 'XA': np.vstack( [ mx.T, x0.T, ( x0 * x0 ).T ] ), 'XB': np.vstack( [ mx.T, x0.T ] ), 'n_st': x.shape[1] }
+
+def _resampled_r( xs, my, y0, yy, k ):
+
+    '''
+    Correlations of the stations with k resampled index blocks at once.
+
+    Parameters
+    ---------
+
+      xs
+        _station_side output
+
+      my, y0, yy
+        Arrays (months x k*lags): weighted mask, centred values and their squares of the
+        lagged index of every resample, side by side. A resample with row multiplicities
+        w uses w*mask, w*values and w*squares, so every sum carries the weight once.
+
+      k
+        Number of resamples
+
+    Returns
+    --------
+
+      Array (k x stations x lags)
+    '''
+
+    S    = xs['n_st']
+    A    = xs['XA'] @ my
+    B    = xs['XB'] @ y0
+    syy  = xs['XB'][:S] @ yy
+
+    n, sx, sxx = A[:S], A[S:2 * S], A[2 * S:]
+    sy, sxy    = B[:S], B[S:]
+
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        var = ( n * sxx - sx * sx ) * ( n * syy - sy * sy )
+        r   = np.clip( ( n * sxy - sx * sy ) / np.sqrt( var ), -1, 1 )
+    r[~( var > 0 )] = np.nan
+
+    return r.reshape( S, k, -1 ).transpose( 1, 0, 2 )
+
+def _bootstrap_chunk( task, x, Y, block, r_obs, batch = 20 ):
+
+    '''
+    One chunk of resamples.
+
+    Null (surrogate) test: the rows of the lagged index are block resampled on their
+    own, which keeps its autocorrelation and breaks its relation with the stations;
+    exceedances of |r| are counted. Confidence intervals: stations and lagged index
+    are block resampled together (as row weights); Fisher z sums are accumulated.
+    '''
+
+    _, seed, n_resamples = task
+    rng = np.random.default_rng( seed )
+    xs  = _station_side( x )
+    T   = len( Y )
+
+    my = ~np.isnan( Y )
+    y0 = np.where( my, Y - Y[my].mean() if my.any() else Y, 0 )
+    my = my.astype( float )
+    yy = y0 * y0
+
+    out = { k: np.zeros( r_obs.shape ) for k in [ 'exceed', 'tested', 'z_sum', 'z_sq', 'z_n' ] }
+
+    for start in range( 0, n_resamples, batch ):
+        k = min( batch, n_resamples - start )
+
+        rows   = block_indices( rng, T, block, k )
+        r_null = _resampled_r( xs, np.hstack( [ my[r] for r in rows ] ), np.hstack( [ y0[r] for r in rows ] ),
+                               np.hstack( [ yy[r] for r in rows ] ), k )
+        ok     = ~np.isnan( r_null )
+        out['exceed'] += ( ok & ( np.abs( np.where( ok, r_null, 0 ) ) >= np.abs( r_obs ) - 1e-12 ) ).sum( axis = 0 )
+        out['tested'] += ok.sum( axis = 0 )
+
+        w      = [ np.bincount( r, minlength = T )[:, None] for r in block_indices( rng, T, block, k ) ]
+        r_boot = _resampled_r( xs, np.hstack( [ wi * my for wi in w ] ), np.hstack( [ wi * y0 for wi in w ] ),
+                               np.hstack( [ wi * yy for wi in w ] ), k )
+        ok     = ~np.isnan( r_boot )
+        z      = np.arctanh( np.clip( np.where( ok, r_boot, 0 ), -0.999999, 0.999999 ) )
+        out['z_sum'] += z.sum( axis = 0 )
+        out['z_sq']  += ( z * z ).sum( axis = 0 )
+        out['z_n']   += ok.sum( axis = 0 )
+
+    return out
+
+@instrumented
+def bootstrap_correlation( df, index_qc, lags = range( -24, 25 ), n_resamples = 10000, block = 24, alpha = 0.05,
+                           seed = 0, n_jobs = 1, backend = 'process', chunk = 500, date_name = 'date',
+                           index_column = INDEX_COLUMN, min_periods = 24 ):
+
+    '''
+    Significance of the lagged correlations between the stations and the Nino 3.4
+    index with a circular moving-block bootstrap, which keeps the autocorrelation
+    left by the rolling means of clean_data.
+
+    Parameters
+    ---------
+
+      df
+        Wide table with a date column and one column per station (see lag_correlation)
+
+      index_qc
+        Index data (prep_index_data output)
+
+      lags
+        Lags in months. Positive lags: the index leads the station by lag months.
+
+      n_resamples
+        Number of resamples, for the test and for the confidence intervals each
+
+      block
+        Block length in months. Should exceed the autocorrelation length, at least
+        the 12 month rolling mean window.
+
+      alpha
+        Confidence intervals are 1 - alpha
+
+      seed
+        Seed of the numpy SeedSequence. Resamples are drawn in fixed chunks with
+        spawned seeds, so results do not depend on n_jobs or backend.
+
+      n_jobs, backend
+        Workers (see parallel.py)
+
+      chunk
+        Resamples per task
+
+      date_name, index_column, min_periods
+        As in lag_correlation
+
+    Returns
+    --------
+
+      Tidy table with station, lag, r, n, p_value (two sided, resampled index as
+      null) and ci_low / ci_high (Fisher z interval with the bootstrap standard error)
+    '''
+
+    from scipy.stats import norm
+
+    if n_resamples < 1:
+        raise ValueError( f'n_resamples must be at least 1, got {n_resamples}' )
+
+    lags = list( lags )
+    _, x, y, stations = monthly_matrix( df, index_qc, date_name, index_column )
+
+    # resample the months from the first to the last station value only
+    Y       = shifted( y, lags )
+    present = np.flatnonzero( ( ~np.isnan( x ) ).any( axis = 1 ) )
+    span    = slice( present[0], present[-1] + 1 ) if len( present ) else slice( 0, 0 )
+    x, Y    = x[span], Y[span]
+
+    r_obs, n = pearson_columns( x, Y )
+    r_obs[n < min_periods] = np.nan
+
+    sizes = [ min( chunk, n_resamples - i ) for i in range( 0, n_resamples, chunk ) ]
+    seeds = np.random.SeedSequence( seed ).spawn( len( sizes ) )
+    tasks = [ ( i, s, size ) for i, ( s, size ) in enumerate( zip( seeds, sizes ) ) ]
+
+    results = map_files( partial( _bootstrap_chunk, x = x, Y = Y, block = block, r_obs = r_obs ), tasks, n_jobs, backend )
+    total   = { k: sum( r[k] for r in results ) for k in results[0] }
+
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        p_value = ( 1 + total['exceed'] ) / ( 1 + total['tested'] )
+        z_mean  = total['z_sum'] / total['z_n']
+        z_se    = np.sqrt( np.maximum( total['z_sq'] / total['z_n'] - z_mean ** 2, 0 ) * total['z_n'] / ( total['z_n'] - 1 ) )
+        z_obs   = np.arctanh( np.clip( r_obs, -0.999999, 0.999999 ) )
+        q       = norm.ppf( 1 - alpha / 2 )
+        ci_low  = np.tanh( z_obs - q * z_se )
+        ci_high = np.tanh( z_obs + q * z_se )
+
+    p_value[np.isnan( r_obs )] = np.nan
+
+    return pd.DataFrame( { 'station': np.repeat( stations, len( lags ) ),
+                           'lag'    : np.tile( lags, len( stations ) ),
+                           'r'      : r_obs.ravel(),
+                           'n'      : n.ravel(),
+                           'p_value': p_value.ravel(),
+                           'ci_low' : ci_low.ravel(),
+                           'ci_high': ci_high.ravel() } )
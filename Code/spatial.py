@@ -0,0 +1,268 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from .clean_data import detrend_deseason
+from .enso       import monthly_values
+from .instrument import instrumented
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _unit_vectors( lat, lon ):
+
+    'Points on the unit sphere: the chord between two of them grows with their great circle distance'
+
+    lat, lon = np.radians( np.asarray( lat, dtype = float ) ), np.radians( np.asarray( lon, dtype = float ) )
+
+    return np.column_stack( [ np.cos( lat ) * np.cos( lon ), np.cos( lat ) * np.sin( lon ), np.sin( lat ) ] )
+
+def _chord_to_km( chord ):
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin( np.minimum( np.asarray( chord ) / 2, 1 ) )
+
+def _km_to_chord( km ):
+
+    return 2 * np.sin( np.minimum( km / EARTH_RADIUS_KM, np.pi ) / 2 )
+
+def haversine_km( lat1, lon1, lat2, lon2 ):
+
+    'Great circle distance (km) between points, element wise over arrays'
+
+    lat1, lon1, lat2, lon2 = ( np.radians( np.asarray( v, dtype = float ) ) for v in ( lat1, lon1, lat2, lon2 ) )
+    a = np.sin( ( lat2 - lat1 ) / 2 ) ** 2 + np.cos( lat1 ) * np.cos( lat2 ) * np.sin( ( lon2 - lon1 ) / 2 ) ** 2
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin( np.sqrt( a ) )
+
+def read_coordinates( filename, name_column = None ):
+
+    '''
+    Station coordinates (CoordinatesDis.csv, CoordinatesRiver.csv).
+
+    Parameters
+    ---------
+
+      filename
+        csv with Lat and Lon columns (decimal degrees) and a station name column
+
+      name_column
+        Column with the station names, default the first text column
+
+    Returns
+    --------
+
+      Table with name, lat and lon
+    '''
+
+    df = pd.read_csv( filename )
+    if name_column is None:
+        text = [ c for c in df.columns if c not in ( 'Lat', 'Lon' ) and df[c].dtype == object ]
+        if not text:
+            raise ValueError( f'{filename}: no station name column' )
+        name_column = text[0]
+
+    return pd.DataFrame( { 'name': df[name_column].astype( str ).str.strip(),
+                           'lat' : df['Lat'].to_numpy( dtype = float ),
+                           'lon' : df['Lon'].to_numpy( dtype = float ) } )
+
+def station_index( coords ):
+
+    '''
+    Spatial index of stations: a KD-tree of their positions on the unit sphere, so
+    nearest and radius queries rank by great circle (haversine) distance.
+
+    Parameters
+    ---------
+
+      coords
+        Table with name, lat and lon (read_coordinates output)
+
+    Returns
+    --------
+
+      Dictionary with names, lat, lon and tree
+    '''
+
+    from scipy.spatial import cKDTree
+
+    coords = coords.dropna( subset = [ 'lat', 'lon' ] ).reset_index( drop = True )
+
+    return { 'names': coords['name'].to_numpy( dtype = object ),
+             'lat'  : coords['lat'].to_numpy( dtype = float ),
+             'lon'  : coords['lon'].to_numpy( dtype = float ),
+             'tree' : cKDTree( _unit_vectors( coords['lat'], coords['lon'] ) ) }
+
+def nearest( index, lat, lon, k = 1 ):
+
+    '''
+    The k stations of index nearest to every query point.
+
+    Returns
+    --------
+
+      Table with query (position of the point), rank (1 nearest), name and distance_km
+    '''
+
+    lat, lon = np.atleast_1d( lat ), np.atleast_1d( lon )
+    k        = min( k, len( index['names'] ) )
+    chord, j = index['tree'].query( _unit_vectors( lat, lon ), k = k )
+    chord, j = np.reshape( chord, ( len( lat ), k ) ), np.reshape( j, ( len( lat ), k ) )
+
+    return pd.DataFrame( { 'query'      : np.repeat( np.arange( len( lat ) ), k ),
+                           'rank'       : np.tile( np.arange( 1, k + 1 ), len( lat ) ),
+                           'name'       : index['names'][j.ravel()],
+                           'distance_km': _chord_to_km( chord.ravel() ) } )
+
+def within( index, lat, lon, radius_km ):
+
+    '''
+    Stations of index within radius_km of every query point.
+
+    Returns
+    --------
+
+      Table with query (position of the point), name and distance_km, nearest first per query
+    '''
+
+    lat, lon = np.atleast_1d( lat ), np.atleast_1d( lon )
+    hits     = index['tree'].query_ball_point( _unit_vectors( lat, lon ), _km_to_chord( radius_km ) )
+    query    = np.repeat( np.arange( len( lat ) ), [ len( h ) for h in hits ] )
+    j        = np.concatenate( [ np.asarray( h, dtype = int ) for h in hits ] ) if len( hits ) else np.zeros( 0, int )
+
+    df = pd.DataFrame( { 'query'      : query,
+                         'name'       : index['names'][j],
+                         'distance_km': haversine_km( lat[query], lon[query], index['lat'][j], index['lon'][j] ) } )
+
+    return df.sort_values( [ 'query', 'distance_km' ], kind = 'stable' ).reset_index( drop = True )
+
+@instrumented
+def pair_stations( rain_index, river_index, radius_km = 50.0, k = None ):
+
+    '''
+    Pairs of rain stations and river gauges within radius_km of each other, from one
+    sparse distance query between the two trees.
+
+    Parameters
+    ---------
+
+      rain_index, river_index
+        station_index outputs
+
+      radius_km
+        Largest distance of a pair
+
+      k
+        Keep only the k nearest gauges of every rain station, None for all
+
+    Returns
+    --------
+
+      Table with rain, river and distance_km, sorted by rain station and distance
+    '''
+
+    sparse = rain_index['tree'].sparse_distance_matrix( river_index['tree'], _km_to_chord( radius_km ),
+                                                        output_type = 'ndarray' )
+    i, j   = sparse['i'].astype( int ), sparse['j'].astype( int )
+
+    df = pd.DataFrame( { 'rain'       : rain_index['names'][i],
+                         'river'      : river_index['names'][j],
+                         'distance_km': haversine_km( rain_index['lat'][i], rain_index['lon'][i],
+                                                      river_index['lat'][j], river_index['lon'][j] ),
+                         '_i'         : i } )
+    df = df.sort_values( [ '_i', 'distance_km' ], kind = 'stable' )
+    if k is not None:
+        df = df[df.groupby( '_i' ).cumcount() < k]
+
+    return df.drop( columns = '_i' ).reset_index( drop = True )
+
+def _clean_columns( df, date_name, columns, column, degree, windows ):
+
+    '''
+    Cleaned series of the station columns of a wide table: every column goes through
+    the clean_data chain (see detrend_deseason) over its own dates, vectorised across
+    the columns, and the cleaning step column is kept. Values of 0 or less have no
+    log and are left out.
+    '''
+
+    df = df.sort_values( date_name, kind = 'stable' ).reset_index( drop = True )
+    x  = df[columns].apply( pd.to_numeric, errors = 'coerce' ).to_numpy( dtype = float )
+
+    # stations without data have all NaN steps
+    with warnings.catch_warnings():
+        warnings.simplefilter( 'ignore', RuntimeWarning )
+        steps = detrend_deseason( np.where( x > 0, x, np.nan ), degree, windows )
+
+    return pd.concat( [ df[[date_name]], pd.DataFrame( steps[column], columns = columns ) ], axis = 1 )
+
+@instrumented
+def pair_correlation( pairs, rain, discharge, rain_date = 'Date', dis_date = 'Year', min_periods = 24,
+                      clean = True, column = 'data_deseason12', degree = 3, windows = ( 6, 12 ) ):
+
+    '''
+    Pearson correlation of the cleaned series of every rain station - river pair, over
+    the months both have data, for all pairs at once.
+
+    Parameters
+    ---------
+
+      pairs
+        Table with rain and river columns (pair_stations output)
+
+      rain, discharge
+        Wide tables with a date column and one column per station / river of monthly
+        values, e.g. output_rainfall.csv and output_discharge.csv. Names missing from
+        a table give NaN.
+
+      rain_date, dis_date
+        Column Names of date
+
+      min_periods
+        Fewest overlapping months for a correlation, NaN below
+
+      clean
+        Clean every station as clean_data does (log, scaling, polynomial detrending
+        and rolling deseasoning) and correlate the column step. False correlates the
+        tables as given, for series cleaned already (e.g. clean_to_wide output).
+
+      column
+        Cleaning step correlated (data_scaled, data_detrend_P, data_deseason, data_deseason12)
+
+      degree, windows
+        Polynomial degree and deseasoning windows of detrend_deseason
+
+    Returns
+    --------
+
+      pairs with r and n (months used)
+    '''
+
+    r_cols = [ c for c in dict.fromkeys( pairs['rain'] ) if c in rain.columns ]
+    d_cols = [ c for c in dict.fromkeys( pairs['river'] ) if c in discharge.columns ]
+
+    if clean:
+        rain      = _clean_columns( rain, rain_date, r_cols, column, degree, windows )
+        discharge = _clean_columns( discharge, dis_date, d_cols, column, degree, windows )
+
+    r_dates = pd.to_datetime( rain[rain_date] ).dt.to_period( 'M' )
+    d_dates = pd.to_datetime( discharge[dis_date] ).dt.to_period( 'M' )
+    months  = pd.period_range( min( r_dates.min(), d_dates.min() ), max( r_dates.max(), d_dates.max() ), freq = 'M' )
+
+    # one empty column at the end for names missing from a table
+    _, x = monthly_values( rain, rain_date, r_cols, months )
+    _, y = monthly_values( discharge, dis_date, d_cols, months )
+    x, y = np.column_stack( [ x, np.full( len( months ), np.nan ) ] ), np.column_stack( [ y, np.full( len( months ), np.nan ) ] )
+
+    xi = pd.Index( r_cols ).get_indexer( pairs['rain'] )
+    yi = pd.Index( d_cols ).get_indexer( pairs['river'] )
+    X, Y = x[:, xi], y[:, yi]
+
+    m  = ~np.isnan( X ) & ~np.isnan( Y )
+    n  = m.sum( axis = 0 )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        X0 = np.where( m, X - np.where( m, X, 0 ).sum( axis = 0 ) / n, 0 )
+        Y0 = np.where( m, Y - np.where( m, Y, 0 ).sum( axis = 0 ) / n, 0 )
+        r  = np.clip( ( X0 * Y0 ).sum( axis = 0 ) / np.sqrt( ( X0 * X0 ).sum( axis = 0 ) * ( Y0 * Y0 ).sum( axis = 0 ) ), -1, 1 )
+    r[n < max( min_periods, 2 )] = np.nan
+
+    return pairs.assign( r = r, n = n )
@@ -0,0 +1,93 @@
+'''
+Import-time guard of the Code package.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget 0.25 --output imports.json
+
+Run from the repository root. Every compute module is imported in a fresh
+interpreter (best of --repeat runs). The check fails (exit status 1) if one of them
+loads a plotting / notebook / model dependency at import time, or takes more than
+--budget seconds on top of importing numpy and pandas.
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import pandas as pd
+
+
+# modules that only import numpy and pandas; plot_data is the plotting module
+COMPUTE_MODULES = [ 'cache', 'clean_data', 'cli', 'climatology', 'coalesce', 'compact', 'composites', 'enso', 'gridded',
+                    'indices', 'instrument', 'load_data', 'output_store', 'parallel', 'pipeline', 'prep',
+                    'prepare_data', 'qc', 'significance', 'spatial' ]
+
+# dependencies loaded on first use only
+HEAVY = [ 'matplotlib', 'seaborn', 'scipy', 'sklearn', 'IPython', 'xlrd', 'openpyxl' ]
+
+PROBE = '''
+import sys, time, json
+t0 = time.perf_counter()
+import numpy, pandas
+t1 = time.perf_counter()
+{statement}
+t2 = time.perf_counter()
+print( json.dumps( {{ 'base': t1 - t0, 'seconds': t2 - t1,
+                     'heavy': sorted( m for m in {heavy!r} if m in sys.modules ) }} ) )
+'''
+
+
+def probe( module, repeat = 3 ):
+
+    '''
+    Import module in fresh interpreters.
+
+    Returns
+    --------
+
+      Dictionary with seconds (best import time after numpy and pandas), base (best
+      numpy + pandas import time) and heavy (heavy modules it loaded)
+    '''
+
+    code = PROBE.format( statement = f'import {module}', heavy = HEAVY )
+    runs = []
+    for _ in range( repeat ):
+        out = subprocess.run( [ sys.executable, '-c', code ], capture_output = True, text = True, check = True,
+                              env = { **os.environ, 'MPLBACKEND': 'Agg' } )
+        runs.append( json.loads( out.stdout.strip().splitlines()[-1] ) )
+
+    return { 'seconds': min( r['seconds'] for r in runs ),
+             'base'   : min( r['base'] for r in runs ),
+             'heavy'  : runs[0]['heavy'] }
+
+def main( argv = None ):
+
+    parser = argparse.ArgumentParser( description = 'Check the import time and dependencies of the Code modules' )
+    parser.add_argument( '--repeat', type = int, default = 3 )
+    parser.add_argument( '--budget', type = float, default = 0.25,
+                         help = 'Exit with status 1 if a module takes longer than this (seconds) after numpy and pandas' )
+    parser.add_argument( '--output', help = 'Write the results to this JSON file' )
+    args = parser.parse_args( argv )
+
+    results = { name: probe( f'Code.{name}', args.repeat ) for name in COMPUTE_MODULES }
+    table   = pd.DataFrame( [ { 'module': name, **r, 'heavy': ', '.join( r['heavy'] ) } for name, r in results.items() ] )
+    print( table.to_string( index = False, float_format = '{:.3f}'.format ) )
+
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            json.dump( results, f, indent = 2 )
+        print( f'Results written to {args.output}' )
+
+    heavy = [ name for name, r in results.items() if r['heavy'] ]
+    slow  = [ name for name, r in results.items() if r['seconds'] > args.budget ]
+    if heavy:
+        print( f'Heavy dependencies imported by: {", ".join( heavy )}' )
+    if slow:
+        print( f'Slower than {args.budget} s: {", ".join( slow )}' )
+
+    return 1 if heavy or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,244 @@
+'''
+Per-stage benchmarks of the prepare, clean and plot functions on synthetic data.
+
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --compare bench.json --tolerance 1.25
+
+Run from the repository root. Every stage is timed (best of --repeat runs) and its
+peak Python memory measured with tracemalloc in a separate run, so the tracing
+overhead does not enter the timings.
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+
+from Code.prepare_data import prep_index_data, prep_mod_rain_data, prep_rain_data, prep_mod_dis_data, \
+                              load_his_dis_data, load_his_dis_long, load_his_dis_monthly, prep_his_dis_data, merge_dis_data
+from Code.clean_data   import clean_data, clean_data_groups
+from Code.pipeline     import merge_rain_sources
+
+from benchmarks.synthetic import write_dataset
+
+
+SCALES = { 'small' : { 'n_rain': 4,  'n_rivers': 4,  'n_hist': 2,  'rain_years': 5,  'hist_years': 10 },
+           'medium': { 'n_rain': 12, 'n_rivers': 12, 'n_hist': 6,  'rain_years': 15, 'hist_years': 30 },
+           'large' : { 'n_rain': 30, 'n_rivers': 60, 'n_hist': 16, 'rain_years': 30, 'hist_years': 40 } }
+
+
+def stages( paths, figures ):
+
+    '''
+    The benchmarked stages in ENSO.ipynb order. Each stage is a function of the
+    outputs of the earlier stages returning its own output.
+
+    Parameters
+    ---------
+
+      paths
+        Dictionary returned by write_dataset
+
+      figures
+        Folder the plot stages save into
+
+    Returns
+    --------
+
+      List of (name, function) pairs
+    '''
+
+    # coalesced modern + historical stations are renamed mod_hist_<station> as in ENSO.ipynb
+    rename = { s: f'mod_hist_{s}' for s in paths['rain'] }
+
+    def plots( out ):
+        from Code.plot_data import use_headless_backend, logscaled_plot, detrend_plot, climatology_plot
+        import matplotlib.pyplot as plt
+
+        use_headless_backend()
+        for c, df in out['clean_data_groups'].items():
+            for fig in [ logscaled_plot( df, figures, f'bench_{c}', show = False ),
+                         detrend_plot( df, figures, f'bench_{c}', show = False ),
+                         climatology_plot( df, figures, 'Climate Type', c, show = False ) ]:
+                plt.close( fig )
+
+    def clean_each( out ):
+        crit = out['criteria_dis']
+        return { c: clean_data( out['merge_dis_data'], crit, 'River Name', 'Climate Type', c, 'Year', out['prep_index_data'],
+                                headless = True )
+                 for c in sorted( crit['Climate Type'].unique() ) }
+
+    return [
+        ( 'prep_index_data'   , lambda out: prep_index_data( paths['files'], 'nino3.4a_rel', 'nino3.4a_rel' ) ),
+        ( 'prep_mod_rain_data', lambda out: prep_mod_rain_data( paths['modern'] )[0] ),
+        ( 'prep_rain_data'    , lambda out: prep_rain_data( paths['hist_csv'], 'hist' )[0] ),
+        ( 'prep_rain_data_mid', lambda out: prep_rain_data( paths['mid_csv'], 'mid' )[0] ),
+        ( 'prep_mod_dis_data' , lambda out: prep_mod_dis_data( paths['hess'] )[0] ),
+        ( 'load_his_dis_data' , lambda out: load_his_dis_data( paths['historical'] ) ),
+        ( 'load_his_dis_long' , lambda out: load_his_dis_long( paths['historical'] ) ),
+        ( 'load_his_dis_monthly', lambda out: load_his_dis_monthly( paths['historical'] ) ),
+        ( 'prep_his_dis_data' , lambda out: prep_his_dis_data( out['load_his_dis_data'] ) ),
+        ( 'merge_rain_data'   , lambda out: merge_rain_sources( out['prep_mod_rain_data'], out['prep_rain_data'],
+                                                                out['prep_rain_data_mid'], [], rename, [] ) ),
+        ( 'merge_dis_data'    , lambda out: merge_dis_data( out['prep_mod_dis_data'], out['prep_his_dis_data'], [] ) ),
+        ( 'criteria_dis'      , lambda out: pd.read_csv( paths['crit_dis'] ) ),
+        ( 'clean_data'        , clean_each ),
+        ( 'clean_data_groups' , lambda out: clean_data_groups( out['merge_dis_data'], out['criteria_dis'], 'River Name',
+                                                               'Climate Type', 'Year', out['prep_index_data'] ) ),
+        ( 'plots'             , plots ),
+    ]
+
+def _shape( value ):
+
+    'Rows and columns of a stage output, where it is a table'
+
+    if isinstance( value, pd.DataFrame ):
+        return list( value.shape )
+    if isinstance( value, tuple ) and value and isinstance( value[0], pd.DataFrame ):
+        return list( value[0].shape )
+
+    return None
+
+def run( paths, figures, repeat = 3 ):
+
+    '''
+    Time every stage and measure its peak memory.
+
+    Parameters
+    ---------
+
+      paths
+        Dictionary returned by write_dataset
+
+      figures
+        Folder the plot stages save into
+
+      repeat
+        Number of timed runs per stage, the fastest is kept
+
+    Returns
+    --------
+
+      Dictionary by stage name with seconds, peak_mb and shape of the output
+    '''
+
+    out, results = {}, {}
+
+    for name, func in stages( paths, figures ):
+        times = []
+        with contextlib.redirect_stdout( io.StringIO() ), contextlib.redirect_stderr( io.StringIO() ):
+            for _ in range( repeat ):
+                t0 = time.perf_counter()
+                out[name] = func( out )
+                times.append( time.perf_counter() - t0 )
+
+            tracemalloc.start()
+            func( out )
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        results[name] = { 'seconds': min( times ),
+                          'peak_mb': peak / 2**20,
+                          'shape'  : _shape( out[name] ) }
+        print( f'{name:<20} {min( times ):9.4f} s {peak / 2**20:9.1f} MB' )
+
+    return results
+
+def compare( baseline, current, tolerance = 1.25 ):
+
+    '''
+    Compare two benchmark results.
+
+    Parameters
+    ---------
+
+      baseline, current
+        Results as written by main (dictionaries with 'stages')
+
+      tolerance
+        Ratio current / baseline of seconds above which a stage counts as slower
+
+    Returns
+    --------
+
+      Table of seconds and peak memory per stage with their ratios, and the names of the slower stages
+    '''
+
+    rows = []
+    for name, cur in current['stages'].items():
+        base = baseline['stages'].get( name )
+        if base is None:
+            continue
+        rows.append( { 'stage'       : name,
+                       'base_s'      : base['seconds'],
+                       'current_s'   : cur['seconds'],
+                       'time_ratio'  : cur['seconds'] / base['seconds'] if base['seconds'] else np.nan,
+                       'base_mb'     : base['peak_mb'],
+                       'current_mb'  : cur['peak_mb'],
+                       'memory_ratio': cur['peak_mb'] / base['peak_mb'] if base['peak_mb'] else np.nan } )
+
+    table  = pd.DataFrame( rows )
+    slower = list( table.loc[table['time_ratio'] > tolerance, 'stage'] ) if len( table ) else []
+
+    return table, slower
+
+def main( argv = None ):
+
+    parser = argparse.ArgumentParser( description = 'Benchmark the prepare, clean and plot stages on synthetic data' )
+    parser.add_argument( '--scale', choices = list( SCALES ), default = 'small' )
+    parser.add_argument( '--repeat', type = int, default = 3 )
+    parser.add_argument( '--seed', type = int, default = 0 )
+    parser.add_argument( '--data', help = 'Folder for the synthetic inputs (default: a temporary folder)' )
+    parser.add_argument( '--output', help = 'Write the results to this JSON file' )
+    parser.add_argument( '--compare', help = 'Baseline JSON file to compare against' )
+    parser.add_argument( '--tolerance', type = float, default = 1.25,
+                         help = 'Exit with status 1 if a stage is slower than tolerance x baseline' )
+    args = parser.parse_args( argv )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.data or tmp
+        print( f'Write synthetic data ({args.scale}) to {folder}' )
+        paths  = write_dataset( folder, seed = args.seed, **SCALES[args.scale] )
+        figures = os.path.join( folder, 'Figures' )
+        os.makedirs( figures, exist_ok = True )
+
+        current = { 'meta'  : { 'scale'   : args.scale,
+                                'sizes'   : SCALES[args.scale],
+                                'repeat'  : args.repeat,
+                                'seed'    : args.seed,
+                                'python'  : platform.python_version(),
+                                'numpy'   : np.__version__,
+                                'pandas'  : pd.__version__,
+                                'machine' : platform.machine(),
+                                'time'    : time.strftime( '%Y-%m-%dT%H:%M:%S' ) },
+                    'stages': run( paths, figures, args.repeat ) }
+
+    if args.output:
+        with open( args.output, 'w' ) as f:
+            json.dump( current, f, indent = 2 )
+        print( f'Results written to {args.output}' )
+
+    if args.compare:
+        with open( args.compare ) as f:
+            baseline = json.load( f )
+        if baseline['meta'].get( 'scale' ) != args.scale:
+            print( f"Baseline scale {baseline['meta'].get( 'scale' )} differs from {args.scale}" )
+        table, slower = compare( baseline, current, args.tolerance )
+        print( table.to_string( index = False, float_format = '{:.3f}'.format ) )
+        if slower:
+            print( f'Slower than {args.tolerance} x baseline: {", ".join( slower )}' )
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,279 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+MONTHS = [ 'JAN','FEB','MAR','APR','MAY','JUN','JUL','AUG','SEPT','OCT','NOV','DEC' ]
+
+
+def station_names( prefix, n ):
+
+    'n station names prefix000, prefix001, ...'
+
+    return [ f'{prefix}{i:03d}' for i in range( n ) ]
+
+def write_mod_rain( filename, start, end, seed = 0, stray = False ):
+
+    '''
+    Modern rainfall workbook as read by read_mod_rain_file: YEAR, MONTH, DAY and
+    PRCP Inch columns, with ' ' and 99.99 sentinels.
+
+    Parameters
+    ---------
+
+      filename
+        Output xlsx
+
+      start, end
+        First and last day
+
+      seed
+        Random seed
+
+      stray
+        Add the unnamed fifth column some of the original workbooks have
+    '''
+
+    rng  = np.random.default_rng( seed )
+    days = pd.date_range( start, end, freq = 'D' )
+
+    prcp = rng.gamma( 0.5, 0.3, len( days ) ).round( 2 ).astype( object )
+    prcp[rng.random( len( days ) ) < 0.01] = ' '
+    prcp[rng.random( len( days ) ) < 0.01] = 99.99
+
+    df = pd.DataFrame( { 'YEAR': days.year, 'MONTH': days.month, 'DAY': days.day, 'PRCP Inch': prcp } )
+    if stray:
+        df[None] = np.where( rng.random( len( days ) ) < 0.001, 1.0, np.nan )
+
+    df.to_excel( filename, index = False )
+
+def write_hess( filename, river, start, n_months, seed = 0 ):
+
+    '''
+    Modern (HESS) discharge workbook as read by read_mod_dis_file: the river name in
+    the second cell of the first row, four header rows, one row per month and a footer.
+
+    Parameters
+    ---------
+
+      filename
+        Output xlsx
+
+      river
+        River name
+
+      start
+        First month
+
+      n_months
+        Number of months
+
+      seed
+        Random seed
+    '''
+
+    rng    = np.random.default_rng( seed )
+    months = pd.date_range( start, periods = n_months, freq = 'MS' )
+
+    rows  = [ [ 'Station', f'{river} River at Station' ], [ 'Area', '' ], [ 'Units', 'mm/month' ], [ '', '' ] ]
+    rows += [ [ m.strftime( '%Y-%m-%d' ), float( rng.gamma( 2, 100 ) ) ] for m in months ]
+    rows += [ [ 'Source: Ibarra et al. 2020', None ] ]
+
+    pd.DataFrame( rows, columns = [ 'Major River Basin', 'Unnamed: 1' ] ).to_excel( filename, index = False )
+
+def write_his_sheet( filename, years, drainage = 250.0, seed = 0 ):
+
+    '''
+    Historical discharge workbook as read by get_his_dis / prep_his_dis_dic: a header
+    area with the drainage area at iloc[9, 6], then one block per year with the year in
+    'Unnamed: 12', MEAN in 'Unnamed: 16', the month names two rows below, a units row
+    and 31 day rows (l/sec).
+
+    Parameters
+    ---------
+
+      filename
+        Output xlsx
+
+      years
+        Years of the blocks
+
+      drainage
+        Drainage area in sq kms
+
+      seed
+        Random seed
+    '''
+
+    rng   = np.random.default_rng( seed )
+    width = 18
+    rows  = []
+
+    def blank():
+        return [ None ] * width
+
+    for i in range( 12 ):
+        row = blank()
+        row[1] = f'Station information {i}'
+        if i == 9:
+            row[6] = drainage
+        rows.append( row )
+
+    for year in years:
+        row = blank(); row[12] = int( year ); row[16] = 'MEAN DAILY DISCHARGE'
+        rows.append( row )
+        rows.append( blank() )
+        row = blank(); row[2] = 'DAY'; row[3:15] = MONTHS
+        rows.append( row )
+        row = blank(); row[2] = 'l/sec'
+        rows.append( row )
+
+        n_days = pd.date_range( f'{year}-01-01', periods = 12, freq = 'MS' ).days_in_month
+        values = rng.gamma( 2, 500, ( 31, 12 ) )
+        values[rng.random( ( 31, 12 ) ) < 0.02] = np.nan
+        for d in range( 31 ):
+            row = blank(); row[2] = d + 1
+            for m in range( 12 ):
+                if d < n_days[m]:
+                    row[3 + m] = values[d, m]
+            rows.append( row )
+        rows.append( blank() )
+
+    header = blank(); header[0] = 'REPUBLIC OF THE PHILIPPINES'
+    pd.DataFrame( rows, columns = header ).to_excel( filename, index = False )
+
+def write_rain_grid( filename, stations, start, end, seed = 0 ):
+
+    '''
+    Daily rainfall csv as read by prep_rain_data (1901_1940Rainfall.csv layout): year,
+    month and day columns named 'Unnamed: 0', 'Unnamed: 1' and 'name', two metadata
+    rows, and one column per station with '?' and -999 sentinels.
+
+    Parameters
+    ---------
+
+      filename
+        Output csv
+
+      stations
+        Station names
+
+      start, end
+        First and last day
+
+      seed
+        Random seed
+    '''
+
+    rng  = np.random.default_rng( seed )
+    days = pd.date_range( start, end, freq = 'D' )
+
+    data = { 'Unnamed: 0': [ 'lat', 'lon' ] + list( days.year ),
+             'Unnamed: 1': [ '', '' ] + list( days.month ),
+             'name'      : [ '', '' ] + list( days.day ) }
+
+    for station in stations:
+        values = rng.gamma( 0.5, 8, len( days ) ).round( 1 ).astype( object )
+        values[rng.random( len( days ) ) < 0.02] = '?'
+        values[rng.random( len( days ) ) < 0.01] = -999
+        data[station] = [ round( rng.uniform( 5, 19 ), 2 ), round( rng.uniform( 117, 127 ), 2 ) ] + list( values )
+
+    pd.DataFrame( data ).to_csv( filename, index = False )
+
+def write_index( filename, start = '1854-01-01', end = '2021-07-01', seed = 0 ):
+
+    'Monthly index csv as read by prep_index_data (two columns: year and anomaly)'
+
+    rng    = np.random.default_rng( seed )
+    months = pd.date_range( start, end, freq = 'MS' )
+    anom   = np.convolve( rng.normal( 0, 0.6, len( months ) + 11 ), np.ones( 12 ) / 4, mode = 'valid' )
+
+    pd.DataFrame( { 'Year': np.round( months.year + ( months.month - 0.5 ) / 12, 3 ),
+                    'ANOM': anom.round( 3 ) } ).to_csv( filename, index = False )
+
+def write_criteria( filename, label, stations, seed = 0 ):
+
+    'Criteria table (CriteriaTableDis_HESS.csv layout) assigning stations to Climate Types 1-4 and CPE 1-3'
+
+    rng = np.random.default_rng( seed )
+
+    pd.DataFrame( { label         : stations,
+                    'Climate Type': rng.integers( 1, 5, len( stations ) ),
+                    'CPE'         : rng.integers( 1, 4, len( stations ) ) } ).to_csv( filename, index = False )
+
+def write_dataset( folder, n_rain = 6, n_rivers = 6, n_hist = 3, rain_years = 10, hist_years = 20, seed = 0 ):
+
+    '''
+    Write a complete synthetic input tree in the layout ENSO.ipynb expects.
+
+    Parameters
+    ---------
+
+      folder
+        Output folder. Gets Modern/, HESS/, Historical/Historical/ and Data/Files/.
+
+      n_rain
+        Number of rainfall stations (Modern workbooks and columns of each rainfall csv)
+
+      n_rivers
+        Number of HESS rivers
+
+      n_hist
+        Number of historical discharge workbooks. The first half share a river with HESS.
+
+      rain_years
+        Years of daily data per Modern workbook
+
+      hist_years
+        Number of year blocks per historical workbook
+
+      seed
+        Random seed
+
+    Returns
+    --------
+
+      Dictionary with the folders and file names written
+    '''
+
+    paths = { 'modern'    : os.path.join( folder, 'Modern' ),
+              'hess'      : os.path.join( folder, 'HESS' ),
+              'historical': os.path.join( folder, 'Historical' ),
+              'files'     : os.path.join( folder, 'Data', 'Files' ) }
+    for key in [ 'modern', 'hess', 'files' ]:
+        os.makedirs( paths[key], exist_ok = True )
+    os.makedirs( os.path.join( paths['historical'], 'Historical' ), exist_ok = True )
+
+    rain   = station_names( 'rain', n_rain )
+    rivers = station_names( 'river', n_rivers )
+    hist   = rivers[:n_hist // 2] + station_names( 'archive', n_hist - n_hist // 2 )
+
+    for i, name in enumerate( rain ):
+        write_mod_rain( os.path.join( paths['modern'], f'{name}.xlsx' ), f'{2020 - rain_years}-01-01', '2019-12-31',
+                        seed + i, stray = i == 0 )
+    for i, name in enumerate( rivers ):
+        write_hess( os.path.join( paths['hess'], f'{name}.xlsx' ), name, '1950-01-01', 12 * 60, seed + i )
+    for i, name in enumerate( hist ):
+        write_his_sheet( os.path.join( paths['historical'], 'Historical', f'{name}.xlsx' ),
+                         range( 1908, 1908 + hist_years ), seed = seed + i )
+
+    paths['hist_csv']  = os.path.join( paths['files'], '1901_1940Rainfall.csv' )
+    paths['mid_csv']   = os.path.join( paths['files'], 'Rainfall1951_1990.csv' )
+    paths['index']     = os.path.join( paths['files'], 'nino3.4a_rel.csv' )
+    paths['crit_dis']  = os.path.join( paths['files'], 'CriteriaTableDis_HESS.csv' )
+    paths['crit_rain'] = os.path.join( paths['files'], 'CriteriaTableRain_HESS.csv' )
+
+    write_rain_grid( paths['hist_csv'], rain, '1901-01-01', '1940-12-31', seed )
+    write_rain_grid( paths['mid_csv'], rain, '1951-01-01', '1990-12-31', seed + 1 )
+    write_index( paths['index'], seed = seed )
+
+    dis_columns = [ f'hess_{r}' for r in rivers[n_hist // 2:] ] + rivers[:n_hist // 2] + \
+                  [ f'historical_{h}' for h in hist[n_hist // 2:] ]
+    write_criteria( paths['crit_dis'], 'River Name', dis_columns, seed )
+    write_criteria( paths['crit_rain'], 'Station Name', rain, seed + 1 )
+
+    paths['rain']   = rain
+    paths['rivers'] = rivers
+    paths['hist']   = hist
+
+    return paths
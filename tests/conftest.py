@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# the modules are imported as the notebook does, from the repository root
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+if ROOT not in sys.path:
+    sys.path.insert( 0, ROOT )
+
+os.environ.setdefault( 'MPLBACKEND', 'Agg' )
+
+
+@pytest.fixture( scope = 'session' )
+def dataset( tmp_path_factory ):
+
+    'Small synthetic input tree in the notebook layout (see benchmarks/synthetic.py)'
+
+    from benchmarks.synthetic import write_dataset
+
+    return write_dataset( str( tmp_path_factory.mktemp( 'data' ) ), n_rain = 4, n_rivers = 3, n_hist = 2,
+                          rain_years = 6, hist_years = 20, seed = 1 )
+
+@pytest.fixture( scope = 'session' )
+def stage_args( dataset ):
+
+    'enso_stages arguments of the synthetic tree'
+
+    return { 'files_folder'     : dataset['files'],
+             'modern_folder'    : dataset['modern'],
+             'hess_folder'      : dataset['hess'],
+             'historical_folder': dataset['historical'],
+             'hist_rename'      : { name: f'mod_hist_{name}' for name in dataset['rain'] } }
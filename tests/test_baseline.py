@@ -0,0 +1,162 @@
+'''
+The vectorised loaders and cleaning against the loop implementations they replaced
+(the original ENSO.ipynb code, kept here verbatim apart from prints and plots).
+'''
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Code.prepare_data import prep_index_data, prep_rain_data, prep_mod_dis_data, load_his_dis_data, \
+                              load_his_dis_monthly, prep_his_dis_data, prep_his_dis_monthly, hist_daily_long, \
+                              merge_dis_data
+from Code.clean_data   import clean_data, clean_data_groups
+
+
+def baseline_prep_rain_data( filename, labelname ):
+
+    df_p      = pd.read_csv( filename )
+
+    df_p      = df_p.iloc[2:].reset_index() \
+                             .drop( columns='index' ) \
+                             .rename(columns = {'Unnamed: 0':'year','Unnamed: 1':'month', 'name':'day'} ) \
+                             .replace('?',-999) \
+                             .replace(0.0,np.nan) \
+                             .astype(float)
+
+    df_p.replace(-999, np.nan, inplace=True)
+    df_p.columns = [ f"{labelname}_{label.lower()}" for label in df_p.columns  ]
+
+    df_p['Date'] = df_p.apply(lambda x: datetime.datetime( int(x[f'{labelname}_year']), int(x[f'{labelname}_month']),
+                                           int(x[f'{labelname}_day'])), axis = 1 )
+
+    df_2= df_p.resample('MS', on='Date').sum().reset_index()
+    df_2.replace(0.0, np.nan, inplace = True)
+
+    return df_2, df_2.columns
+
+def baseline_prep_his_dis_data( dict_hist ):
+
+    dict_final = {}
+
+    for k,v in dict_hist.items():
+
+        dict_final[k] = []
+
+        for year,df_daily in v['data'].items():
+            df_discharge = df_daily.copy()
+            df_discharge = ( (( ( df_discharge.mean()/ v['drainage'] ) * 0.0864 * 30)).to_frame() )
+            df_discharge = df_discharge.iloc[2: , :]
+            df_discharge.columns = [k]
+            df_discharge.index.names = ['Year']
+            df_discharge.reset_index(inplace=True)
+            look_up = {'JAN':1, 'FEB':2,  'MAR':3, 'APR':4,'MAY':5,
+                       'JUN':6, 'JUL':7, 'AUG':8 , 'SEPT':9,'OCT':10, 'NOV':11, 'DEC':12}
+            df_discharge['Year'] = df_discharge['Year'].map(lambda x: look_up[x])
+            df_discharge['Year'] = df_discharge['Year'].map(lambda x: datetime.datetime(year,x,1))
+            dict_final[k].append( df_discharge )
+
+        dict_final[k] = pd.concat(dict_final[k]).reset_index(drop=True)
+
+    return dict_final
+
+def baseline_clean_data( df, crit_data, crit_label, crit_name, crit_number, date_name, index_qc ):
+
+    from sklearn.linear_model import LinearRegression
+    from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+    temp_df = df
+    df_select  = crit_data[(crit_data[crit_name] == crit_number) ]
+    df_name    = list(df_select[crit_label])
+
+    df_mean         = pd.DataFrame( temp_df[df_name].mean(axis=1) )
+    df_mean.columns = ['data_mean']
+    df_mean['date'] = temp_df[date_name]
+    df_mean = df_mean.dropna().reset_index( drop=True )
+
+    df_mean['data_log']    = pd.DataFrame( (np.log10(df_mean['data_mean'])) )
+
+    scaler = StandardScaler()
+    df_mean['data_scaled']      = scaler.fit_transform( df_mean['data_log'].values.reshape(-1,1) )
+
+    X = [i for i in range( 0, len(df_mean['data_log']) ) ]
+    X = np.reshape( X, (len(X), 1) )
+    y = df_mean['data_scaled'].values
+    pf = PolynomialFeatures(degree=3)
+    Xp = pf.fit_transform(X)
+
+    md2 = LinearRegression()
+    md2.fit(Xp, y)
+    trendp = md2.predict(Xp)
+
+    df_mean['data_detrend_P'] = [y[i] - trendp[i] for i in range(0, len(df_mean['data_log']) )]
+
+    df_mean['data_deseason'] = df_mean['data_detrend_P'].rolling(window=6, center=True).mean()[3:-3]
+    df_mean['data_deseason12'] = df_mean['data_detrend_P'].rolling(window=12, center=True).mean()[6:-6]
+
+    df_final = df_mean.merge(index_qc, how = 'outer', on = 'date', validate = '1:1' )
+    df_final = df_final.sort_values( 'date' ).reset_index(drop=True)
+    df_final = df_final.dropna().reset_index(drop=True)
+    df_final['month'] = df_final['date'].dt.month
+
+    return df_final
+
+def test_prep_rain_data( dataset ):
+
+    for filename, label in [ ( dataset['hist_csv'], 'hist' ), ( dataset['mid_csv'], 'mid' ) ]:
+        df, columns      = prep_rain_data( filename, label )
+        ref, ref_columns = baseline_prep_rain_data( filename, label )
+
+        assert list( columns ) == list( ref_columns )
+        pd.testing.assert_frame_equal( df, ref, check_dtype = False )
+
+def test_prep_his_dis_data( dataset ):
+
+    dict_hist = load_his_dis_data( dataset['historical'] )
+    ref       = baseline_prep_his_dis_data( dict_hist )
+
+    # from the long tables read with the workbooks, from the yearly tables and straight from the files
+    yearly = { k: { 'data': v['data'], 'drainage': v['drainage'] } for k, v in dict_hist.items() }
+    for result in [ prep_his_dis_data( dict_hist ), prep_his_dis_data( yearly ),
+                    load_his_dis_monthly( dataset['historical'] ) ]:
+        assert list( result ) == list( ref )
+        for k in ref:
+            pd.testing.assert_frame_equal( result[k], ref[k], check_dtype = False )
+
+def test_prep_his_dis_monthly_actual_month_days( dataset ):
+
+    dict_hist = load_his_dis_data( dataset['historical'] )
+    drainage  = { k: v['drainage'] for k, v in dict_hist.items() }
+    monthly   = prep_his_dis_monthly( hist_daily_long( dict_hist ), drainage )
+    actual    = prep_his_dis_monthly( hist_daily_long( dict_hist ), drainage, month_days = None )
+
+    np.testing.assert_allclose( actual['discharge'], monthly['discharge'] * actual['days'] / 30 )
+
+@pytest.fixture( scope = 'module' )
+def discharge( dataset ):
+
+    df_hess, _ = prep_mod_dis_data( dataset['hess'] )
+    hist_dis   = load_his_dis_monthly( dataset['historical'] )
+
+    return { 'df'      : merge_dis_data( df_hess, hist_dis, [] ),
+             'crit'    : pd.read_csv( dataset['crit_dis'] ),
+             'index_qc': prep_index_data( dataset['files'], 'nino3.4a_rel', 'nino3.4a_rel' ) }
+
+def test_clean_data( discharge ):
+
+    pytest.importorskip( 'sklearn' )
+
+    df, crit, index_qc = discharge['df'], discharge['crit'], discharge['index_qc']
+    groups = sorted( crit['Climate Type'].unique() )
+    every  = clean_data_groups( df, crit, 'River Name', 'Climate Type', 'Year', index_qc )
+
+    for c in groups:
+        ref    = baseline_clean_data( df, crit, 'River Name', 'Climate Type', c, 'Year', index_qc )
+        result = clean_data( df, crit, 'River Name', 'Climate Type', c, 'Year', index_qc, headless = True )
+
+        assert len( ref ) > 0
+
+        pd.testing.assert_frame_equal( result[ref.columns], ref, check_dtype = False, atol = 1e-9 )
+        pd.testing.assert_frame_equal( every[c][ref.columns], ref, check_dtype = False, atol = 1e-9 )
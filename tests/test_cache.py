@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+
+from Code import cache
+
+
+def test_warm_reads_hit_and_a_changed_file_misses( tmp_path ):
+
+    src = tmp_path / 'table.csv'
+    pd.DataFrame( { 'a': [ 1, 2, 3 ], 'b': [ 0.5, None, 2.5 ] } ).to_csv( src, index = False )
+    cache_dir = str( tmp_path / 'cache' )
+    cache.cache_report( reset = True )
+
+    cold = cache.cached_read_csv( str( src ), cache_dir )
+    warm = cache.cached_read_csv( str( src ), cache_dir )
+    pd.testing.assert_frame_equal( warm, cold )
+
+    pd.DataFrame( { 'a': [ 4 ], 'b': [ 1.0 ] } ).to_csv( src, index = False )
+    os.utime( src, ns = ( os.stat( src ).st_atime_ns, os.stat( src ).st_mtime_ns + 10 ** 9 ) )
+    changed = cache.cached_read_csv( str( src ), cache_dir )
+
+    assert changed['a'].tolist() == [ 4 ]
+    assert cache.cache_report( reset = True )['hit'].tolist() == [ False, True, False ]
+
+def test_reader_arguments_are_part_of_the_key( tmp_path ):
+
+    src = tmp_path / 'table.csv'
+    pd.DataFrame( { 'a': [ 1, 2 ], 'b': [ 3, 4 ] } ).to_csv( src, index = False )
+    cache_dir = str( tmp_path / 'cache' )
+
+    cache.cached_read_csv( str( src ), cache_dir )
+    only_b = cache.cached_read_csv( str( src ), cache_dir, usecols = [ 'b' ] )
+
+    assert list( only_b.columns ) == [ 'b' ]
+
+def test_timings_are_bounded():
+
+    cache.cache_report( reset = True )
+    for _ in range( cache.MAX_TIMINGS + 5 ):
+        cache._timings.append( { 'path': 'table.csv', 'hit': True, 'seconds': 1.0, 'parse_seconds': 1.0 } )
+
+    assert len( cache.cache_report( reset = True ) ) == cache.MAX_TIMINGS
+    assert len( cache._timings ) == 0
@@ -0,0 +1,68 @@
+import os
+import json
+
+import pandas as pd
+
+from Code import cli
+
+
+def write_config( folder, stage_args, **settings ):
+
+    config = { **stage_args,
+               'store_dir': os.path.join( folder, 'store' ),
+               'outputs'  : { 'rain'     : os.path.join( folder, 'out', 'output_rainfall.csv' ),
+                              'discharge': os.path.join( folder, 'out', 'output_discharge.csv' ) },
+               **settings }
+    filename = os.path.join( folder, 'config.json' )
+    with open( filename, 'w' ) as f:
+        json.dump( config, f )
+
+    return filename
+
+def test_status_stale_then_run_then_up_to_date( tmp_path, stage_args ):
+
+    config = write_config( str( tmp_path ), stage_args )
+
+    assert cli.main( [ 'status', config ] ) == cli.EXIT_STALE
+    assert cli.main( [ 'run', config ] ) == cli.EXIT_OK
+    assert cli.main( [ 'status', config ] ) == cli.EXIT_OK
+
+    out = tmp_path / 'out'
+    for name in [ 'output_rainfall', 'output_discharge' ]:
+        assert ( out / f'{name}.csv' ).exists()
+        clean = pd.read_csv( out / f'{name}_clean.csv' )
+        assert clean.columns[0] == 'date' and len( clean.columns ) > 1
+
+def test_targets_always_include_the_clean_stages():
+
+    targets = cli._targets( { 'outputs': { 'rain': 'output_rainfall.csv' } } )
+
+    assert targets == [ 'rain', 'clean_rain', 'clean_dis' ]
+    assert cli._targets( {} ) is None
+
+def test_config_errors( tmp_path, stage_args ):
+
+    assert cli.main( [ 'run', str( tmp_path / 'missing.json' ) ] ) == cli.EXIT_CONFIG
+    assert cli.main( [ 'unknown-command' ] ) == cli.EXIT_CONFIG
+
+    config = write_config( str( tmp_path ), stage_args, not_a_setting = 1 )
+    assert cli.main( [ 'run', config ] ) == cli.EXIT_CONFIG
+
+    config = write_config( str( tmp_path ), { **stage_args, 'hess_folder': str( tmp_path / 'no_such_folder' ) } )
+    assert cli.main( [ 'status', config ] ) == cli.EXIT_CONFIG
+
+def test_failed_export( tmp_path, stage_args ):
+
+    config = write_config( str( tmp_path ), stage_args,
+                           hist_daily = { 'filename': str( tmp_path / 'hist_daily.xlsx' ), 'mode': 'no_such_mode' } )
+
+    assert cli.main( [ 'run', config ] ) == cli.EXIT_FAILED
+
+def test_interrupt( tmp_path, stage_args, monkeypatch ):
+
+    def interrupted( *args, **kwargs ):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr( cli, 'run', interrupted )
+
+    assert cli.main( [ 'run', write_config( str( tmp_path ), stage_args ) ] ) == cli.EXIT_INTERRUPT
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from Code.coalesce import coalesce_sources, provenance, provenance_counts, station_name
+
+
+def sources():
+
+    dates = pd.date_range( '2000-01-01', periods = 4, freq = 'MS' )
+    mod   = pd.DataFrame( { 'Date': dates, 'mod_iloilo': [ 1.0, np.nan, 3.0, np.nan ], 'mod_baguio': [ 5.0, 6.0, np.nan, np.nan ] } )
+    hist  = pd.DataFrame( { 'Date': dates, 'hist_iloilo': [ 10.0, 20.0, 30.0, np.nan ], 'hist_Baguio_City': [ 50.0, 60.0, 70.0, 80.0 ] } )
+
+    return { 'mod': mod, 'hist': hist }
+
+def test_first_source_with_a_value_wins():
+
+    result = coalesce_sources( sources() )
+    merged = result['merged'].set_index( 'Date' )
+
+    assert result['stations'] == [ 'iloilo', 'baguio' ]
+    assert merged['iloilo'].tolist()[:3] == [ 1.0, 20.0, 3.0 ] and np.isnan( merged['iloilo'].iat[3] )
+    assert merged['baguio'].tolist() == [ 5.0, 6.0, 70.0, 80.0 ]
+
+    prov = provenance( result )
+    assert prov['iloilo'].astype( object ).tolist()[:3] == [ 'mod', 'hist', 'mod' ] and pd.isna( prov['iloilo'].iat[3] )
+    assert provenance_counts( result ).loc['baguio'].tolist() == [ 2, 2 ]
+    assert result['single'] == []
+
+def test_precedence_overrides_and_drops_sources():
+
+    result = coalesce_sources( sources(), precedence = { 'iloilo': [ 'hist' ], 'baguio': [ 'hist', 'mod' ] } )
+    merged = result['merged'].set_index( 'Date' )
+
+    assert merged['iloilo'].tolist()[:3] == [ 10.0, 20.0, 30.0 ]
+    assert merged['baguio'].tolist() == [ 50.0, 60.0, 70.0, 80.0 ]
+
+def test_station_names_and_aliases():
+
+    assert station_name( 'historical_Mambusao_River', 'historical_' ) == 'mambusao'
+    assert station_name( 'hess_cotobato', 'hess_', { 'cotobato': 'cotabato' } ) == 'cotabato'
+
+    one = { 'hess': pd.DataFrame( { 'Year': pd.date_range( '2000-01-01', periods = 2, freq = 'MS' ), 'hess_x': [ 1.0, 2.0 ] } ),
+            'historical': pd.DataFrame( { 'Year': pd.date_range( '2000-01-01', periods = 2, freq = 'MS' ), 'historical_y': [ 3.0, 4.0 ] } ) }
+    assert coalesce_sources( one, date_name = 'Year' )['single'] == [ 'x', 'y' ]
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from scipy.stats import pearsonr
+
+from Code.enso import pearson_columns, lagged_pearson
+
+
+def with_gaps( rng, shape, fraction = 0.2 ):
+
+    x = rng.normal( size = shape )
+    x[rng.random( shape ) < fraction] = np.nan
+
+    return x
+
+def test_pearson_columns_matches_scipy_with_gaps():
+
+    rng  = np.random.default_rng( 0 )
+    x, Y = with_gaps( rng, ( 200, 4 ) ), with_gaps( rng, ( 200, 3 ) )
+    Y[:, 0] += x[:, 0]
+
+    r, n = pearson_columns( x, Y )
+
+    for i in range( x.shape[1] ):
+        for j in range( Y.shape[1] ):
+            both = ~np.isnan( x[:, i] ) & ~np.isnan( Y[:, j] )
+            assert n[i, j] == both.sum()
+            assert r[i, j] == pytest.approx( pearsonr( x[both, i], Y[both, j] )[0], abs = 1e-12 )
+
+def test_lagged_pearson_matches_scipy_with_gaps():
+
+    rng  = np.random.default_rng( 1 )
+    y    = with_gaps( rng, 300 )
+    x    = with_gaps( rng, ( 300, 2 ) )
+    x[5:, 1] += 2 * y[:-5]
+    lags = [ -3, 0, 5, 12 ]
+
+    r, n = lagged_pearson( x, y, lags )
+
+    for j, lag in enumerate( lags ):
+        shifted = np.full( len( y ), np.nan )
+        if lag >= 0:
+            shifted[lag:] = y[:len( y ) - lag]
+        else:
+            shifted[:lag] = y[-lag:]
+        for i in range( x.shape[1] ):
+            both = ~np.isnan( x[:, i] ) & ~np.isnan( shifted )
+            assert n[i, j] == both.sum()
+            assert r[i, j] == pytest.approx( pearsonr( x[both, i], shifted[both] )[0], abs = 1e-12 )
+
+def test_constant_series_has_no_correlation():
+
+    x = np.ones( ( 50, 1 ) )
+    r, n = pearson_columns( x, np.arange( 50.0 )[:, None] )
+
+    assert np.isnan( r[0, 0] ) and n[0, 0] == 50
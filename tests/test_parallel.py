@@ -0,0 +1,25 @@
+import pytest
+
+from Code.parallel import map_files, n_workers
+
+
+FILES = [ 'c.xlsx', 'a.xlsx', 'e.xlsx', 'b.xlsx', 'd.xlsx' ]
+
+
+@pytest.mark.parametrize( 'backend', [ 'process', 'thread' ] )
+@pytest.mark.parametrize( 'n_jobs', [ 1, 2, 3, 8, None, -1 ] )
+def test_results_in_sorted_file_order( backend, n_jobs ):
+
+    assert map_files( str.upper, FILES, n_jobs, backend ) == [ f.upper() for f in sorted( FILES ) ]
+
+def test_invalid_backend_raises_on_every_path():
+
+    for n_jobs in [ 1, 2 ]:
+        with pytest.raises( ValueError ):
+            map_files( str.upper, FILES, n_jobs, 'prcess' )
+
+def test_n_workers():
+
+    assert n_workers( 1 ) == 1
+    assert n_workers( 0 ) == 1
+    assert n_workers( None ) == n_workers( -1 ) >= 1
@@ -0,0 +1,63 @@
+import pandas as pd
+
+from Code.pipeline import stage, run_pipeline, stale_stages, stage_keys
+
+
+def numbers( folder, n ):
+
+    return pd.DataFrame( { 'x': range( n ) } )
+
+def doubled( df, factor ):
+
+    return df * factor
+
+def total( df ):
+
+    return float( df['x'].sum() )
+
+def stages( tmp_path, n = 5, factor = 2 ):
+
+    return { 'numbers': stage( numbers, params = { 'n': n }, files = [ str( tmp_path / 'inputs' ) ],
+                               options = { 'folder': str( tmp_path / 'inputs' ) } ),
+             'doubled': stage( doubled, inputs = [ 'numbers' ], params = { 'factor': factor } ),
+             'total'  : stage( total, inputs = [ 'doubled' ] ) }
+
+def test_only_stages_downstream_of_a_change_are_stale( tmp_path ):
+
+    ( tmp_path / 'inputs' ).mkdir()
+    store = str( tmp_path / 'store' )
+
+    assert stale_stages( stages( tmp_path ), store ) == [ 'numbers', 'doubled', 'total' ]
+    assert run_pipeline( stages( tmp_path ), [ 'total' ], store ) == { 'total': 20.0 }
+    assert stale_stages( stages( tmp_path ), store ) == []
+
+    assert stale_stages( stages( tmp_path, factor = 3 ), store ) == [ 'doubled', 'total' ]
+    assert run_pipeline( stages( tmp_path, factor = 3 ), [ 'total' ], store ) == { 'total': 30.0 }
+
+    ( tmp_path / 'inputs' / 'new.csv' ).write_text( 'x\n1\n' )
+    assert stale_stages( stages( tmp_path, factor = 3 ), store ) == [ 'numbers', 'doubled', 'total' ]
+
+def test_options_do_not_change_the_keys( tmp_path ):
+
+    a = stages( tmp_path )
+    b = stages( tmp_path )
+    b['numbers']['options'] = { 'folder': 'elsewhere' }
+
+    assert stage_keys( a ) == stage_keys( b )
+
+def test_stored_outputs_are_reused( tmp_path ):
+
+    ( tmp_path / 'inputs' ).mkdir()
+    store = str( tmp_path / 'store' )
+    calls = []
+
+    def counted( df ):
+        calls.append( 1 )
+        return total( df )
+
+    pipeline = { **stages( tmp_path ), 'total': stage( counted, inputs = [ 'doubled' ] ) }
+    run_pipeline( pipeline, [ 'total' ], store )
+    run_pipeline( pipeline, [ 'total' ], store )
+    run_pipeline( pipeline, [ 'total' ], store, force = [ 'total' ] )
+
+    assert len( calls ) == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from Code import qc
+
+
+def test_value_flags():
+
+    values = np.array( [ [ 1.0 ], [ 99.99 ], [ np.nan ], [ -2.0 ], [ 3.0 ], [ 3.0 ], [ 3.0 ], [ 0.5 ], [ 400.0 ] ] )
+    x, flags = qc.qc_flags( values, sentinels = ( 99.99, ), valid_range = ( 0, 500 ), min_run = 3, outlier_z = 5 )
+
+    assert flags[:, 0].tolist() == [ 0, qc.SENTINEL, qc.MISSING, qc.RANGE, qc.FLATLINE, qc.FLATLINE, qc.FLATLINE, 0,
+                                     qc.OUTLIER ]
+    assert np.isnan( qc.apply_flags( x, flags ) ).sum() == 7
+
+def test_dry_runs_and_text_values():
+
+    x, flags = qc.qc_flags( pd.DataFrame( { 'p': [ 0, 0, 0, 0, '?', 1.5 ] } ), min_run = 2 )
+
+    assert flags[:, 0].tolist() == [ 0, 0, 0, 0, qc.MISSING, 0 ]
+
+def test_monthly_totals_keep_dry_and_missing_months_apart():
+
+    dates  = pd.to_datetime( [ '2000-01-01', '2000-01-02', '2000-03-01', '2000-04-01', '2000-04-02' ] )
+    values = np.array( [ 1.0, 2.0, 0.0, 5.0, np.nan ] )
+    _, flags = qc.qc_flags( values )
+
+    months = qc.monthly_totals( values, dates, flags, min_days = 2 )
+
+    assert months['months'].strftime( '%Y-%m' ).tolist() == [ '2000-01', '2000-02', '2000-03', '2000-04' ]
+    assert months['sums'][:, 0].tolist() == [ 3.0, 0.0, 0.0, 5.0 ]
+    assert months['days'][:, 0].tolist() == [ 2, 0, 1, 1 ]
+    assert months['flags'][1, 0] & qc.NO_DATA
+    assert months['flags'][2, 0] & qc.DRY
+    assert months['flags'][3, 0] & qc.FEW_DAYS and months['flags'][3, 0] & qc.MISSING
+    assert not months['flags'][0, 0]
+
+def test_flag_counts():
+
+    _, flags = qc.qc_flags( np.array( [ [ np.nan, 1.0 ], [ 99.99, 2.0 ] ] ), sentinels = ( 99.99, ) )
+    counts   = qc.flag_counts( flags, [ 'a', 'b' ] )
+
+    assert counts.loc['a', 'missing'] == 1 and counts.loc['a', 'sentinel'] == 1 and counts.loc['b'].sum() == 0
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from Code.enso         import INDEX_COLUMN
+from Code.significance import bootstrap_correlation
+
+
+def tables( n = 240, seed = 0 ):
+
+    rng   = np.random.default_rng( seed )
+    dates = pd.date_range( '1950-01-01', periods = n, freq = 'MS' )
+    y     = np.convolve( rng.normal( size = n + 11 ), np.ones( 12 ) / 12, 'valid' )
+    df    = pd.DataFrame( { 'date': dates, 'linked': y + 0.05 * rng.normal( size = n ), 'noise': rng.normal( size = n ) } )
+
+    return df, pd.DataFrame( { 'date': dates, INDEX_COLUMN: y } )
+
+def test_seeded_results_do_not_depend_on_the_workers():
+
+    df, index_qc = tables()
+    args = dict( lags = [ 0, 6 ], n_resamples = 300, block = 24, chunk = 100, seed = 7 )
+
+    serial   = bootstrap_correlation( df, index_qc, **args )
+    threads  = bootstrap_correlation( df, index_qc, n_jobs = 3, backend = 'thread', **args )
+    reseeded = bootstrap_correlation( df, index_qc, **{ **args, 'seed': 8 } )
+
+    pd.testing.assert_frame_equal( serial, threads )
+    assert not np.allclose( serial['p_value'], reseeded['p_value'] )
+
+def test_linked_station_is_significant():
+
+    df, index_qc = tables()
+    out = bootstrap_correlation( df, index_qc, lags = [ 0 ], n_resamples = 300, chunk = 100 ).set_index( 'station' )
+
+    assert out.loc['linked', 'r'] > 0.9
+    assert out.loc['linked', 'p_value'] < 0.05
+    assert out.loc['linked', 'ci_low'] <= out.loc['linked', 'r'] <= out.loc['linked', 'ci_high']
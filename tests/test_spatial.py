@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Code.spatial import haversine_km, station_index, nearest, within, pair_stations, pair_correlation
+
+
+def coords( n, seed ):
+
+    rng = np.random.default_rng( seed )
+
+    return pd.DataFrame( { 'name': [ f's{seed}_{i}' for i in range( n ) ],
+                           'lat' : rng.uniform( 5, 19, n ),
+                           'lon' : rng.uniform( 117, 127, n ) } )
+
+def test_haversine_known_distance():
+
+    # one degree of latitude
+    assert haversine_km( 0, 0, 1, 0 ) == pytest.approx( 111.19, abs = 0.01 )
+
+def test_queries_match_brute_force():
+
+    points = coords( 60, 0 )
+    index  = station_index( points )
+    d      = haversine_km( 12.0, 122.0, points['lat'], points['lon'] )
+
+    near = nearest( index, 12.0, 122.0, k = 5 )
+    assert near['name'].tolist() == points['name'].to_numpy()[np.argsort( d )[:5]].tolist()
+    np.testing.assert_allclose( near['distance_km'], np.sort( d )[:5] )
+
+    inside = within( index, 12.0, 122.0, 200 )
+    assert sorted( inside['name'] ) == sorted( points['name'][d <= 200] )
+
+def test_pairs_match_brute_force():
+
+    rain, rivers = coords( 30, 1 ), coords( 20, 2 )
+    pairs = pair_stations( station_index( rain ), station_index( rivers ), radius_km = 150 )
+
+    d = haversine_km( rain['lat'].to_numpy()[:, None], rain['lon'].to_numpy()[:, None],
+                      rivers['lat'].to_numpy()[None], rivers['lon'].to_numpy()[None] )
+    i, j = np.nonzero( d <= 150 )
+    assert set( zip( pairs['rain'], pairs['river'] ) ) == set( zip( rain['name'][i], rivers['name'][j] ) )
+
+def test_pair_correlation_of_cleaned_series():
+
+    rng   = np.random.default_rng( 3 )
+    dates = pd.date_range( '1950-01-01', periods = 300, freq = 'MS' )
+    base  = rng.normal( size = 300 )
+    rain  = pd.DataFrame( { 'Date': dates, 'a': np.exp( base + 0.3 * rng.normal( size = 300 ) ), 'b': np.exp( rng.normal( size = 300 ) ) } )
+    dis   = pd.DataFrame( { 'Year': dates, 'r': np.exp( base + 0.3 * rng.normal( size = 300 ) ) } )
+    pairs = pd.DataFrame( { 'rain': [ 'a', 'b', 'missing' ], 'river': [ 'r', 'r', 'r' ] } )
+
+    out = pair_correlation( pairs, rain, dis )
+
+    assert out['r'].iat[0] > 0.5 and abs( out['r'].iat[1] ) < 0.3
+    assert np.isnan( out['r'].iat[2] ) and out['n'].iat[2] == 0